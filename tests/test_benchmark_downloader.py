@@ -0,0 +1,55 @@
+import json
+from urllib.request import Request, urlopen
+
+from tools.benchmark_downloader import percentile, run_benchmark
+from tools.mock_wiz_server import MOCK_TOKEN, MockWizServer, SyntheticAccount
+
+
+def get_json(url, token=MOCK_TOKEN):
+    with urlopen(Request(url, headers={"X-Wiz-Token": token}), timeout=10) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def test_synthetic_account_is_deterministic_and_paginated():
+    account = SyntheticAccount(notes=7, images=2, attachments=1, categories=2, size_sigma=0.8, seed=3)
+    assert account.details == SyntheticAccount(notes=7, images=2, attachments=1, categories=2,
+                                               size_sigma=0.8, seed=3).details
+
+    with MockWizServer(account) as server:
+        base = server.base_url
+        assert get_json(f"{base}/ks/category/all/mock-kb")["result"] == ["/Folder0/", "/Folder1/"]
+        page = get_json(f"{base}/ks/note/list/category/mock-kb?category=/Folder0/&start=2&count=2")["result"]
+        assert [note["docGuid"] for note in page] == ["note-000004", "note-000006"]
+
+        name, size = account.details["note-000004"]["images"][0]
+        resources = get_json(f"{base}/ks/note/download/mock-kb/note-000004?downloadData=1")["result"]["resources"]
+        with urlopen(resources[0]["url"], timeout=10) as response:
+            assert response.read() == account.payload("note-000004", name, size)
+        assert len(account.payload("note-000004", name, size)) == size
+
+        stats = get_json(f"{base}/__stats")
+        assert stats["requests"] == 4
+        assert stats["bytes_sent"] > size
+
+
+def test_benchmark_reports_throughput_and_latency(tmp_path):
+    account = SyntheticAccount(notes=12, images=2, attachments=1, categories=3,
+                               note_size=2048, image_size=4096, attachment_size=8192,
+                               zip_ratio=0.25, lite_ratio=0.25)
+
+    report = run_benchmark(account=account, output_dir=str(tmp_path), rate=0, max_workers=4,
+                           convert_processes=0)
+
+    assert report["notes"] == report["succeeded"] == 12
+    assert report["images"] == 24
+    assert report["attachments"] == 12
+    assert report["bytes"] > account.total_bytes
+    assert report["notes_per_sec"] > 0 and report["bytes_per_sec"] > 0
+    assert 0 < report["latency_p50"] <= report["latency_p99"] <= report["latency_max"]
+    assert (tmp_path / "wiznote_download" / "Folder0" / "Note 0.md").exists()
+
+
+def test_percentile_uses_nearest_rank():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile(list(range(1, 101)), 99) == 99
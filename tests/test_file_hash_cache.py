@@ -0,0 +1,122 @@
+import os
+import random
+import time
+
+from tools import file_hash_cache
+from tools.file_hash_cache import FileHashCache
+from tools.vault_cleaner import VaultCleaner
+
+
+def age(path, seconds=60):
+    """把修改时间调到过去（刚修改的文件不会写入缓存）"""
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_cache_hits_until_size_mtime_or_inode_changes(tmp_path):
+    db = tmp_path / "cache" / "hashes.db"
+    target = tmp_path / "a.bin"
+    target.write_bytes(b"x" * 1000)
+    age(target)
+
+    cache = FileHashCache(db)
+    digest = cache.full_hash(target)
+    assert cache.partial_hash(target) == digest  # 小文件的头尾即全部内容
+    cache.close()
+
+    cache = FileHashCache(db)
+    assert cache.full_hash(target) == digest
+    assert cache.stats["hits"] == 1 and cache.stats["bytes_read"] == 0
+
+    target.write_bytes(b"y" * 1000)  # 大小不变，mtime 变化
+    age(target, 30)
+    assert cache.full_hash(target) != digest
+    replacement = tmp_path / "b.bin"
+    replacement.write_bytes(b"x" * 1000)
+    os.replace(replacement, target)  # inode 变化
+    age(target, 30)
+    assert cache.full_hash(target) == digest
+    assert cache.stats["misses"] == 2
+
+    fresh = tmp_path / "fresh.bin"
+    fresh.write_bytes(b"z")
+    cache.full_hash(fresh)
+    assert cache.stats["stored"] == 2  # 刚修改的文件只计算不缓存
+    assert cache.full_hash(tmp_path / "missing.bin") is None
+    assert cache.identical(target, tmp_path / "a.bin") and not cache.identical(target, fresh)
+    cache.close()
+
+
+def test_dedup_rerun_reads_nothing_from_unchanged_vault(tmp_path):
+    rng = random.Random(3)
+    big = rng.randbytes(file_hash_cache.PARTIAL_HASH_SIZE * 3)
+    for rel, data in {"attachments/a.pdf": big, "notes/a_files/a.pdf": big,
+                      "attachments/b.png": b"1" * 500, "notes/b.png": b"1" * 500}.items():
+        path = tmp_path / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        age(path)
+
+    first = VaultCleaner(str(tmp_path)).dedup()
+    assert first["dup_groups"] == 2 and first["bytes_read"] > len(big)
+    assert (tmp_path / file_hash_cache.HASH_CACHE_PATH).exists()
+
+    second = VaultCleaner(str(tmp_path)).dedup()
+    assert second["dup_groups"] == 2 and second["bytes_read"] == 0
+
+    other = tmp_path.parent / (tmp_path.name + "-nocache")
+    (other / "attachments").mkdir(parents=True)
+    VaultCleaner(str(other), hash_cache=False).dedup()
+    assert not (other / ".obsidian").exists()  # 关闭缓存时不在仓库中写文件
+
+
+def test_parallel_hashing_matches_serial_order_in_every_mode(tmp_path):
+    rng = random.Random(9)
+    blobs = [rng.randbytes(rng.randrange(1, 3 * file_hash_cache.PARTIAL_HASH_SIZE)) for _ in range(6)]
+    for i in range(40):
+        data = blobs[i % len(blobs)]
+        path = tmp_path / f"dir{i % 4}" / f"file{i}.png"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        age(path)
+    paths = sorted(tmp_path.rglob("*.png")) + [tmp_path / "missing.png"]
+
+    serial = FileHashCache().hash_many(paths, "full", workers=1)
+    assert serial[-1] is None and len(set(serial[:-1])) == len(blobs)
+    for mode in ("thread", "process"):
+        done = []
+        cache = FileHashCache()
+        assert cache.hash_many(paths, "full", workers=4, mode=mode, progress=lambda n, total: done.append(n)) == serial
+        assert done == list(range(1, len(paths) + 1))
+        assert cache.hash_many(paths, "full", workers=4, mode=mode) == serial
+        assert cache.stats["hits"] == len(paths) - 1  # 第二次全部命中
+
+    results = []
+    for workers, mode in ((1, "thread"), (8, "thread"), (3, "process")):
+        cleaner = VaultCleaner(str(tmp_path), hash_cache=False, hash_workers=workers, hash_mode=mode)
+        groups = cleaner._group_by_hash(paths)
+        results.append([(key, [str(p) for p in group]) for key, group in groups.items()])
+    assert results[0] == results[1] == results[2] and len(results[0]) == len(blobs)
+
+
+def test_smart_migrate_skips_resources_that_are_already_identical(tmp_path):
+    from tools.smart_migrate_to_obsidian import SmartNoteMigrator
+
+    source, vault = tmp_path / "wiz", tmp_path / "vault"
+    (source / "img").mkdir(parents=True)
+    (source / "img" / "a.png").write_bytes(b"png" * 1000)
+    (source / "img" / "spec.pdf").write_bytes(b"pdf" * 1000)
+    note = source / "note.md"
+    note.write_text("![图](img/a.png)\n[规格](img/spec.pdf)\n[[img/spec.pdf|规格书]]\n", encoding="utf-8")
+    vault.mkdir()
+
+    migrator = SmartNoteMigrator(source, vault, hash_workers=2)
+    target = vault / "02_Areas" / "note.md"
+    assert migrator.migrate_note(note, target)
+    assert (vault / "02_Areas" / "note_files" / "spec.pdf").read_bytes() == b"pdf" * 1000
+    assert migrator.results["unchanged_resources"] == 1  # 同一附件被引用两次，第二次不再复制
+
+    target.write_text("![图](missing.png)\n", encoding="utf-8")  # 目标笔记引用缺失，需要重新迁移
+    again = SmartNoteMigrator(source, vault, hash_workers=2)
+    assert again.migrate_note(note, target)
+    assert again.results["unchanged_resources"] == 3  # 图片、附件、WikiLink 附件内容相同，不再复制
@@ -0,0 +1,68 @@
+import difflib
+import itertools
+
+import pytest
+
+from tools.obsidian_health_check import ObsidianHealthChecker
+from tools.text_similarity import SimilarityScorer, run_benchmark, similar_pairs
+from tests.test_vault_cleaner import edit_block, make_text, write_note
+
+
+def test_bounds_never_reject_pairs_that_reach_the_threshold():
+    base = make_text(1, 600)
+    texts = [base, edit_block(base, 2, 0.1), edit_block(base, 3, 0.3), base[:400], base + make_text(4, 300),
+             make_text(5, 600), "", "abc", "abd"]
+    for method in ("ratio", "exact"):
+        scorer = SimilarityScorer(0.8, method)
+        for a, b in itertools.combinations(texts, 2):
+            expected = difflib.SequenceMatcher(None, a, b, autojunk=method == "ratio").ratio() if a and b else 0.0
+            assert (scorer.score(a, b) >= 0.8) == (expected >= 0.8)
+        assert scorer.stats["length"] + scorer.stats["quick"] > 0  # 上界确实排除了一部分
+
+    with pytest.raises(ValueError):
+        SimilarityScorer(0.8, "levenshtein")
+
+
+def test_dice_tracks_sequence_matcher_on_block_edits():
+    base = make_text(7, 1500)
+    for fraction in (0.05, 0.1, 0.2, 0.4):
+        edited = edit_block(base, 11, fraction)
+        exact = difflib.SequenceMatcher(None, base, edited, autojunk=False).ratio()
+        assert abs(SimilarityScorer(0.0, "dice").score(base, edited) - exact) < 0.02
+
+    pairs = [(base, edit_block(base, seed, 0.1)) for seed in range(5)] + [(base, make_text(20, 1500))]
+    report = run_benchmark(pairs, ["dice", "ratio"], 0.8)
+    assert report["dice"]["disagree"] == 0 and report["dice"]["pruned_mismatch"] == 0
+
+
+def test_similar_pairs_matches_brute_force_and_health_check(tmp_path):
+    base = make_text(30, 800)
+    texts = [base, make_text(31, 800), edit_block(base, 32, 0.05), base[:300], "", edit_block(base, 33, 0.5)]
+    scorer = SimilarityScorer(0.8)
+    brute = [(i, j) for i, j in itertools.combinations(range(len(texts)), 2)
+             if SimilarityScorer(0.8).score(texts[i], texts[j]) >= 0.8]
+    assert [(i, j) for i, j, _ in similar_pairs(texts, scorer)] == brute == [(0, 2)]
+
+    write_note(tmp_path, "a.md", "a", base)
+    write_note(tmp_path, "b.md", "b", make_text(31, 800))
+    write_note(tmp_path, "sub/c.md", "c", edit_block(base, 32, 0.05))
+    checker = ObsidianHealthChecker(str(tmp_path))
+    checker._check_similar_content(sorted(tmp_path.rglob("*.md")))
+    found = checker.results["duplicates"]["content"]
+    assert [(item["file1"], item["file2"]) for item in found] == [("a.md", "sub/c.md")]
+
+
+def test_health_check_defaults_to_ratio_and_dice_is_opt_in(tmp_path):
+    base = make_text(40)
+    blocks = [base[i:i + 300] for i in range(0, len(base), 300)]
+    write_note(tmp_path, "a.md", "a", base)
+    write_note(tmp_path, "b.md", "b", "".join(reversed(blocks)))  # 只调换段落顺序
+
+    def similar(**kwargs):
+        checker = ObsidianHealthChecker(str(tmp_path), **kwargs)
+        checker._check_similar_content(sorted(tmp_path.rglob("*.md")))
+        return checker.results["duplicates"]["content"]
+
+    # 默认与 vault_cleaner 一致使用 ratio：段落调换不算相似；选择 dice 时才会报告
+    assert similar() == []
+    assert len(similar(similarity="dice")) == 1
@@ -0,0 +1,155 @@
+import random
+
+from tools import vault_cleaner
+from tools.vault_cleaner import MinHashLSH, VaultCleaner
+
+def make_text(seed, length=1200):
+    """随机中文文本（取自常用汉字区，字符分布足够分散）"""
+    rng = random.Random(seed)
+    return "".join(chr(rng.randrange(0x4E00, 0x6000)) if rng.random() > 0.08 else "，"
+                   for _ in range(length))
+
+
+def edit_block(text, seed, fraction):
+    rng = random.Random(seed)
+    n = int(len(text) * fraction)
+    start = rng.randrange(len(text) - n)
+    return text[:start] + make_text(seed + 1000, n) + text[start + n:]
+
+
+def write_note(root, rel, title, body):
+    path = root / rel
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f"---\ntitle: {title}\n---\n\n{body}\n", encoding="utf-8")
+    return path
+
+
+def test_lsh_bands_follow_threshold_and_find_similar_texts():
+    index = MinHashLSH(0.5)
+    assert index.bands * index.rows <= index.num_perm
+    # 在阈值处成为候选的概率接近一半，远低于阈值时几乎为 0
+    assert 0.3 < 1 - (1 - 0.5 ** index.rows) ** index.bands < 0.9
+    assert 1 - (1 - 0.1 ** index.rows) ** index.bands < 0.01
+
+    base = make_text(1)
+    texts = [base, edit_block(base, 2, 0.1)] + [make_text(seed) for seed in range(10, 40)]
+    for i, text in enumerate(texts):
+        index.add(i, text)
+    assert not index.add("empty", "")
+    pairs = index.candidate_pairs()
+    assert (0, 1) in pairs
+    assert len(pairs) < 10  # 互不相关的笔记很少成为候选
+    assert index.signature(base) == MinHashLSH(0.5).signature(base)  # 签名在不同运行间一致
+
+
+def test_fuzzy_finds_renamed_near_duplicates_without_quadratic_title_groups(tmp_path, monkeypatch):
+    base = make_text(1)
+    write_note(tmp_path, "项目/周报.md", "周报", base)
+    write_note(tmp_path, "临时草稿/周报 副本 2024.md", "周报 副本 2024", edit_block(base, 3, 0.05))
+    write_note(tmp_path, "项目/无关.md", "无关", make_text(2))
+    # 大量同名但内容不同的笔记，以及同名的短内容占位笔记
+    for i in range(60):
+        write_note(tmp_path, f"导入/{i}/无标题.md", "无标题", make_text(100 + i))
+    for i in range(30):
+        write_note(tmp_path, f"空白/{i}/无标题.md", "无标题", "占位")
+
+    compared = []
+    original = vault_cleaner.SimilarityScorer.score
+
+    def counting_score(self, a, b):
+        compared.append(1)
+        return original(self, a, b)
+
+    monkeypatch.setattr(vault_cleaner.SimilarityScorer, "score", counting_score)
+    # 标题不同的近似笔记默认只报告
+    result = VaultCleaner(str(tmp_path)).fuzzy(threshold=0.8)
+    assert result["report_only"] == 1
+    assert not any(path.startswith("临时草稿/") for path in result["removed_paths"])
+
+    compared.clear()
+    result = VaultCleaner(str(tmp_path)).fuzzy(threshold=0.8, cross_title=True)
+    removed = set(result["removed_paths"])
+    assert "临时草稿/周报 副本 2024.md" in removed
+    assert "项目/周报.md" not in removed and "项目/无关.md" not in removed
+    assert sum(1 for path in removed if path.startswith("空白/")) == 29
+    assert not any(path.startswith("导入/") for path in removed)
+    assert len(compared) < 100  # 不再对 90 篇同名笔记两两比对（4005 次）
+    assert (tmp_path / "临时草稿/周报 副本 2024.md").exists()  # 预览模式不删除
+
+
+def test_jaccard_threshold_mapping_is_clamped():
+    assert MinHashLSH.jaccard_threshold(1.0) == vault_cleaner.LSH_THRESHOLD_SLACK
+    assert MinHashLSH.jaccard_threshold(0.05) == vault_cleaner.LSH_MIN_JACCARD
+    assert MinHashLSH.jaccard_threshold(0.8) < 0.8
+
+
+def test_dedup_reads_only_size_collisions_and_confirms_with_full_hash(tmp_path):
+    rng = random.Random(5)
+    big = rng.randbytes(vault_cleaner.PARTIAL_HASH_SIZE * 5)
+    middle_changed = bytearray(big)
+    middle_changed[len(big) // 2] ^= 0xFF  # 头尾相同、中间不同：只有完整哈希能区分
+    small = rng.randbytes(3000)
+    files = {
+        "attachments/video.mp4": big,
+        "笔记/a_files/video.mp4": big,
+        "笔记/b_files/video.mp4": bytes(middle_changed),
+        "attachments/doc.pdf": small,
+        "笔记/a_files/doc.pdf": small,
+        "笔记/a_files/other.pdf": rng.randbytes(3000),
+        "attachments/empty.txt": b"",
+        "笔记/empty.txt": b"",
+    }
+    for i in range(20):
+        files[f"attachments/unique_{i}.png"] = rng.randbytes(10000 + i)  # 大小唯一，不应被读取
+    for rel, data in files.items():
+        path = tmp_path / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    cleaner = VaultCleaner(str(tmp_path))
+    result = cleaner.dedup()
+
+    assert result["dup_groups"] == 3
+    assert sorted(result["removed_paths"]) == ["笔记/a_files/doc.pdf", "笔记/a_files/video.mp4", "笔记/empty.txt"]
+    stats = cleaner.hash_stats
+    assert stats["partial"] == 6 and stats["full"] == 3
+    # 头尾哈希：3 个大文件各 128 KB + 3 个小文件全部；完整哈希：3 个大文件
+    assert result["bytes_read"] == 3 * 2 * vault_cleaner.PARTIAL_HASH_SIZE + 3 * 3000 + 3 * len(big)
+    assert (tmp_path / "笔记/a_files/video.mp4").exists()  # 预览模式不删除
+
+
+def test_fuzzy_deletes_by_ratio_even_when_dice_is_selected(tmp_path):
+    base = make_text(40)
+    blocks = [base[i:i + 300] for i in range(0, len(base), 300)]
+    reordered = "".join(reversed(blocks))  # 段落顺序调换：Dice 接近 1，SequenceMatcher 远低于阈值
+    write_note(tmp_path, "a/周报.md", "周报", base)
+    write_note(tmp_path, "b/周报.md", "周报", reordered)
+    write_note(tmp_path, "c/周报.md", "周报", edit_block(base, 41, 0.05))
+    assert vault_cleaner.SimilarityScorer(0.8, "dice").score(base, reordered) > 0.95
+
+    for method in ("ratio", "dice"):
+        result = VaultCleaner(str(tmp_path), similarity=method).fuzzy(threshold=0.8)
+        assert result["removed_paths"] == ["c/周报.md"]
+
+
+def test_fuzzy_deletes_only_direct_matches_of_the_keeper(tmp_path):
+    def replace(text, start, n, seed):
+        return text[:start] + make_text(seed, n) + text[start + n:]
+
+    a = make_text(50)
+    b = replace(a, 0, 180, 51)        # a~b ≈ 0.85
+    c = replace(b, 1020, 180, 52)     # b~c ≈ 0.85，a~c ≈ 0.70
+    write_note(tmp_path, "笔记.md", "笔记", a)
+    write_note(tmp_path, "备份/笔记.md", "笔记", b)
+    write_note(tmp_path, "备份/旧/笔记.md", "笔记", c)
+    write_note(tmp_path, "无关/会议.md", "会议", replace(a, 500, 30, 53))  # 标题不同，内容几乎相同
+
+    result = VaultCleaner(str(tmp_path)).fuzzy(threshold=0.8)
+    # 保留「笔记.md」，只删除与它直接相似的 b；c 只与被删除的 b 相似，不能连带删除
+    assert result["removed_paths"] == ["备份/笔记.md"]
+    assert result["report_only"] >= 1
+
+    # 低阈值下 a~c 也达标，此时 c 与保留笔记直接匹配，可以删除；标题不同的笔记仍只报告
+    result = VaultCleaner(str(tmp_path)).fuzzy(threshold=0.6)
+    assert sorted(result["removed_paths"]) == ["备份/旧/笔记.md", "备份/笔记.md"]
+    assert "无关/会议.md" not in result["removed_paths"]
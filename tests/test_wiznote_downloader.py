@@ -1,7 +1,30 @@
-from tools.wiznote_downloader import WizMigrator
+import base64
+import hashlib
+import io
+import json
+import queue
+import socketserver
+import struct
+import threading
+import zipfile
+import zlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from tools import wiznote_downloader
+from tools.wiznote_downloader import (SCHEDULE_WINDOW, STATE_DB_NAME, AdaptiveRateLimiter, BandwidthLimiter,
+                                      BatchExporter, DownloadState, MarkdownConverter, NotePipeline,
+                                      RequestMetrics, ResponseCache, WizMigrator)
 
 
 class FakeResponse:
+    status_code = 200
+    headers = {}
+
     def __init__(self, payload):
         self.payload = payload
 
@@ -100,3 +123,1314 @@ def test_login_keeps_default_api_url_when_server_omits_it():
     assert success
     assert error is None
     assert migrator.kapi_url == "https://ks.wiz.cn"
+
+
+class RoutedResponse:
+    def __init__(self, payload=None, status_code=200, content=b"", headers=None):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content if payload is None else json.dumps(payload).encode("utf-8")
+        self.text = self.content.decode("utf-8", errors="ignore")
+
+    def json(self):
+        if self.payload is None:
+            raise ValueError("not json")
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def iter_content(self, chunk_size=8192):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class RoutedSession:
+    """按 URL 片段返回预设响应，并记录请求过的 URL"""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.headers = {}
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append(url)
+        for fragment, response in self.routes.items():
+            if fragment in url:
+                return response
+        return RoutedResponse(status_code=404, content=b"not found")
+
+
+def make_logged_in_migrator(tmp_path, routes, **kwargs):
+    migrator = WizMigrator("user@example.com", "password",
+                           output_base=str(tmp_path / "wiznote_download"), **kwargs)
+    migrator.kapi_url = "https://ks.example.com"
+    migrator.kb_guid = "kb"
+    migrator.session = RoutedSession(routes)
+    migrator.login = lambda: (True, None)
+    return migrator
+
+
+def test_download_state_tracks_listing_and_finished_notes(tmp_path):
+    state = DownloadState(tmp_path / STATE_DB_NAME)
+    state.record_listing("kb", [
+        {"docGuid": "a", "title": "A", "category": "/x/", "version": 3},
+        {"docGuid": "b", "title": "B", "category": "/x/", "version": 5},
+    ])
+    state.mark_category_scanned("kb", "/x/")
+    state.mark_note("a", "done", md_path="x/A.md")
+    state.mark_note("b", "in_progress")
+
+    assert state.is_category_scanned("kb", "/x/")
+    assert not state.is_category_scanned("kb", "/y/")
+    assert [DownloadState.note_guid(n) for n in state.load_notes("kb")] == ["a", "b"]
+    assert state.finished_guids("kb") == {"a"}
+    assert state.get_status("b") == "in_progress"
+    state.close()
+
+
+def test_resume_skips_listing_and_finished_notes(tmp_path):
+    output_base = tmp_path / "wiznote_download"
+    state = DownloadState(output_base / STATE_DB_NAME)
+    state.set_value("categories:kb", ["/x/"])
+    state.record_listing("kb", [
+        {"docGuid": "done", "title": "Done", "category": "/x/"},
+        {"docGuid": "todo", "title": "Todo", "category": "/x/"},
+    ])
+    state.mark_category_scanned("kb", "/x/")
+    state.mark_note("done", "done")
+    state.close()
+
+    migrator = make_logged_in_migrator(tmp_path, {}, resume=True)
+    processed = []
+    migrator._prepare_note = lambda note, base: processed.append(note["docGuid"]) or (None, {"status": "skip", "title": "t"})
+
+    migrator.run()
+
+    assert processed == ["todo"]
+    assert migrator.session.calls == []
+
+
+def test_partial_note_is_redone_instead_of_skipped(tmp_path):
+    view = RoutedResponse({"returnCode": 200, "result": {"html": "<p>new body</p>"}})
+    migrator = make_logged_in_migrator(tmp_path, {"/ks/note/view/": view})
+    output_base = Path(migrator.output_base)
+    (output_base / "x").mkdir(parents=True)
+    md_file = output_base / "x" / "Note.md"
+    md_file.write_text("half-writ", encoding="utf-8")
+
+    note = {"docGuid": "g1", "title": "Note", "category": "/x/"}
+    state = migrator._get_state()
+    state.record_listing("kb", [note])
+    state.mark_note("g1", "in_progress")
+
+    result = migrator.process_note(note, str(output_base))
+
+    assert result["status"] == "success"
+    assert "new body" in md_file.read_text(encoding="utf-8")
+    assert state.get_status("g1") == "done"
+
+
+def test_zip_package_is_streamed_and_extracted_into_assets_folder(tmp_path, monkeypatch):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        z.writestr("index.html", '<p>Zipped</p><img src="index_files/a.png">')
+        z.writestr("index_files/a.png", b"png" * 1000)
+        z.writestr("index_files/sub/doc.pdf", b"pdf")
+        z.writestr("index_files/../../evil.txt", b"nope")
+    # 限制内存缓冲，确保大包会落盘
+    monkeypatch.setattr(wiznote_downloader, "ZIP_SPOOL_MAX_MEMORY", 1024)
+    monkeypatch.setattr(wiznote_downloader, "ZIP_CHUNK_SIZE", 512)
+    migrator = make_logged_in_migrator(tmp_path, {
+        "/ks/note/download/kb/g1": RoutedResponse(content=buffer.getvalue()),
+    })
+    output_base = Path(migrator.output_base)
+
+    result = migrator.process_note({"docGuid": "g1", "title": "Zipped", "category": "/x/"}, str(output_base))
+
+    assert result["status"] == "success"
+    assert result["images_downloaded"] == 1
+    assert result["attachments_downloaded"] == 1
+    assets = output_base / "x" / "Zipped_files"
+    assert (assets / "a.png").read_bytes() == b"png" * 1000
+    assert (assets / "sub" / "doc.pdf").read_bytes() == b"pdf"
+    assert not list(tmp_path.rglob("evil.txt"))
+    assert not list((output_base / "x").glob("_temp_*"))
+    assert "Zipped_files/a.png" in (output_base / "x" / "Zipped.md").read_text(encoding="utf-8")
+    assert not any("/ks/note/view/" in url for url in migrator.session.calls)
+
+
+def test_non_zip_download_falls_back_to_view(tmp_path):
+    migrator = make_logged_in_migrator(tmp_path, {
+        "/ks/note/download/kb/g1": RoutedResponse({"returnCode": 200, "result": {}}),
+        "/ks/note/view/": RoutedResponse({"returnCode": 200, "result": {"html": "<p>Viewed</p>"}}),
+    })
+
+    result = migrator.process_note({"docGuid": "g1", "title": "Plain", "category": "/x/"}, migrator.output_base)
+
+    assert result["status"] == "success"
+    assert "Viewed" in (Path(migrator.output_base) / "x" / "Plain.md").read_text(encoding="utf-8")
+
+
+def test_note_metadata_is_fetched_once_and_lite_notes_skip_zip_probe(tmp_path):
+    migrator = make_logged_in_migrator(tmp_path, {
+        "/ks/note/view/": RoutedResponse({"returnCode": 200, "result": {"html": "<p>Body</p>"}}),
+        "/ks/note/attachments/": RoutedResponse({"returnCode": 200, "result": [{"attGuid": "a1", "name": "doc.pdf"}]}),
+        "/ks/attachment/download/": RoutedResponse(content=b"%PDF"),
+        "/ks/note/download/": RoutedResponse({"returnCode": 200, "result": {"resources": []}}),
+    })
+
+    result = migrator.process_note({"docGuid": "g1", "title": "Lite", "category": "/x/", "type": "lite/markdown"},
+                                   migrator.output_base)
+
+    assert result["status"] == "success"
+    assert result["attachments_downloaded"] == 1
+    calls = migrator.session.calls
+    assert sum("/ks/note/attachments/" in url for url in calls) == 1
+    # Lite 笔记不探测 ZIP，只剩资源列表这一次 /ks/note/download 请求
+    assert sum("/ks/note/download/" in url for url in calls) == 1
+    assert migrator.requests_saved == 2
+    note = (Path(migrator.output_base) / "x" / "Lite.md").read_text(encoding="utf-8")
+    assert "[[Lite_files/doc.pdf|doc.pdf]]" in note
+
+
+def test_asset_store_stores_shared_assets_once(tmp_path):
+    logo = b"LOGO" * 256
+    migrator = make_logged_in_migrator(tmp_path, {
+        "/ks/note/view/": RoutedResponse({"returnCode": 200, "result": {"html": "<p>Body</p>"}}),
+        "/ks/note/attachments/": RoutedResponse({"returnCode": 200, "result": [
+            {"attGuid": "a1", "name": "logo.png.pdf", "dataSize": len(logo)}]}),
+        "/ks/attachment/download/": RoutedResponse(content=logo),
+        "/ks/note/download/": RoutedResponse({"returnCode": 200, "result": {"resources": []}}),
+    })
+    output_base = Path(migrator.output_base)
+
+    for guid in ("g1", "g2"):
+        note = {"docGuid": guid, "title": guid, "category": "/x/", "type": "lite"}
+        assert migrator.process_note(note, str(output_base))["status"] == "success"
+
+    first = output_base / "x" / "g1_files" / "logo.png.pdf"
+    second = output_base / "x" / "g2_files" / "logo.png.pdf"
+    assert first.read_bytes() == second.read_bytes() == logo
+    # 下载前无法确认内容，两次都下载；第二次按摘要去重
+    assert sum("/ks/attachment/download/" in url for url in migrator.session.calls) == 2
+    store = migrator.asset_store
+    assert (store.stored, store.deduped, store.bytes_reused) == (1, 1, len(logo))
+    blobs = [p for p in (output_base / ".wiz_blobs").rglob("*") if p.is_file()]
+    assert len(blobs) == 1
+    # 默认不使用硬链接：修改一篇笔记的附件不影响另一篇
+    assert first.stat().st_ino != second.stat().st_ino
+    first.write_bytes(b"edited")
+    assert second.read_bytes() == logo
+
+
+def crc32_collision(prefix, wanted):
+    """在 prefix 后追加 4 字节，使整体的 CRC32 等于 wanted"""
+    table = []
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = (c >> 1) ^ 0xEDB88320 if c & 1 else c >> 1
+        table.append(c)
+    by_top = {entry >> 24: i for i, entry in enumerate(table)}
+    register = wanted ^ 0xFFFFFFFF
+    indexes = []
+    for _ in range(4):
+        index = by_top[register >> 24]
+        indexes.insert(0, index)
+        register = ((register ^ table[index]) << 8) & 0xFFFFFFFF
+    register = zlib.crc32(prefix) ^ 0xFFFFFFFF
+    suffix = bytearray()
+    for index in indexes:
+        suffix.append((register ^ index) & 0xFF)
+        register = (register >> 8) ^ table[index]
+    return prefix + bytes(suffix)
+
+
+def test_zip_assets_with_colliding_crc_are_stored_by_content(tmp_path):
+    original = b"AAAA" * 64
+    collision = crc32_collision(b"BBBB" * 63, zlib.crc32(original))
+    assert len(collision) == len(original) and zlib.crc32(collision) == zlib.crc32(original)
+
+    def package(body, files):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as z:
+            z.writestr("index.html", body)
+            for name, data in files.items():
+                z.writestr(f"index_files/{name}", data)
+        return RoutedResponse(content=buffer.getvalue())
+
+    # 同名、同大小、同 CRC32 的不同图片不能互相替代：只按 SHA-256 去重
+    migrator = make_logged_in_migrator(tmp_path, {
+        "/ks/note/download/kb/g1": package("<p>one</p>", {"image.png": original}),
+        "/ks/note/download/kb/g2": package("<p>two</p>", {"image.png": collision}),
+        "/ks/note/download/kb/g3": package("<p>three</p>", {"copy.png": original}),
+    })
+    output_base = Path(migrator.output_base)
+
+    for guid in ("g1", "g2", "g3"):
+        note = {"docGuid": guid, "title": guid, "category": "/x/"}
+        assert migrator.process_note(note, str(output_base))["status"] == "success"
+
+    assert (output_base / "x" / "g1_files" / "image.png").read_bytes() == original
+    assert (output_base / "x" / "g2_files" / "image.png").read_bytes() == collision
+    assert (output_base / "x" / "g3_files" / "copy.png").read_bytes() == original
+    store = migrator.asset_store
+    assert (store.stored, store.deduped) == (2, 1)
+
+
+def test_incremental_downloads_only_changed_notes_and_reports_deleted(tmp_path):
+    listing = [
+        {"docGuid": "edited", "title": "Edited", "category": "/x/", "version": 2},
+        {"docGuid": "same", "title": "Same", "category": "/x/", "version": 7},
+        {"docGuid": "new", "title": "New", "category": "/x/", "version": 1},
+    ]
+    migrator = make_logged_in_migrator(tmp_path, {
+        "/ks/category/all/": RoutedResponse({"returnCode": 200, "result": ["/x/"]}),
+        "/ks/note/list/category/": RoutedResponse({"returnCode": 200, "result": listing}),
+    }, incremental=True)
+
+    state = migrator._get_state()
+    state.record_listing("kb", [
+        {"docGuid": "edited", "title": "Edited", "category": "/x/", "version": 1},
+        {"docGuid": "same", "title": "Same", "category": "/x/", "version": 7},
+        {"docGuid": "gone", "title": "Gone", "category": "/x/", "version": 4},
+    ])
+    for guid in ("edited", "same", "gone"):
+        state.mark_note(guid, "done")
+
+    processed = []
+    migrator._prepare_note = lambda note, base: processed.append(note["docGuid"]) or (None, {"status": "skip", "title": "t"})
+
+    migrator.run()
+
+    assert sorted(processed) == ["edited", "new"]
+    assert migrator.refresh_guids == {"edited"}
+    assert [n["note_guid"] for n in migrator.deleted_notes] == ["gone"]
+    report = (Path(migrator.output_base) / "download_report.md").read_text(encoding="utf-8")
+    assert "服务器已删除的笔记" in report
+
+
+def test_listing_runs_concurrently_and_streams_into_downloads(tmp_path):
+    first_note_processed = threading.Event()
+    listings = {
+        "/a/": [{"docGuid": "a1", "title": "A1", "category": "/a/"},
+                {"docGuid": "shared", "title": "Shared", "category": "/a/"}],
+        "/b/": [{"docGuid": "b1", "title": "B1", "category": "/b/"},
+                {"docGuid": "shared", "title": "Shared", "category": "/b/"}],
+    }
+
+    class ListingSession:
+        headers = {}
+
+        def get(self, url, params=None, **kwargs):
+            if "/ks/category/all/" in url:
+                return RoutedResponse({"returnCode": 200, "result": ["/a/", "/b/"]})
+            category = params["category"]
+            if category == "/b/":
+                # /b/ 的列表要等 /a/ 的笔记开始下载后才返回：证明下载不必等待全部扫描完成
+                assert first_note_processed.wait(timeout=5)
+            return RoutedResponse({"returnCode": 200, "result": listings[category]})
+
+    migrator = make_logged_in_migrator(tmp_path, {}, list_workers=2)
+    migrator.session = ListingSession()
+    processed = []
+
+    def fake_prepare(note, base):
+        processed.append(note["docGuid"])
+        first_note_processed.set()
+        return None, {"status": "skip", "title": note["title"]}
+
+    migrator._prepare_note = fake_prepare
+
+    migrator.run()
+
+    assert sorted(processed) == ["a1", "b1", "shared"]
+    assert migrator.known_folders == {"/a/", "/b/"}
+    assert migrator.listing_errors == 0
+
+
+def test_pipeline_runs_each_stage_on_its_own_bounded_workers(tmp_path):
+    migrator = WizMigrator("user@example.com", "password", output_base=str(tmp_path))
+    stage_threads = {"fetch": set(), "assets": set(), "convert": set(), "write": set()}
+
+    def stage(name, result=None):
+        def run(*args):
+            stage_threads[name].add(threading.current_thread().name)
+            return result
+        return run
+
+    def prepare(note, base):
+        return {"guid": note["docGuid"], "safe_title": note["docGuid"], "rel_dir": ""}, None
+
+    def fetch(ctx):
+        stage_threads["fetch"].add(threading.current_thread().name)
+        if ctx["guid"] == "broken":
+            raise RuntimeError("boom")
+
+    migrator._prepare_note = prepare
+    migrator._fetch_note_body = fetch
+    migrator._fetch_note_assets = stage("assets")
+    migrator._convert_note = stage("convert")
+    migrator._write_note = lambda ctx: stage("write")() or {"status": "success", "title": ctx["guid"]}
+
+    pipeline = NotePipeline(migrator, str(tmp_path), {"fetch": 2, "assets": 3, "convert": 1, "write": 1}).start()
+    assert [q.maxsize for q in pipeline.queues] == [SCHEDULE_WINDOW, 6, 2, 2]
+    for i in range(20):
+        pipeline.submit({"docGuid": f"n{i}"})
+    pipeline.submit({"docGuid": "broken"})
+    pipeline.close()
+    pipeline.join()
+
+    results = [pipeline.results.get_nowait() for _ in range(21)]
+    assert pipeline.results.empty()
+    assert sum(r["status"] == "success" for r in results) == 20
+    assert [r["error"] for r in results if r["status"] == "error"] == ["boom"]
+    for name, threads in stage_threads.items():
+        assert threads and all(t.startswith(f"wiz-{name}-") for t in threads)
+    assert len(stage_threads["convert"]) == 1
+
+
+def test_heavy_notes_are_scheduled_first_and_encrypted_notes_skip_the_pipeline(tmp_path):
+    migrator = WizMigrator("user@example.com", "password", output_base=str(tmp_path))
+    notes = [
+        {"docGuid": "small", "dataSize": 1000},
+        {"docGuid": "secret", "dataSize": 10 ** 9, "encrypted": 1, "title": "Secret", "category": "/x/"},
+        {"docGuid": "many-attachments", "attachmentCount": 3},
+        {"docGuid": "huge", "dataSize": 50 * 1024 * 1024},
+        {"docGuid": "collab", "type": "collaboration"},
+        {"docGuid": "unknown"},
+    ]
+
+    class RecordingPipeline:
+        results = queue.Queue()
+        submitted = []
+
+        def submit(self, note, weight=0):
+            self.submitted.append((note["docGuid"], weight))
+
+    pipeline = RecordingPipeline()
+    migrator._begin_stream(pipeline)
+    migrator._dispatch_notes(notes)
+
+    assert [guid for guid, _ in pipeline.submitted] == ["huge", "collab", "many-attachments", "small", "unknown"]
+    encrypted = pipeline.results.get_nowait()
+    assert encrypted["status"] == "encrypted" and encrypted["note_guid"] == "secret"
+    assert encrypted["path"] == "x"
+    assert migrator._stream["submitted"] == 6  # 加密笔记也计入总数，由主线程汇总结果
+
+
+def test_pipeline_takes_heaviest_waiting_note_first(tmp_path):
+    migrator = WizMigrator("user@example.com", "password", output_base=str(tmp_path))
+    gate, order = threading.Event(), []
+
+    def fetch(ctx):
+        gate.wait(5)
+        order.append(ctx["guid"])
+
+    migrator._prepare_note = lambda note, base: ({"guid": note["docGuid"], "safe_title": "", "rel_dir": ""}, None)
+    migrator._fetch_note_body = fetch
+    migrator._fetch_note_assets = lambda ctx: None
+    migrator._convert_note = lambda note, ctx: None
+    migrator._write_note = lambda ctx: {"status": "success", "title": ctx["guid"]}
+
+    pipeline = NotePipeline(migrator, str(tmp_path), {"fetch": 1}).start()
+    pipeline.submit({"docGuid": "first"}, 0)
+    time.sleep(0.1)  # 唯一的 fetch 线程取走第一篇后在 gate 处等待
+    for guid, weight in [("light", 1), ("heavy", 100), ("medium", 10), ("light2", 1)]:
+        pipeline.submit({"docGuid": guid}, weight)
+    gate.set()
+    pipeline.close()
+    pipeline.join()
+
+    assert order == ["first", "heavy", "medium", "light", "light2"]
+
+
+def test_results_stream_to_journal_and_report_renders_from_it(tmp_path):
+    migrator = WizMigrator("user@example.com", "password", output_base=str(tmp_path))
+    failed_image = {"name": "a.png", "url": "https://res/a.png", "note": "Collab", "path": "x"}
+    results = [
+        {"status": "success", "title": "Ok", "md_path": "x/Ok.md", "images_found": 1, "images_downloaded": 1,
+         "failed_images": [], "failed_attachments": []},
+        {"status": "error", "title": "Broken", "error": "boom", "note_guid": "g2", "path": "x"},
+        {"status": "collaborative", "title": "Collab", "note_guid": "g3", "path": "x", "images_found": 1,
+         "images_downloaded": 0, "failed_images": [failed_image], "failed_attachments": [],
+         "failure_reason": "missing_dependency"},
+        {"status": "encrypted", "title": "Secret", "note_guid": "g4", "path": "x"},
+    ]
+    for i, result in enumerate(results, 1):
+        migrator._handle_result(result, i, len(results))
+
+    assert migrator.results_journal.counts == {"success": 1, "error": 1, "collaborative": 1,
+                                               "encrypted": 1, "failed_image": 1}
+    assert len(migrator.failed_notes) == 1 and list(migrator.failed_images) == [dict(failed_image, kind="failed_image")]
+    migrator.generate_report(str(tmp_path), 25.0, 50.0, 0.0)
+    migrator.results_journal.close()
+
+    lines = [json.loads(line) for line in (tmp_path / "download_results.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [line["kind"] for line in lines] == ["success", "error", "collaborative", "failed_image", "encrypted"]
+    assert "failed_images" not in lines[2]
+    report = (tmp_path / "download_report.md").read_text(encoding="utf-8")
+    assert "- 失败: 1 个" in report
+    assert "### 1. Broken" in report and "boom" in report
+    assert "检测到 1 个协作笔记因缺少依赖而无法下载" in report
+    assert "### 1. Secret" in report
+    assert "https://res/a.png" in report
+
+
+def test_converter_uses_process_pool_with_size_and_timeout_guards():
+    page = "<h1>Title</h1>" + "<p>row <b>bold</b></p>" * 50
+    converter = MarkdownConverter(processes=1, timeout=30, max_size=10_000, inline_size=100)
+    try:
+        markdown, fallback = converter.convert(page)
+        assert fallback is None
+        assert markdown.startswith("# Title") and "**bold**" in markdown
+        assert len(converter._idle) == 1  # 子进程转换完成后留作下次使用
+
+        markdown, fallback = converter.convert("<p>x &amp; y</p>" * 2000)
+        assert "过大" in fallback
+        assert markdown.startswith("x & y")
+
+        # 超时：只终止转换这篇的子进程，之后的转换启动新的子进程
+        converter.timeout = 0.001
+        converter.max_size = None
+        markdown, fallback = converter.convert(page * 200)
+        assert "超过" in fallback and "row bold" in markdown
+        assert converter.terminated == 1 and not converter._idle
+        converter.timeout = 30
+        assert converter.convert(page) == (converter.convert(page)[0], None)
+        assert converter.fallbacks == 2
+    finally:
+        converter.close()
+
+
+def test_converter_timeout_starts_when_a_worker_takes_the_document():
+    page = "<h1>Title</h1>" + "<p>row <b>bold</b></p>" * 50
+    converter = MarkdownConverter(processes=1, timeout=0.5, inline_size=100)
+    try:
+        converter.convert(page)  # 先启动子进程，避免启动耗时影响计时
+        # 唯一的子进程被占用 1 秒：排队等待超过 timeout，但转换本身很快，不应判为超时
+        converter._slots.acquire()
+        threading.Timer(1.0, converter._slots.release).start()
+        started = time.monotonic()
+        markdown, fallback = converter.convert(page)
+        assert time.monotonic() - started >= 0.9
+        assert fallback is None and markdown.startswith("# Title")
+        assert converter.terminated == 0 and converter.fallbacks == 0
+    finally:
+        converter.close()
+
+
+class FakeWizHandler(BaseHTTPRequestHandler):
+    """最小化的 WizNote API，用于驱动完整下载流程"""
+
+    notes = [
+        {"docGuid": "g1", "title": "One", "category": "/x/"},
+        {"docGuid": "g2", "title": "Two", "category": "/x/"},
+    ]
+    seen_tokens = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload, status=200, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        base = f"http://{self.headers['Host']}"
+        self._send({"returnCode": 200, "result": {"token": "tok", "kbGuid": "kb", "kbServer": base}})
+
+    def do_GET(self):
+        base = f"http://{self.headers['Host']}"
+        path, _, query = self.path.partition("?")
+        if path.startswith("/ks/"):
+            self.seen_tokens.append(self.headers.get("X-Wiz-Token"))
+        if path == "/ks/category/all/kb":
+            self._send({"returnCode": 200, "result": ["/x/"]})
+        elif path == "/ks/note/list/category/kb":
+            self._send({"returnCode": 200, "result": self.notes})
+        elif path.startswith("/ks/note/download/kb/") and "downloadData" in query:
+            self._send({"returnCode": 200, "result": {"resources": [{"name": "a.png", "url": f"{base}/res/a.png"}]}})
+        elif path.startswith("/ks/note/view/kb/"):
+            self._send({"returnCode": 200, "result": {"html": '<p>Hello</p><img src="index_files/a.png">'}})
+        elif path.startswith("/ks/note/attachments/kb/"):
+            self._send({"returnCode": 200, "result": []})
+        elif path == "/res/a.png":
+            self._send(b"\x89PNG-data", content_type="image/png")
+        else:
+            self._send({"returnCode": 404}, status=404)
+
+
+@pytest.fixture
+def fake_wiz_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeWizHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(wiznote_downloader, "AS_URL", base)
+    FakeWizHandler.seen_tokens = []
+    yield base
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("engine", ["thread", "async"])
+def test_engine_downloads_notes_and_images(tmp_path, fake_wiz_server, engine):
+    if engine == "async":
+        pytest.importorskip("aiohttp")
+    output_base = tmp_path / "wiznote_download"
+    migrator = WizMigrator("user@example.com", "password", output_base=str(output_base),
+                           engine=engine, concurrency=4, per_host_limit=2)
+
+    migrator.run()
+
+    assert migrator.success_count == 2
+    assert migrator.total_images_downloaded == 2
+    note = (output_base / "x" / "One.md").read_text(encoding="utf-8")
+    assert "Hello" in note
+    assert "One_files/a.png" in note
+    assert (output_base / "x" / "Two_files" / "a.png").read_bytes() == b"\x89PNG-data"
+    # 两篇笔记的同一张图片只在资源存储中保存一份
+    assert len([p for p in (output_base / ".wiz_blobs").rglob("*") if p.is_file()]) == 1
+    assert set(FakeWizHandler.seen_tokens) == {"tok"}
+    endpoints = json.loads((output_base / "download_metrics.json").read_text(encoding="utf-8"))["endpoints"]
+    assert endpoints["note_view"]["count"] == 2
+    assert endpoints["resource"]["count"] == 2
+    assert endpoints["resource"]["bytes"] >= 2 * len(b"\x89PNG-data")  # 下载前无法确认内容，两张都下载后去重
+
+
+def test_async_engine_runs_collaboration_fetches_under_the_global_limit(tmp_path, fake_wiz_server, monkeypatch):
+    pytest.importorskip("aiohttp")
+    engines = []
+    init = wiznote_downloader.AsyncDownloadEngine.__init__
+
+    def tracking_init(self, migrator):
+        init(self, migrator)
+        engines.append(self)
+
+    held = []
+
+    def fetch_collaboration(self, ctx):
+        held.append(engines[0].semaphore.locked())
+        return "# collab"
+
+    monkeypatch.setattr(wiznote_downloader.AsyncDownloadEngine, "__init__", tracking_init)
+    monkeypatch.setattr(WizMigrator, "_is_collaborative_html", lambda self, html: True)
+    monkeypatch.setattr(WizMigrator, "_fetch_collaboration_note", fetch_collaboration)
+    output_base = tmp_path / "wiznote_download"
+    migrator = WizMigrator("user@example.com", "password", output_base=str(output_base),
+                           engine="async", concurrency=1)
+
+    migrator.run()
+
+    # 全局并发为 1：线程池中的协作笔记获取占用唯一的名额
+    assert migrator.success_count == 2
+    assert held == [True, True]
+
+
+@pytest.mark.parametrize("engine", ["thread", "async"])
+def test_engines_download_while_other_categories_are_still_listing(tmp_path, fake_wiz_server, monkeypatch, engine):
+    if engine == "async":
+        pytest.importorskip("aiohttp")
+    monkeypatch.setattr(WizMigrator, "_category_paths", staticmethod(lambda categories: ["/x/", "/slow/"]))
+    overlapped = []
+    if engine == "thread":
+        scan = WizMigrator.scan_folder_recursive
+
+        def slow_scan(self, folder, *args):
+            if folder != "/slow/":
+                return scan(self, folder, *args)
+            deadline = time.monotonic() + 5
+            while not self.success_count and time.monotonic() < deadline:
+                time.sleep(0.02)
+            overlapped.append(self.success_count > 0)
+        monkeypatch.setattr(WizMigrator, "scan_folder_recursive", slow_scan)
+    else:
+        import asyncio
+        scan = wiznote_downloader.AsyncDownloadEngine._scan_folder
+
+        async def slow_scan(self, folder, all_notes):
+            if folder != "/slow/":
+                return await scan(self, folder, all_notes)
+            deadline = time.monotonic() + 5
+            while not self.migrator.success_count and time.monotonic() < deadline:
+                await asyncio.sleep(0.02)
+            overlapped.append(self.migrator.success_count > 0)
+        monkeypatch.setattr(wiznote_downloader.AsyncDownloadEngine, "_scan_folder", slow_scan)
+    output_base = tmp_path / "wiznote_download"
+    migrator = WizMigrator("user@example.com", "password", output_base=str(output_base), engine=engine)
+
+    migrator.run()
+
+    # 两种引擎都边扫描边下载：/slow/ 还在扫描时 /x/ 的笔记已经下载完成
+    assert overlapped == [True]
+    assert migrator.success_count == 2
+
+
+@pytest.mark.parametrize("engine", ["thread", "async"])
+def test_engines_share_incremental_selection_and_deleted_notes(tmp_path, fake_wiz_server, monkeypatch, engine):
+    if engine == "async":
+        pytest.importorskip("aiohttp")
+    output_base = tmp_path / "wiznote_download"
+    WizMigrator("user@example.com", "password", output_base=str(output_base), engine=engine).run()
+
+    monkeypatch.setattr(FakeWizHandler, "notes", [
+        {"docGuid": "g1", "title": "One", "category": "/x/"},
+        {"docGuid": "g1", "title": "One", "category": "/x/"},   # 重复出现的笔记只计一次
+        {"docGuid": "g3", "title": "Three", "category": "/x/"},
+    ])
+    migrator = WizMigrator("user@example.com", "password", output_base=str(output_base),
+                           engine=engine, incremental=True)
+    migrator.run()
+
+    # 未修改的 g1 跳过，新增的 g3 下载，列表中消失的 g2 记为已删除
+    assert migrator.success_count == 1
+    assert (output_base / "x" / "Three.md").exists()
+    assert [note["note_guid"] for note in migrator.deleted_notes] == ["g2"]
+    report = (output_base / "download_report.md").read_text(encoding="utf-8")
+    assert "- 总数: 1 个" in report
+
+
+@pytest.mark.parametrize("engine", ["thread", "async"])
+def test_listing_failure_is_recorded_and_run_still_finishes(tmp_path, fake_wiz_server, monkeypatch, engine):
+    if engine == "async":
+        pytest.importorskip("aiohttp")
+    monkeypatch.setattr(WizMigrator, "_category_paths", staticmethod(lambda categories: ["/x/", "/broken/"]))
+    if engine == "thread":
+        scan = WizMigrator.scan_folder_recursive
+
+        def flaky_scan(self, folder, *args):
+            if folder == "/broken/":
+                raise RuntimeError("boom")
+            return scan(self, folder, *args)
+        monkeypatch.setattr(WizMigrator, "scan_folder_recursive", flaky_scan)
+    else:
+        scan = wiznote_downloader.AsyncDownloadEngine._scan_folder
+
+        async def flaky_scan(self, folder, all_notes):
+            if folder == "/broken/":
+                raise RuntimeError("boom")
+            return await scan(self, folder, all_notes)
+        monkeypatch.setattr(wiznote_downloader.AsyncDownloadEngine, "_scan_folder", flaky_scan)
+    output_base = tmp_path / "wiznote_download"
+    migrator = WizMigrator("user@example.com", "password", output_base=str(output_base), engine=engine)
+
+    migrator.run()
+
+    # 出错的分类只计为扫描失败：其余笔记照常下载，报告写出，状态库关闭且不记录同步点
+    assert migrator.listing_errors == 1
+    assert migrator.success_count == 2
+    assert (output_base / "download_report.md").exists()
+    assert migrator.state is None
+    assert migrator.converter._idle == []
+    state = DownloadState(output_base / STATE_DB_NAME)
+    try:
+        assert state.get_value("last_sync:kb") is None
+        assert not state.is_category_scanned("kb", "/broken/")
+    finally:
+        state.close()
+
+
+def test_scheduler_sizes_pool_and_caps_in_flight_requests(tmp_path):
+    migrator = WizMigrator("user@example.com", "password", concurrency=3, pool_size=6, rate=0)
+    adapter = migrator.session.get_adapter("https://ks.wiz.cn")
+    assert adapter._pool_maxsize == 6
+    assert adapter._pool_block
+
+    active = 0
+    peak = 0
+    counter_lock = threading.Lock()
+
+    class SlowSession:
+        headers = {}
+
+        def get(self, url, **kwargs):
+            nonlocal active, peak
+            with counter_lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with counter_lock:
+                active -= 1
+            return RoutedResponse(content=b"data")
+
+    migrator.session = SlowSession()
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        results = list(executor.map(
+            lambda i: migrator.download_file(f"https://x/{i}", str(tmp_path / f"{i}.bin")), range(24)))
+
+    assert all(results)
+    assert peak <= 3
+    assert migrator.scheduler.peak_in_flight == peak
+
+
+def test_rate_limiter_backs_off_on_throttling_and_recovers():
+    now = [100.0]
+    limiter = AdaptiveRateLimiter(rate=10, max_rate=20, min_rate=1, clock=lambda: now[0])
+
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(0.1)
+
+    # 429 + Retry-After：速率减半，所有请求暂停到指定时间
+    limiter.on_response(429, 0.05, "3")
+    assert limiter.rate == pytest.approx(5)
+    assert limiter.reserve() == pytest.approx(3)
+    assert limiter.retry_delay(0) == pytest.approx(3)
+
+    # 冷却期内的并发错误只降速一次
+    limiter.on_response(503, 0.05)
+    assert limiter.rate == pytest.approx(5)
+    assert limiter.throttled == 2
+
+    now[0] += 5
+    limiter.on_response(502, 0.05)
+    assert limiter.rate == pytest.approx(2.5)
+
+    for _ in range(200):
+        limiter.on_response(200, 0.05)
+    assert limiter.rate == pytest.approx(20)
+
+    # 延迟远高于基线时降速
+    now[0] += 5
+    for _ in range(20):
+        limiter.on_response(200, 2.0)
+    assert limiter.rate < 20
+    assert "req/s" in limiter.describe()
+
+
+def test_throttled_api_calls_honor_retry_after(tmp_path):
+    limiter_waits = []
+    responses = iter([
+        RoutedResponse(status_code=429, content=b"slow down", headers={"Retry-After": "0"}),
+        RoutedResponse({"returnCode": 200, "result": []}),
+    ])
+
+    class ThrottlingSession:
+        headers = {}
+
+        def get(self, url, **kwargs):
+            return next(responses)
+
+    migrator = make_logged_in_migrator(tmp_path, {}, rate=50)
+    migrator.session = ThrottlingSession()
+    migrator.rate_limiter.retry_delay = lambda attempt: limiter_waits.append(attempt) or 0
+
+    response = migrator._http("get", "https://ks.example.com/ks/note/list/category/kb")
+
+    assert response.status_code == 200
+    assert limiter_waits == [0]
+    assert migrator.rate_limiter.throttled == 1
+    assert migrator.rate_limiter.rate < 26
+    stats = migrator.metrics.snapshot()["endpoints"]["note_list"]
+    assert stats["count"] == 2
+    assert stats["status"] == {"429": 1, "200": 1}
+    assert stats["retries"] == 1
+
+
+def test_request_metrics_classify_endpoints_and_export_histograms(tmp_path):
+    metrics = RequestMetrics(buckets=(0.1, 1))
+    assert metrics.endpoint("https://as.wiz.cn/as/user/login") == "login"
+    assert metrics.endpoint("https://ks/ks/note/download/kb/g", {"downloadData": "1"}) == "resource_list"
+    assert metrics.endpoint("https://ks/ks/note/download/kb/g") == "note_download"
+    assert metrics.endpoint("https://ks/ks/note/kb/g/tokens") == "collab_token"
+    assert metrics.endpoint("https://ks/ks/attachment/download/kb/g/a") == "attachment_download"
+    assert metrics.endpoint("https://cdn.example.com/a.png") == "resource"
+
+    metrics.record("note_view", 200, 0.05, 100)
+    metrics.record("note_view", 200, 0.5, 300)
+    metrics.record("note_view", None, 2.0, error="ReadTimeout")
+    metrics.record_retry("note_view")
+    written = metrics.write(tmp_path, prometheus=True)
+
+    stats = json.loads((tmp_path / "download_metrics.json").read_text(encoding="utf-8"))["endpoints"]["note_view"]
+    assert stats["count"] == 3 and stats["bytes"] == 400 and stats["retries"] == 1
+    assert stats["status"] == {"200": 2}
+    assert stats["errors"] == {"ReadTimeout": 1}
+    assert stats["latency"]["buckets"] == {"0.1": 1, "1": 2, "+Inf": 3}
+    assert stats["latency"]["p50"] == 1
+    assert stats["latency"]["p99"] == 2.0
+    prom = (tmp_path / "download_metrics.prom").read_text(encoding="utf-8")
+    assert 'wiz_requests_total{endpoint="note_view",status="200"} 2' in prom
+    assert 'wiz_request_duration_seconds_bucket{endpoint="note_view",le="+Inf"} 3' in prom
+    assert [p.name for p in written] == ["download_metrics.json", "download_metrics.prom"]
+
+
+class FlakyRangeHandler(BaseHTTPRequestHandler):
+    """第一次请求只发送一半数据就断开，之后按 Range 返回剩余部分"""
+
+    payload = bytes(range(256)) * 800
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        type(self).requests.append((range_header, self.headers.get("If-Range")))
+        if range_header:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            body = self.payload[start:]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(self.payload) - 1}/{len(self.payload)}")
+        else:
+            body = self.payload
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        if len(type(self).requests) == 1:
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(2)
+            return
+        self.wfile.write(body)
+
+
+@pytest.mark.parametrize("use_store", [False, True])
+def test_interrupted_download_resumes_with_range(tmp_path, use_store):
+    FlakyRangeHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyRangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/big.bin"
+    try:
+        migrator = WizMigrator("user@example.com", "password", output_base=str(tmp_path),
+                               max_retries=3, rate=0, asset_store=use_store)
+        migrator.rate_limiter.retry_delay = lambda attempt: 0
+        migrator._get_state()
+        target = tmp_path / "x_files" / "big.bin"
+
+        assert migrator.download_file(url, str(target), name="big.bin" if use_store else None)
+
+        assert target.read_bytes() == FlakyRangeHandler.payload
+        (first_range, _), (resume_range, if_range) = FlakyRangeHandler.requests
+        resumed_from = int(resume_range.split("=")[1].rstrip("-"))
+        assert first_range is None and if_range == '"v1"'
+        assert 0 < resumed_from <= len(FlakyRangeHandler.payload) // 2
+        assert not list(tmp_path.rglob("*.part"))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class MisalignedRangeHandler(FlakyRangeHandler):
+    """第一次请求中途断开；续传请求返回 206，但 Content-Range 的起点与请求的不符"""
+
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        type(self).requests.append((range_header, self.headers.get("If-Range")))
+        payload = self.payload
+        if range_header:
+            payload = payload[1:]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes 1-{len(self.payload) - 1}/{len(self.payload)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if len(type(self).requests) == 1:
+            self.wfile.write(payload[:len(payload) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(2)
+            return
+        self.wfile.write(payload)
+
+
+@pytest.mark.parametrize("use_store", [False, True])
+def test_misaligned_partial_response_restarts_without_range(tmp_path, use_store):
+    MisalignedRangeHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MisalignedRangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/big.bin"
+    try:
+        migrator = WizMigrator("user@example.com", "password", output_base=str(tmp_path),
+                               max_retries=3, rate=0, asset_store=use_store)
+        migrator.rate_limiter.retry_delay = lambda attempt: 0
+        migrator._get_state()
+        target = tmp_path / "x_files" / "big.bin"
+
+        assert migrator.download_file(url, str(target), name="big.bin" if use_store else None)
+
+        # 起点不符的 206 不能拼接到 .part 后面，也不能当作完整文件写入：丢弃 .part 后不带 Range 重新下载
+        assert target.read_bytes() == MisalignedRangeHandler.payload
+        assert [range_header is not None for range_header, _ in MisalignedRangeHandler.requests] == [False, True, False]
+        assert not list(tmp_path.rglob("*.part"))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_truncated_download_is_not_left_as_finished_file(tmp_path):
+    migrator = WizMigrator("user@example.com", "password", output_base=str(tmp_path), max_retries=1, rate=0)
+    response = RoutedResponse(content=b"half", headers={"Content-Length": "8"})
+    migrator.session = RoutedSession({"/att": response})
+    target = tmp_path / "doc_files" / "doc.pdf"
+
+    assert not migrator.download_file("https://ks.example.com/att", str(target))
+
+    assert not target.exists()
+    assert (tmp_path / "doc_files" / "doc.pdf.part").read_bytes() == b"half"
+
+
+class FakeShareJSHandler(socketserver.BaseRequestHandler):
+    """最小化的 ShareJS 编辑器服务：WebSocket 握手 + 文本帧，fetch 响应延迟后乱序返回"""
+
+    connections = []
+
+    def _recv_exact(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def _send_text(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        header = b"\x81" + (bytes([len(body)]) if len(body) < 126 else b"\x7e" + struct.pack(">H", len(body)))
+        with self.send_lock:
+            self.request.sendall(header + body)
+
+    def _reply_fetch(self, message):
+        time.sleep(0.05)
+        doc = message["d"]
+        resources = {f"{doc}.png": {"type": "image/png"}, "notes.txt": {"type": "text/plain"}}
+        self._send_text({"a": "f", "c": message["c"], "d": doc,
+                         "data": {"v": 1, "type": "rich", "data": {"content": f"# {doc}", "resources": resources}}})
+
+    def handle(self):
+        self.send_lock = threading.Lock()
+        request = b""
+        while b"\r\n\r\n" not in request:
+            request += self.request.recv(4096)
+        lines = request.decode("latin-1").split("\r\n")
+        headers = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+        accept = base64.b64encode(hashlib.sha1(
+            (headers["Sec-WebSocket-Key"] + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest()).decode()
+        self.request.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                              f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        self.connections.append(headers.get("Cookie"))
+        try:
+            while True:
+                first, second = self._recv_exact(2)
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack(">H", self._recv_exact(2))[0]
+                elif length == 127:
+                    length = struct.unpack(">Q", self._recv_exact(8))[0]
+                mask = self._recv_exact(4)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self._recv_exact(length)))
+                if first & 0x0F == 0x8:
+                    break
+                message = json.loads(payload)
+                if message["a"] == "hs":
+                    self._send_text({"a": "hs", "protocol": 1, "id": "session"})
+                elif message["a"] == "f":
+                    threading.Thread(target=self._reply_fetch, args=(message,), daemon=True).start()
+        except (ConnectionError, OSError):
+            pass
+
+
+@pytest.fixture
+def fake_sharejs_server():
+    pytest.importorskip("websocket")
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeShareJSHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FakeShareJSHandler.connections = []
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def make_collab_migrator(tmp_path, monkeypatch, base, **kwargs):
+    monkeypatch.setattr(wiznote_downloader, "COLLABORATION_PARSER_AVAILABLE", True)
+    monkeypatch.setattr(wiznote_downloader, "parse_collaboration_note",
+                        lambda raw: json.loads(raw)["data"]["data"]["content"], raising=False)
+    migrator = WizMigrator("user@example.com", "password", output_base=str(tmp_path), rate=0, **kwargs)
+    migrator.kapi_url = base
+    migrator.kb_guid = "kb"
+    migrator.user_guid = "user"
+    migrator.get_collaboration_token = lambda doc_guid: f"tok-{doc_guid}"
+    return migrator
+
+
+def test_collaboration_client_reuses_and_multiplexes_one_connection(tmp_path, monkeypatch, fake_sharejs_server):
+    migrator = make_collab_migrator(tmp_path, monkeypatch, fake_sharejs_server, collab_connections=1)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(migrator.get_collaboration_content, ["d1", "d2", "d3"]))
+    markdown, images = migrator.get_collaboration_content("d4")
+
+    assert [r[0] for r in results] == ["# d1", "# d2", "# d3"]
+    assert markdown == "# d4"
+    assert images == {"d4.png": {"url": f"{fake_sharejs_server}/editor/kb/d4/resources/d4.png", "token": "tok-d4"}}
+    # 四篇笔记共用一条已认证的连接
+    assert FakeShareJSHandler.connections == ["x-live-editor-token=tok-d1"]
+    assert migrator.collab_client.opened == 1
+    assert migrator.collab_client.reused == 3
+    migrator.collab_client.close()
+
+
+def test_collaboration_images_download_concurrently(tmp_path, monkeypatch, fake_sharejs_server):
+    migrator = make_collab_migrator(tmp_path, monkeypatch, fake_sharejs_server, max_workers=4)
+    monkeypatch.setattr(FakeShareJSHandler, "_reply_fetch", lambda self, message: self._send_text({
+        "a": "f", "c": "kb", "d": message["d"], "data": {"v": 1, "data": {
+            "content": "![](index_files/a.png)",
+            "resources": {name: {"type": "image/png"} for name in ("a.png", "b.png", "c.png")}}}}))
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def fake_download(url, token, output_path):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.1)
+        Path(output_path).write_bytes(token.encode())
+        with lock:
+            active[0] -= 1
+        return True
+
+    migrator.download_collaboration_image = fake_download
+    ctx = {"guid": "doc", "assets_path": tmp_path / "Doc_files", "assets_folder_name": "Doc_files",
+           "safe_title": "Doc", "rel_dir": "", "failed_images": [], "images_found": 0, "images_downloaded": 0}
+
+    markdown = migrator._fetch_collaboration_note(ctx)
+    migrator.collab_client.close()
+
+    assert markdown == "![](Doc_files/a.png)"
+    assert ctx["images_downloaded"] == 3
+    assert peak[0] > 1
+    assert (tmp_path / "Doc_files" / "b.png").read_bytes() == b"tok-doc"
+
+
+def test_batch_export_runs_jobs_in_parallel_under_a_shared_budget(tmp_path, monkeypatch):
+    from tools.mock_wiz_server import MockWizServer, SyntheticAccount
+
+    seen = []
+
+    class RecordingMigrator(WizMigrator):
+        def run(self):
+            super().run()
+            seen.append((self.user_id, self.kb_guid, self.scheduler.semaphore, self.rate_limiter))
+
+    monkeypatch.setenv("WIZ_BATCH_TEST_PASSWORD", "secret")
+    manifest = {
+        "output": str(tmp_path / "batch"),
+        "parallel": 2,
+        "concurrency": 6,
+        "rate": 0,
+        "defaults": {"workers": 2, "convert_processes": 0},
+        "jobs": [
+            {"name": "me", "user_id": "a@example.com", "password_env": "WIZ_BATCH_TEST_PASSWORD"},
+            {"user_id": "b@example.com", "password": "pw", "kb_guid": "0f1e2d3c-0000-team", "workers": 3},
+            {"name": "nopass", "user_id": "c@example.com"},
+        ],
+    }
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+
+    with MockWizServer(SyntheticAccount(notes=6, images=1, attachments=0, categories=2)) as server:
+        monkeypatch.setattr(wiznote_downloader, "AS_URL", server.base_url)
+        exporter = BatchExporter.from_manifest(str(manifest_path), migrator_class=RecordingMigrator,
+                                               max_bandwidth=50)
+        assert exporter.resolve_passwords() == ["nopass"]
+        summary = exporter.run()
+
+    jobs = {job["name"]: job for job in summary["jobs"]}
+    assert jobs["me"]["status"] == jobs["b@example.com-0f1e2d3c"]["status"] == "ok"
+    assert jobs["nopass"]["status"] == "skipped"
+    assert jobs["me"]["succeeded"] == jobs["b@example.com-0f1e2d3c"]["succeeded"] == 6
+    assert summary["totals"]["notes"] == 12 and summary["totals"]["completed"] == 2
+    assert summary["totals"]["bytes"] > 0 and summary["budget"]["concurrency"] == 6
+
+    # 每个任务独立的下载目录和状态库，共用同一个并发信号量和限速器
+    for name in ("me", "b@example.com-0f1e2d3c"):
+        assert (tmp_path / "batch" / name / STATE_DB_NAME).exists()
+        assert (tmp_path / "batch" / name / "download_report.md").exists()
+    assert {kb for _, kb, _, _ in seen} == {"mock-kb", "0f1e2d3c-0000-team"}
+    assert len({id(sem) for _, _, sem, _ in seen}) == 1
+    assert len({id(limiter) for _, _, _, limiter in seen}) == 1
+    assert exporter.budget.bandwidth.bytes > 0
+
+    report = (tmp_path / "batch" / "batch_report.md").read_text(encoding="utf-8")
+    assert "| me | a@example.com | 完成 | 6/6 |" in report
+    saved = json.loads((tmp_path / "batch" / "batch_summary.json").read_text(encoding="utf-8"))
+    assert saved["totals"]["jobs"] == 3
+
+
+def test_batch_manifest_rejects_unknown_options_and_duplicate_outputs():
+    with pytest.raises(ValueError, match="engine"):
+        BatchExporter.parse_manifest({"jobs": [{"user_id": "a", "engine": "async"}]})
+    with pytest.raises(ValueError, match="重复"):
+        BatchExporter.parse_manifest({"jobs": [{"user_id": "a"}, {"user_id": "b", "name": "a"}]})
+    with pytest.raises(ValueError, match="user_id"):
+        BatchExporter.parse_manifest({"jobs": [{"name": "x"}]})
+
+
+def test_bandwidth_limiter_spaces_chunks_by_size():
+    now = [100.0]
+    limiter = BandwidthLimiter(1000, burst=0.5, clock=lambda: now[0])
+    assert limiter.reserve(500) == 0.0        # 突发额度内不等待
+    assert limiter.reserve(1000) == pytest.approx(1.0)
+    now[0] += 10                              # 空闲后额度只恢复到 burst
+    assert limiter.reserve(500) == 0.0
+    assert limiter.reserve(500) == pytest.approx(0.5)
+    assert BandwidthLimiter(0).reserve(10 ** 9) == 0.0
+
+
+def test_http_cache_serves_rerun_metadata_from_disk(tmp_path, monkeypatch):
+    from tools.mock_wiz_server import MockWizServer, SyntheticAccount
+
+    cache_path = tmp_path / "http_cache.db"
+    cached_endpoints = {"categories", "note_list", "note_view", "resource_list", "attachment_list"}
+
+    def export(output):
+        migrator = WizMigrator("u", "p", output_base=str(tmp_path / output), rate=0, max_workers=2,
+                               convert_processes=0, http_cache=str(cache_path))
+        cache = migrator.response_cache
+        migrator.run()
+        return migrator, cache
+
+    account = SyntheticAccount(notes=6, images=1, attachments=1, categories=2, zip_ratio=0, lite_ratio=0.5)
+    with MockWizServer(account) as server:
+        monkeypatch.setattr(wiznote_downloader, "AS_URL", server.base_url)
+        first, first_cache = export("first")
+        second, second_cache = export("second")
+
+    assert cached_endpoints <= set(first.metrics.snapshot()["endpoints"])
+    assert first_cache.hits == 0 and first_cache.stored > 0
+    # 第二次运行的分类、列表、正文和资源/附件列表全部来自缓存
+    assert not cached_endpoints & set(second.metrics.snapshot()["endpoints"])
+    assert second_cache.hits == first_cache.stored
+    assert second.success_count == 6
+    assert (tmp_path / "second" / "Folder0" / "Note 0.md").read_text(encoding="utf-8") == \
+        (tmp_path / "first" / "Folder0" / "Note 0.md").read_text(encoding="utf-8")
+
+
+def test_response_cache_validates_version_ttl_and_evicts_lru(tmp_path):
+    now = [1000.0]
+    cache = ResponseCache(tmp_path / "cache.db", ttl=60, max_bytes=300, clock=lambda: now[0])
+    key = ResponseCache.key("http://kb/ks/note/view/kb/doc", {"b": 2, "a": 1})
+    assert key == ResponseCache.key("http://kb/ks/note/view/kb/doc", {"a": 1, "b": 2})
+
+    cache.put(key, b"v1 body", version="1|100")
+    now[0] += 10 ** 6                                   # 带版本的条目不受 TTL 限制
+    assert cache.get(key, "1|100") == b"v1 body"
+    assert cache.get(key, "2|200") is None              # 笔记已修改
+
+    cache.put("list", b"page")
+    assert cache.get("list") == b"page"
+    now[0] += 61
+    assert cache.get("list") is None                    # 列表页过期
+
+    assert not ResponseCache.cacheable(200, b'{"returnCode": 301}')
+    assert not ResponseCache.cacheable(500, b'{}')
+    assert ResponseCache.cacheable(200, b'<html></html>')
+
+    cache.close()
+
+    cache = ResponseCache(tmp_path / "lru.db", ttl=60, max_bytes=300, clock=lambda: now[0])
+    for name in ("a", "b", "c"):
+        now[0] += 1
+        cache.put(name, b"x" * 100)
+    now[0] += 1
+    assert cache.get("a") == b"x" * 100                 # a 最近被访问，淘汰更早的 b
+    cache.put("d", b"x" * 100)
+    assert cache.get("b") is None and cache.get("a") is not None
+    assert cache.total_bytes <= 300 and cache.evicted >= 1
+    cache.close()
+
+    reopened = ResponseCache(tmp_path / "lru.db", ttl=60, max_bytes=300, clock=lambda: now[0])
+    assert reopened.get("d") == b"x" * 100
+    reopened.close()
+
+
+def test_archive_and_replay_reconvert_without_network(tmp_path, monkeypatch):
+    from tools.mock_wiz_server import MockWizServer, SyntheticAccount
+
+    account = SyntheticAccount(notes=8, images=2, attachments=1, categories=2, zip_ratio=0.5, lite_ratio=0.25)
+    with MockWizServer(account) as server:
+        monkeypatch.setattr(wiznote_downloader, "AS_URL", server.base_url)
+        downloader = WizMigrator("u", "p", output_base=str(tmp_path / "download"), rate=0,
+                                 max_workers=2, convert_processes=0, archive=True)
+        downloader.run()
+        served = server.snapshot()["requests"]
+
+        archive_dir = tmp_path / "download" / wiznote_downloader.ARCHIVE_DIR_NAME
+        replayer = WizMigrator(None, None, output_base=str(tmp_path / "replayed"), convert_processes=0)
+        monkeypatch.setattr(WizMigrator, "clean_opening_title",
+                            staticmethod(lambda md_content, title: "<!-- replayed -->\n" + md_content))
+        replayer.replay(str(archive_dir))
+        assert server.snapshot()["requests"] == served  # 重放不访问服务器
+
+    assert replayer.success_count == 8
+    assert replayer.total_attachments_downloaded == downloader.total_attachments_downloaded == 8
+    original = sorted(p.relative_to(tmp_path / "download").as_posix()
+                      for p in (tmp_path / "download").rglob("*")
+                      if p.is_file() and not any(part.startswith(".") for part in p.parts[len(tmp_path.parts):])
+                      and p.suffix not in (".md", ".json", ".jsonl"))
+    assert len(original) == 8 * 2 + 8  # 图片和附件
+    for rel in original:
+        assert (tmp_path / "replayed" / rel).read_bytes() == (tmp_path / "download" / rel).read_bytes()
+    note = (tmp_path / "replayed" / "Folder0" / "Note 0.md").read_text(encoding="utf-8")
+    assert "<!-- replayed -->" in note and "## 📎 附件" in note
+
+    # 归档记录来源目录：可以写回来源目录，但拒绝覆盖其他非空目录
+    assert wiznote_downloader.NoteArchive.source_of(archive_dir) == (tmp_path / "download").resolve()
+    other = tmp_path / "other_export"
+    other.mkdir()
+    (other / "keep.md").write_text("mine", encoding="utf-8")
+    refused = WizMigrator(None, None, output_base=str(other), convert_processes=0)
+    refused.replay(str(archive_dir))
+    assert refused.success_count == 0
+    assert [p.name for p in other.iterdir()] == ["keep.md"]
+    rewritten = WizMigrator(None, None, output_base=str(tmp_path / "download"), convert_processes=0)
+    rewritten.replay(str(archive_dir))
+    assert rewritten.success_count == 8
+    assert "<!-- replayed -->" in (tmp_path / "download" / "Folder0" / "Note 0.md").read_text(encoding="utf-8")
+
+
+def test_resume_keeps_previous_results_in_journal_and_report(tmp_path):
+    output_base = tmp_path / "wiznote_download"
+    state = DownloadState(output_base / STATE_DB_NAME)
+    state.set_value("categories:kb", ["/x/"])
+    state.record_listing("kb", [
+        {"docGuid": "g1", "title": "One", "category": "/x/"},
+        {"docGuid": "g2", "title": "Two", "category": "/x/"},
+        {"docGuid": "g3", "title": "Three", "category": "/x/"},
+    ])
+    state.mark_category_scanned("kb", "/x/")
+    state.close()
+    body = RoutedResponse({"returnCode": 200, "result": {"html": "<p>Body</p>"}})
+    routes = {"/ks/note/view/kb/g1": body, "/ks/note/view/kb/g2": body,
+              "/ks/note/view/kb/g3": RoutedResponse(status_code=500, content=b"down")}
+
+    first = make_logged_in_migrator(tmp_path, routes, resume=True, max_retries=1)
+    first.run()
+    assert (first.success_count, len(first.failed_notes)) == (2, 1)
+
+    routes["/ks/note/view/kb/g3"] = body
+    second = make_logged_in_migrator(tmp_path, routes, resume=True, max_retries=1)
+    second.run()
+
+    # 只重新处理上次失败的笔记；报告仍统计整个导出，旧的失败记录被新结果取代
+    assert [url for url in second.session.calls if "/ks/note/view/" in url] == ["https://ks.example.com/ks/note/view/kb/g3"]
+    lines = [json.loads(line) for line in
+             (output_base / "download_results.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert sorted((line["note_guid"], line["kind"]) for line in lines) == [
+        ("g1", "success"), ("g2", "success"), ("g3", "success")]
+    report = (output_base / "download_report.md").read_text(encoding="utf-8")
+    assert "- 总数: 3 个" in report and "- 成功: 3 个" in report and "- 失败: 0 个" in report
+    assert second.success_count == 3
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+WizNote 下载器端到端基准测试
+
+在本地启动模拟服务器（mock_wiz_server.py）并生成合成账号，然后用 WizMigrator.run
+完整下载一遍，报告：
+  - 吞吐量：笔记/秒、字节/秒（服务器发送的字节数）
+  - 单篇笔记耗时：p50 / p99（从开始处理到结果记录）
+  - 峰值内存（RSS）：本进程和已退出的子进程（转换进程池）
+
+也可以用 --server 指向单独运行的 mock_wiz_server.py（服务器不与下载器争抢 CPU）。
+
+用法：
+  python3 tools/benchmark_downloader.py                                   # 默认 200 篇笔记
+  python3 tools/benchmark_downloader.py --notes 1000 --images 4 --latency 0.02
+  python3 tools/benchmark_downloader.py --engine async --concurrency 32
+  python3 tools/benchmark_downloader.py --workers 8 --convert-processes 4 --json bench.json
+  python3 tools/benchmark_downloader.py --server http://127.0.0.1:8765
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from urllib.request import urlopen
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False  # Windows 上不提供峰值内存
+
+try:
+    import mock_wiz_server
+    import wiznote_downloader
+except ImportError:
+    from tools import mock_wiz_server, wiznote_downloader
+
+
+class BenchmarkMigrator(wiznote_downloader.WizMigrator):
+    """记录每篇笔记从开始处理（_prepare_note）到结果记录（_record_note_state）的耗时"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timing_lock = threading.Lock()
+        self.note_started = {}
+        self.note_latencies = []
+
+    def _prepare_note(self, note, output_base):
+        guid = wiznote_downloader.DownloadState.note_guid(note)
+        with self.timing_lock:
+            self.note_started[guid] = time.perf_counter()
+        return super()._prepare_note(note, output_base)
+
+    def _record_note_state(self, note, result):
+        super()._record_note_state(note, result)
+        guid = wiznote_downloader.DownloadState.note_guid(note)
+        with self.timing_lock:
+            started = self.note_started.pop(guid, None)
+            if started is not None:
+                self.note_latencies.append(time.perf_counter() - started)
+
+
+def percentile(values, pct):
+    """最近秩法计算百分位数；values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def peak_rss_mb():
+    """返回 (本进程峰值 RSS, 已退出子进程的最大峰值 RSS)，单位 MB；不支持时返回 (None, None)"""
+    if not RESOURCE_AVAILABLE:
+        return None, None
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+
+def fetch_server_stats(base_url):
+    with urlopen(f"{base_url}/__stats", timeout=10) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def run_benchmark(account=None, server_options=None, server_url=None, output_dir=None,
+                  quiet=True, **migrator_options):
+    """
+    对模拟服务器运行一次完整下载，返回结果字典
+
+    account / server_options 用于在本进程内启动模拟服务器；给出 server_url 时改为使用已运行的服务器。
+    migrator_options 原样传给 WizMigrator（workers 以 max_workers 传入）。
+    """
+    server = None
+    if server_url is None:
+        server = mock_wiz_server.MockWizServer(account or mock_wiz_server.SyntheticAccount(),
+                                               **(server_options or {}))
+        server_url = server.start()
+
+    previous_as_url = wiznote_downloader.AS_URL
+    wiznote_downloader.AS_URL = server_url
+    temp_dir = None
+    if output_dir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="wiz-bench-")
+        output_dir = temp_dir.name
+    try:
+        before = fetch_server_stats(server_url)
+        migrator = BenchmarkMigrator("bench@example.com", "password",
+                                     output_base=os.path.join(output_dir, "wiznote_download"),
+                                     **migrator_options)
+        started = time.perf_counter()
+        if quiet:
+            with open(os.devnull, "w", encoding="utf-8") as devnull, redirect_stdout(devnull):
+                migrator.run()
+        else:
+            migrator.run()
+        elapsed = time.perf_counter() - started
+        after = fetch_server_stats(server_url)
+    finally:
+        wiznote_downloader.AS_URL = previous_as_url
+        if server is not None:
+            server.stop()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    latencies = migrator.note_latencies
+    notes = len(latencies)
+    bytes_received = after["bytes_sent"] - before["bytes_sent"]
+    rss, children_rss = peak_rss_mb()
+    return {
+        "engine": migrator.engine,
+        "notes": notes,
+        "succeeded": migrator.success_count,
+        "failed": len(migrator.failed_notes),
+        "images": migrator.total_images_downloaded,
+        "attachments": migrator.total_attachments_downloaded,
+        "elapsed": elapsed,
+        "requests": after["requests"] - before["requests"],
+        "bytes": bytes_received,
+        "notes_per_sec": notes / elapsed if elapsed > 0 else 0.0,
+        "bytes_per_sec": bytes_received / elapsed if elapsed > 0 else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies) if latencies else None,
+        "errors_injected": after["errors_injected"] - before["errors_injected"],
+        "throttled": after["throttled"] - before["throttled"],
+        "peak_rss_mb": rss,
+        "peak_child_rss_mb": children_rss,
+        "endpoints": migrator.metrics.snapshot()["endpoints"],  # 下载器按接口的请求统计
+    }
+
+
+def print_report(report):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.1f} ms"
+
+    def mb(value):
+        return "-" if value is None else f"{value:.1f} MB"
+
+    print(f"\n{'='*70}")
+    print(f"📈 基准测试结果（{report['engine']} 引擎）")
+    print(f"{'='*70}")
+    print(f"  📝 笔记: {report['notes']} 篇（成功 {report['succeeded']}，失败 {report['failed']}），"
+          f"图片 {report['images']} 张，附件 {report['attachments']} 个")
+    print(f"  ⏱️  耗时: {report['elapsed']:.2f} 秒，请求 {report['requests']} 次")
+    print(f"  🚀 吞吐量: {report['notes_per_sec']:.1f} 篇/秒，"
+          f"{report['bytes_per_sec'] / 1024 / 1024:.2f} MB/秒（共 {report['bytes'] / 1024 / 1024:.1f} MB）")
+    print(f"  ⏳ 单篇耗时: p50 {ms(report['latency_p50'])}，p99 {ms(report['latency_p99'])}，"
+          f"最大 {ms(report['latency_max'])}")
+    if report["errors_injected"] or report["throttled"]:
+        print(f"  💥 注入故障: 500 错误 {report['errors_injected']} 次，429 限流 {report['throttled']} 次")
+    print(f"  💾 峰值内存: 本进程 {mb(report['peak_rss_mb'])}，子进程 {mb(report['peak_child_rss_mb'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='WizNote 下载器端到端基准测试（使用本地模拟服务器）',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument('--server', help='使用已运行的 mock_wiz_server.py（如 http://127.0.0.1:8765），不在本进程启动')
+    parser.add_argument('--output', help='下载目录（默认使用临时目录，结束后删除）')
+    parser.add_argument('--json', help='把结果写入 JSON 文件')
+    parser.add_argument('--verbose', action='store_true', help='显示下载器的输出')
+    mock_wiz_server.add_account_arguments(parser)
+
+    group = parser.add_argument_group("下载器参数（同 wiznote_downloader.py）")
+    group.add_argument('--engine', choices=['thread', 'async'], default='thread')
+    group.add_argument('--workers', type=int, default=wiznote_downloader.DEFAULT_MAX_WORKERS)
+    group.add_argument('--concurrency', type=int, default=wiznote_downloader.DEFAULT_CONCURRENCY)
+    group.add_argument('--per-host', type=int, default=wiznote_downloader.DEFAULT_PER_HOST_LIMIT)
+    group.add_argument('--list-workers', type=int, default=wiznote_downloader.DEFAULT_LIST_WORKERS)
+    group.add_argument('--convert-processes', type=int, default=wiznote_downloader.DEFAULT_CONVERT_PROCESSES)
+    group.add_argument('--rate', type=float, default=0,
+                       help='自适应限速初始速率（默认: 0，不限速，测量下载器本身的上限）')
+    group.add_argument('--retries', type=int, default=wiznote_downloader.DEFAULT_MAX_RETRIES)
+    group.add_argument('--no-asset-store', action='store_true')
+    args = parser.parse_args()
+
+    account = None if args.server else mock_wiz_server.account_from_args(args)
+    report = run_benchmark(
+        account=account,
+        server_options=mock_wiz_server.server_options_from_args(args),
+        server_url=args.server.rstrip("/") if args.server else None,
+        output_dir=args.output,
+        quiet=not args.verbose,
+        engine=args.engine,
+        max_workers=args.workers,
+        concurrency=args.concurrency,
+        per_host_limit=args.per_host,
+        list_workers=args.list_workers,
+        convert_processes=args.convert_processes,
+        rate=args.rate,
+        max_retries=args.retries,
+        asset_store=not args.no_asset_store,
+    )
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 结果已写入: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -24,6 +24,11 @@ from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Optional, Set, Tuple
 
+try:
+    from file_hash_cache import FileHashCache
+except ImportError:
+    from tools.file_hash_cache import FileHashCache
+
 
 # 默认匹配的目录名（可通过 config.json 的 cleanup.resource_dir_names 覆盖）
 _RESOURCE_DIR_NAMES = {"attachments", "images", "all_image", "all_images"}
@@ -58,10 +63,13 @@ if "resource_dir_suffixes" in _cleanup_cfg:
 class AttachmentConsolidator:
     """附件整合器"""
 
-    def __init__(self, vault_dir: str, dry_run: bool = False):
+    def __init__(self, vault_dir: str, dry_run: bool = False, hash_cache=True):
         self.vault_dir = Path(vault_dir).resolve()
         self.dry_run = dry_run
         self.target_dir = self.vault_dir / "attachments"
+        # 同名文件比较用的哈希缓存：True 为仓库内默认位置，字符串为自定义路径，False 只在本次运行内缓存
+        self.hash_cache_setting = hash_cache
+        self._hash_cache: Optional[FileHashCache] = None
 
         # 统计
         self.scanned_dirs: List[Path] = []
@@ -155,6 +163,8 @@ class AttachmentConsolidator:
         print(f"\n📦 第1步：移动文件到 {self.target_dir.relative_to(self.vault_dir)}/")
         self.target_dir.mkdir(parents=True, exist_ok=True)
         self._move_all_files()
+        if self._hash_cache is not None:
+            self._hash_cache.flush()
 
         # 3. 更新 Markdown 引用
         print(f"\n📝 第2步：更新 Markdown 引用")
@@ -457,11 +467,16 @@ class AttachmentConsolidator:
                     md_files.append(root_path / f)
         return md_files
 
+    @property
+    def hash_cache(self) -> FileHashCache:
+        """首次遇到同名文件时才打开"""
+        if self._hash_cache is None:
+            self._hash_cache = FileHashCache.for_vault(self.vault_dir, self.hash_cache_setting)
+        return self._hash_cache
+
     def _files_identical(self, a: Path, b: Path) -> bool:
-        """比较两个文件内容是否相同"""
-        if a.stat().st_size != b.stat().st_size:
-            return False
-        return a.read_bytes() == b.read_bytes()
+        """比较两个文件内容是否相同（先比较大小，再比较缓存的内容哈希，不再整个读入内存）"""
+        return self.hash_cache.identical(a, b)
 
     def _unique_path(self, path: Path) -> Path:
         """生成唯一路径，避免覆盖"""
@@ -542,6 +557,8 @@ def main():
     )
     parser.add_argument("mode", choices=["scan", "dry-run", "migrate"], help="运行模式")
     parser.add_argument("vault_dir", help="Obsidian Vault 目录路径")
+    parser.add_argument("--no-hash-cache", action="store_true",
+                        help="不读写 .obsidian/vault_tools_hashes.db 文件哈希缓存")
 
     args = parser.parse_args()
 
@@ -558,7 +575,8 @@ def main():
             sys.exit(0)
 
     is_dry_run = args.mode == "dry-run"
-    consolidator = AttachmentConsolidator(str(vault), dry_run=(args.mode != "scan" and is_dry_run))
+    consolidator = AttachmentConsolidator(str(vault), dry_run=(args.mode != "scan" and is_dry_run),
+                                          hash_cache=not args.no_hash_cache)
 
     if args.mode == "scan":
         result = consolidator.scan()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+持久化文件哈希缓存（vault_cleaner / obsidian_health_check / smart_migrate_to_obsidian /
+consolidate_attachments 共用）
+
+以 (路径, 大小, mtime_ns, inode) 为键把文件哈希保存在 SQLite 中（默认位于仓库的
+.obsidian/vault_tools_hashes.db，各工具扫描时都会跳过 .obsidian）。再次运行时只要文件的
+大小、修改时间和 inode 都没变就直接返回缓存的哈希，不读取文件内容；任一项变化即重新计算。
+
+两种哈希（均为 BLAKE2b）：
+  full     完整内容，HASH_BUFFER_SIZE 大块读取
+  partial  头尾各 PARTIAL_HASH_SIZE 字节；不超过两倍大小的文件即整个文件（与 full 的值不同）
+
+修改时间距现在不足 RACY_WINDOW_NS 的文件只计算不缓存：同一时间粒度内的再次修改可能
+不改变 mtime，缓存这样的结果可能在下次运行时返回过期的哈希（本次运行内仍会记住）。
+
+hash_many() 并行计算一批文件的哈希，结果与输入顺序一致：
+  thread   线程池（默认）；hashlib 计算和文件读取都会释放 GIL，NVMe 上可用满多核，
+           网络挂载盘上可同时发出多个读请求
+  process  进程池；缓存查询仍在主进程，只把未命中的文件交给子进程计算
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+
+HASH_CACHE_PATH = Path(".obsidian") / "vault_tools_hashes.db"  # 相对于仓库根目录
+PARTIAL_HASH_SIZE = 64 * 1024     # 部分哈希头尾各读取的字节数
+HASH_BUFFER_SIZE = 1024 * 1024    # 完整哈希的读取块大小
+HASH_DIGEST_SIZE = 20             # BLAKE2b 摘要长度（字节）
+RACY_WINDOW_NS = 2 * 10**9        # 刚修改过的文件不缓存
+COMMIT_EVERY = 1000               # 每写入多少条提交一次
+HASH_MODES = ("thread", "process")
+DEFAULT_HASH_WORKERS = min(32, (os.cpu_count() or 1) + 4)  # 与 ThreadPoolExecutor 的默认值相同
+
+
+def full_digest(path: Union[str, Path], size: int = 0) -> Tuple[str, int]:
+    """计算文件完整内容的 BLAKE2b，返回 (摘要, 读取的字节数)"""
+    hasher = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    read = 0
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buffer):
+            hasher.update(view[:n])
+            read += n
+    return hasher.hexdigest(), read
+
+
+def partial_digest(path: Union[str, Path], size: int) -> Tuple[str, int]:
+    """计算文件头尾各 PARTIAL_HASH_SIZE 字节的 BLAKE2b（小文件读取全部内容），返回 (摘要, 读取的字节数)"""
+    hasher = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    with open(path, "rb") as f:
+        if size <= 2 * PARTIAL_HASH_SIZE:
+            data = f.read()
+            hasher.update(data)
+            return hasher.hexdigest(), len(data)
+        head = f.read(PARTIAL_HASH_SIZE)
+        f.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+        tail = f.read(PARTIAL_HASH_SIZE)
+    hasher.update(head)
+    hasher.update(tail)
+    return hasher.hexdigest(), len(head) + len(tail)
+
+
+def _compute(kind: str, path: str, size: int) -> Tuple[str, int]:
+    """进程池中执行的哈希计算（模块级函数，可被 pickle）"""
+    return FileHashCache.KINDS[kind](path, size)
+
+
+class FileHashCache:
+    """按 (路径, 大小, mtime_ns, inode) 失效的文件哈希缓存（线程安全）
+
+    path 为 None 时只缓存在内存中（本次运行内有效）。stats 记录命中、计算次数和实际读取的字节数。
+    """
+
+    KINDS = {"full": full_digest, "partial": partial_digest}
+
+    def __init__(self, path: Optional[Union[str, Path]] = None):
+        self.path = Path(path) if path else None
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path) if self.path else ":memory:", check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            if self.path:
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS hashes (
+                    path TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (path, kind)
+                )
+            """)
+            self.conn.commit()
+        self.pending = 0
+        self.memo = {}  # 本次运行内算过的哈希（含不写入数据库的刚修改文件）：(路径, 类型) -> (签名, 摘要)
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "bytes_read": 0}
+
+    @classmethod
+    def for_vault(cls, vault_dir: Union[str, Path], setting: Union[bool, str, Path] = True) -> "FileHashCache":
+        """按命令行设置打开缓存：True 使用仓库内的默认位置，字符串为自定义路径，False 只缓存在内存中"""
+        if setting is False or setting is None:
+            return cls(None)
+        if setting is True:
+            return cls(Path(vault_dir) / HASH_CACHE_PATH)
+        return cls(Path(setting).expanduser())
+
+    def full_hash(self, path: Union[str, Path]) -> Optional[str]:
+        """文件完整内容的哈希；文件不可读时返回 None"""
+        return self._lookup(path, "full")
+
+    def partial_hash(self, path: Union[str, Path]) -> Optional[str]:
+        """文件头尾的哈希；文件不可读时返回 None"""
+        return self._lookup(path, "partial")
+
+    def identical(self, a: Union[str, Path], b: Union[str, Path]) -> bool:
+        """两个文件内容是否相同（先比较大小，再比较缓存的完整哈希）"""
+        try:
+            if os.stat(a).st_size != os.stat(b).st_size:
+                return False
+        except OSError:
+            return False
+        digest = self.full_hash(a)
+        return digest is not None and digest == self.full_hash(b)
+
+    def hash_many(self, paths: Iterable[Union[str, Path]], kind: str = "full",
+                  workers: int = DEFAULT_HASH_WORKERS, mode: str = "thread",
+                  progress: Optional[Callable[[int, int], None]] = None) -> List[Optional[str]]:
+        """并行计算一批文件的哈希，返回与 paths 顺序一致的列表（不可读的文件为 None）
+
+        progress(已完成数, 总数) 在每个文件完成后调用（在主线程中）。
+        """
+        if mode not in HASH_MODES:
+            raise ValueError(f"未知的哈希并行方式: {mode}（可选: {', '.join(HASH_MODES)}）")
+        paths = list(paths)
+        total = len(paths)
+        results: List[Optional[str]] = [None] * total
+        if workers <= 1 or total <= 1:
+            for index, path in enumerate(paths):
+                results[index] = self._lookup(path, kind)
+                if progress:
+                    progress(index + 1, total)
+            return results
+
+        if mode == "thread":
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(self._lookup, path, kind): index for index, path in enumerate(paths)}
+                for done, future in enumerate(as_completed(futures), 1):
+                    results[futures[future]] = future.result()
+                    if progress:
+                        progress(done, total)
+            return results
+
+        done = 0
+        pending = []
+        for index, path in enumerate(paths):
+            key, signature, digest = self._cached(path, kind)
+            if digest is not None or signature is None:
+                results[index] = digest
+                done += 1
+                if progress:
+                    progress(done, total)
+            else:
+                pending.append((index, key, signature))
+        if not pending:
+            return results
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+            futures = {pool.submit(_compute, kind, key, signature[0]): (index, key, signature)
+                       for index, key, signature in pending}
+            for future in as_completed(futures):
+                index, key, signature = futures[future]
+                try:
+                    digest, read = future.result()
+                except OSError:
+                    digest = None
+                else:
+                    digest = self._store(key, kind, signature, digest, read)
+                results[index] = digest
+                done += 1
+                if progress:
+                    progress(done, total)
+        return results
+
+    def _lookup(self, path: Union[str, Path], kind: str) -> Optional[str]:
+        key, signature, digest = self._cached(path, kind)
+        if digest is not None or signature is None:
+            return digest
+        try:
+            digest, read = self.KINDS[kind](key, signature[0])
+        except OSError:
+            return None
+        return self._store(key, kind, signature, digest, read)
+
+    def _cached(self, path: Union[str, Path], kind: str) -> Tuple[str, Optional[tuple], Optional[str]]:
+        """返回 (绝对路径, 当前签名, 缓存的摘要)；文件不存在时签名为 None，未命中时摘要为 None"""
+        key = os.path.abspath(path)
+        try:
+            st = os.stat(key)
+        except OSError:
+            return key, None, None
+        signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+        with self.lock:
+            remembered = self.memo.get((key, kind))
+            if remembered and remembered[0] == signature:
+                self.stats["hits"] += 1
+                return key, signature, remembered[1]
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, inode, digest FROM hashes WHERE path = ? AND kind = ?",
+                (key, kind),
+            ).fetchone()
+            if row and tuple(row[:3]) == signature:
+                self.stats["hits"] += 1
+                return key, signature, row[3]
+        return key, signature, None
+
+    def _store(self, key: str, kind: str, signature: tuple, digest: str, read: int) -> str:
+        """记录计算结果；计算期间文件发生变化时只返回结果，不缓存"""
+        try:
+            after = os.stat(key)
+            unchanged = (after.st_size, after.st_mtime_ns, after.st_ino) == signature
+        except OSError:
+            unchanged = False
+        with self.lock:
+            self.stats["misses"] += 1
+            self.stats["bytes_read"] += read
+            if not unchanged:
+                return digest
+            self.memo[(key, kind)] = (signature, digest)
+            if time.time_ns() - signature[1] > RACY_WINDOW_NS:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO hashes (path, kind, size, mtime_ns, inode, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, kind) + signature + (digest,),
+                )
+                self.stats["stored"] += 1
+                self.pending += 1
+                if self.pending >= COMMIT_EVERY:
+                    self.conn.commit()
+                    self.pending = 0
+        return digest
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self.conn.commit()
+                self.pending = 0
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
+
+    def describe(self) -> str:
+        stats = self.stats
+        return (f"哈希缓存: 命中 {stats['hits']}，计算 {stats['misses']}，"
+                f"读取 {stats['bytes_read'] / 1024 / 1024:.1f} MB")
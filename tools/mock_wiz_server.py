@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+WizNote 本地模拟服务器
+
+按参数生成一个合成账号（N 篇笔记、每篇 M 张图片/附件、大小按对数正态分布），
+在本地提供 wiznote_downloader.py 用到的接口，用于在没有真实账号时测量下载性能：
+
+  POST /as/user/login                              登录
+  GET  /ks/category/all/<kb>                       分类列表
+  GET  /ks/note/list/category/<kb>                 分类下的笔记（分页）
+  GET  /ks/note/download/<kb>/<doc>                ZIP 笔记包；带 downloadData 参数时返回资源列表
+  GET  /ks/note/view/<kb>/<doc>                    笔记正文
+  GET  /ks/note/attachments/<kb>/<doc>             附件列表
+  GET  /ks/attachment/download/<kb>/<doc>/<att>    附件内容
+  GET  /res/<doc>/<name>                           图片内容
+  GET  /__stats                                    服务器统计（请求数、发送字节数、注入的错误数）
+
+可以注入延迟（--latency/--jitter）、服务器错误（--error-rate，返回 500）和
+限流（--throttle-rate，返回 429 + Retry-After）。
+
+相同参数和 --seed 生成的账号完全相同，便于对比不同下载参数的结果。
+
+用法：
+  python3 tools/mock_wiz_server.py --notes 500 --images 3 --port 8765
+  python3 tools/mock_wiz_server.py --notes 200 --attachments 1 --latency 0.05 --error-rate 0.01
+  python3 tools/benchmark_downloader.py --server http://127.0.0.1:8765   # 对这个服务器运行基准测试
+"""
+import argparse
+import io
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MOCK_TOKEN = "mock-token"
+MOCK_KB_GUID = "mock-kb"
+MOCK_USER_GUID = "mock-user"
+FILLER_BLOCK_SIZE = 64 * 1024
+LOREM = ("WizNote mock paragraph used to pad synthetic notes to the requested size. "
+         "为合成笔记填充内容的段落。")
+
+
+def lognormal_size(rng, mean, sigma):
+    """按对数正态分布生成一个大小（字节），期望值约为 mean；sigma 为 0 时固定为 mean"""
+    if mean <= 0:
+        return 0
+    if sigma <= 0:
+        return int(mean)
+    mu = math.log(mean) - sigma * sigma / 2
+    return max(16, int(rng.lognormvariate(mu, sigma)))
+
+
+class SyntheticAccount:
+    """
+    合成的 WizNote 账号：分类、笔记列表和每篇笔记的资源
+
+    笔记内容在请求时按 (笔记, 资源名) 生成，不占用常驻内存；
+    每个资源的内容以自己的路径开头，不同资源的内容互不相同（资源存储不会误判为重复）。
+    """
+
+    def __init__(self, notes=100, images=2, attachments=0, categories=5,
+                 note_size=8 * 1024, image_size=64 * 1024, attachment_size=256 * 1024,
+                 size_sigma=0.5, zip_ratio=0.0, lite_ratio=0.0, seed=0):
+        rng = random.Random(seed)
+        self.kb_guid = MOCK_KB_GUID
+        self.categories = [f"/Folder{i}/" for i in range(max(1, categories))]
+        self.notes = []      # 笔记列表元数据（按分类分页返回）
+        self.details = {}    # guid -> 正文大小、类型、图片和附件
+        self.filler = rng.randbytes(FILLER_BLOCK_SIZE)
+        base_time = 1700000000000
+
+        for i in range(notes):
+            guid = f"note-{i:06d}"
+            roll = rng.random()
+            if roll < zip_ratio:
+                kind = "zip"
+            elif roll < zip_ratio + lite_ratio:
+                kind = "lite"
+            else:
+                kind = "html"
+            detail = {
+                "kind": kind,
+                "size": lognormal_size(rng, note_size, size_sigma),
+                "images": [(f"img-{i}-{j}.png", lognormal_size(rng, image_size, size_sigma))
+                           for j in range(images)],
+                "attachments": [(f"att-{i}-{j}", f"file-{i}-{j}.pdf",
+                                 lognormal_size(rng, attachment_size, size_sigma))
+                                for j in range(attachments)],
+            }
+            self.details[guid] = detail
+            self.notes.append({
+                "docGuid": guid,
+                "title": f"Note {i}",
+                "category": self.categories[i % len(self.categories)],
+                "type": "lite/markdown" if kind == "lite" else "document",
+                "version": 1,
+                "dataModified": base_time + i * 1000,
+                "created": base_time,
+                "encrypted": False,
+                # 与真实列表一样给出笔记数据大小和附件数（下载器据此安排下载顺序）
+                "dataSize": detail["size"] + sum(size for _, size in detail["images"]),
+                "attachmentCount": len(detail["attachments"]),
+            })
+
+    def notes_in(self, category):
+        return [note for note in self.notes if note["category"] == category]
+
+    def payload(self, guid, name, size):
+        """生成某个资源的内容（确定性，长度为 size）"""
+        head = f"{guid}/{name}\n".encode("utf-8")
+        repeat = size // FILLER_BLOCK_SIZE + 1
+        return (head + self.filler * repeat)[:size]
+
+    def note_body(self, guid):
+        """生成笔记正文：HTML（或 Lite 笔记的 Markdown），引用 index_files/ 下的图片"""
+        detail = self.details[guid]
+        lite = detail["kind"] == "lite"
+        paragraph = f"{LOREM}\n\n" if lite else f"<p>{LOREM}</p>\n"
+        count = max(1, detail["size"] // len(paragraph.encode("utf-8")))
+        text = paragraph * count
+        if lite:
+            images = "".join(f"![](index_files/{name})\n" for name, _ in detail["images"])
+            return f"# {guid}\n\n{text}{images}"
+        images = "".join(f'<img src="index_files/{name}">\n' for name, _ in detail["images"])
+        return f"<html><body><h1>{guid}</h1>\n{text}{images}</body></html>"
+
+    def note_package(self, guid):
+        """生成 ZIP 笔记包：index.html + index_files/ 下的图片和附件（下载器不再单独请求附件）"""
+        detail = self.details[guid]
+        files = detail["images"] + [(name, size) for _, name, size in detail["attachments"]]
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as z:
+            z.writestr("index.html", self.note_body(guid))
+            for name, size in files:
+                z.writestr(f"index_files/{name}", self.payload(guid, name, size))
+        return buffer.getvalue()
+
+    @property
+    def total_bytes(self):
+        """所有图片和附件的总大小（不含正文）"""
+        return sum(sum(size for _, size in detail["images"])
+                   + sum(size for _, _, size in detail["attachments"])
+                   for detail in self.details.values())
+
+
+class MockWizHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive，与真实服务器一样复用连接
+
+    ROUTES = [
+        ("categories", re.compile(r"^/ks/category/(?:all|list)/(?P<kb>[^/]+)$")),
+        ("note_list", re.compile(r"^/ks/note/list/category/(?P<kb>[^/]+)$")),
+        ("note_download", re.compile(r"^/ks/note/download/(?P<kb>[^/]+)/(?P<doc>[^/]+)$")),
+        ("note_view", re.compile(r"^/ks/note/view/(?P<kb>[^/]+)/(?P<doc>[^/]+)$")),
+        ("attachments", re.compile(r"^/ks/note/attachments/(?P<kb>[^/]+)/(?P<doc>[^/]+)$")),
+        ("attachment_download", re.compile(
+            r"^/ks/attachment/download/(?P<kb>[^/]+)/(?P<doc>[^/]+)/(?P<att>[^/]+)$")),
+        ("resource", re.compile(r"^/res/(?P<doc>[^/]+)/(?P<name>[^/]+)$")),
+    ]
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status=200, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(status, len(body))
+
+    def _base_url(self):
+        return f"http://{self.headers.get('Host')}"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlparse(self.path).path != "/as/user/login":
+            self._send({"returnCode": 404, "returnMessage": "not found"}, status=404)
+            return
+        self._send({"returnCode": 200, "result": {
+            "token": MOCK_TOKEN,
+            "kbGuid": self.server.account.kb_guid,
+            "kbServer": self._base_url(),
+            "userGuid": MOCK_USER_GUID,
+        }})
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == "/__stats":
+            self._send(self.server.snapshot())
+            return
+
+        self.server.delay()
+        fault = self.server.roll_fault()
+        if fault == "throttle":
+            self._send({"returnCode": 429, "returnMessage": "too many requests"}, status=429,
+                       headers={"Retry-After": "0"})
+            return
+        if fault == "error":
+            self._send({"returnCode": 500, "returnMessage": "injected error"}, status=500)
+            return
+
+        for route, pattern in self.ROUTES:
+            match = pattern.match(parsed.path)
+            if match:
+                break
+        else:
+            self._send({"returnCode": 404, "returnMessage": "not found"}, status=404)
+            return
+
+        if route != "resource" and self.headers.get("X-Wiz-Token") != MOCK_TOKEN:
+            self._send({"returnCode": 301, "returnMessage": "token invalid"}, status=401)
+            return
+
+        account = self.server.account
+        params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        doc = match.groupdict().get("doc")
+        if doc is not None and doc not in account.details:
+            self._send({"returnCode": 404, "returnMessage": "note not found"}, status=404)
+            return
+        getattr(self, f"_{route}")(account, match, params)
+
+    def _categories(self, account, match, params):
+        self._send({"returnCode": 200, "result": account.categories})
+
+    def _note_list(self, account, match, params):
+        notes = account.notes_in(params.get("category", "/"))
+        start = int(params.get("start", 0))
+        count = int(params.get("count", 100))
+        self._send({"returnCode": 200, "result": notes[start:start + count]})
+
+    def _note_download(self, account, match, params):
+        doc = match["doc"]
+        detail = account.details[doc]
+        if "downloadData" in params:
+            base = self._base_url()
+            resources = [{"name": name, "url": f"{base}/res/{doc}/{name}"} for name, _ in detail["images"]]
+            self._send({"returnCode": 200, "result": {"resources": resources}})
+        elif detail["kind"] == "zip":
+            self._send(account.note_package(doc), content_type="application/zip")
+        else:
+            self._send({"returnCode": 404, "returnMessage": "package not available"}, status=404)
+
+    def _note_view(self, account, match, params):
+        body = account.note_body(match["doc"])
+        key = "body" if account.details[match["doc"]]["kind"] == "lite" else "html"
+        self._send({"returnCode": 200, "result": {key: body}})
+
+    def _attachments(self, account, match, params):
+        attachments = [{"attGuid": att_guid, "name": name, "dataSize": size}
+                       for att_guid, name, size in account.details[match["doc"]]["attachments"]]
+        self._send({"returnCode": 200, "result": attachments})
+
+    def _attachment_download(self, account, match, params):
+        doc = match["doc"]
+        for att_guid, name, size in account.details[doc]["attachments"]:
+            if att_guid == match["att"]:
+                self._send(account.payload(doc, name, size), content_type="application/octet-stream")
+                return
+        self._send({"returnCode": 404, "returnMessage": "attachment not found"}, status=404)
+
+    def _resource(self, account, match, params):
+        doc = match["doc"]
+        for name, size in account.details[doc]["images"]:
+            if name == match["name"]:
+                self._send(account.payload(doc, name, size), content_type="image/png")
+                return
+        self._send({"returnCode": 404, "returnMessage": "resource not found"}, status=404)
+
+
+class MockWizServer(ThreadingHTTPServer):
+    """
+    在本地端口上提供合成账号的 WizNote 接口
+
+    可作为上下文管理器使用：进入时在后台线程启动，退出时关闭。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, account, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, throttle_rate=0.0, seed=0):
+        super().__init__((host, port), MockWizHandler)
+        self.account = account
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.errors_injected = 0
+        self.throttled = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中启动服务器，返回基础 URL"""
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-wiz-server", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle_error(self, request, client_address):
+        """客户端关闭空闲的 keep-alive 连接属于正常情况，不打印异常"""
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def delay(self):
+        """按配置的延迟（加上 0~jitter 的随机抖动）等待"""
+        if self.latency <= 0 and self.jitter <= 0:
+            return
+        with self.lock:
+            extra = self.rng.uniform(0, self.jitter) if self.jitter > 0 else 0
+        time.sleep(self.latency + extra)
+
+    def roll_fault(self):
+        """按概率决定本次请求是否注入故障：返回 "throttle"、"error" 或 None"""
+        if self.error_rate <= 0 and self.throttle_rate <= 0:
+            return None
+        with self.lock:
+            roll = self.rng.random()
+            if roll < self.throttle_rate:
+                self.throttled += 1
+                return "throttle"
+            if roll < self.throttle_rate + self.error_rate:
+                self.errors_injected += 1
+                return "error"
+        return None
+
+    def record(self, status, size):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += size
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "bytes_sent": self.bytes_sent,
+                "errors_injected": self.errors_injected,
+                "throttled": self.throttled,
+                "notes": len(self.account.notes),
+            }
+
+
+def add_account_arguments(parser):
+    """合成账号和故障注入的命令行参数（供模拟服务器和基准测试共用）"""
+    group = parser.add_argument_group("合成账号")
+    group.add_argument('--notes', type=int, default=200, help='笔记数（默认: 200）')
+    group.add_argument('--images', type=int, default=2, help='每篇笔记的图片数（默认: 2）')
+    group.add_argument('--attachments', type=int, default=0, help='每篇笔记的附件数（默认: 0）')
+    group.add_argument('--categories', type=int, default=5, help='分类数（默认: 5）')
+    group.add_argument('--note-size', type=int, default=8, help='正文平均大小/KB（默认: 8）')
+    group.add_argument('--image-size', type=int, default=64, help='图片平均大小/KB（默认: 64）')
+    group.add_argument('--attachment-size', type=int, default=256, help='附件平均大小/KB（默认: 256）')
+    group.add_argument('--size-sigma', type=float, default=0.5,
+                       help='大小分布（对数正态）的离散程度，0 表示所有文件同样大小（默认: 0.5）')
+    group.add_argument('--zip-ratio', type=float, default=0.0, help='以 ZIP 笔记包提供的笔记比例（默认: 0）')
+    group.add_argument('--lite-ratio', type=float, default=0.0, help='Lite/Markdown 笔记比例（默认: 0）')
+    group.add_argument('--seed', type=int, default=0, help='随机种子（默认: 0）')
+
+    group = parser.add_argument_group("服务器行为")
+    group.add_argument('--latency', type=float, default=0.0, help='每个请求的固定延迟/秒（默认: 0）')
+    group.add_argument('--jitter', type=float, default=0.0, help='额外的随机延迟上限/秒（默认: 0）')
+    group.add_argument('--error-rate', type=float, default=0.0, help='返回 500 的请求比例（默认: 0）')
+    group.add_argument('--throttle-rate', type=float, default=0.0, help='返回 429 的请求比例（默认: 0）')
+
+
+def account_from_args(args):
+    return SyntheticAccount(
+        notes=args.notes, images=args.images, attachments=args.attachments,
+        categories=args.categories, note_size=args.note_size * 1024,
+        image_size=args.image_size * 1024, attachment_size=args.attachment_size * 1024,
+        size_sigma=args.size_sigma, zip_ratio=args.zip_ratio, lite_ratio=args.lite_ratio,
+        seed=args.seed,
+    )
+
+
+def server_options_from_args(args):
+    return {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='WizNote 本地模拟服务器（用于下载性能测试）',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址（默认: 127.0.0.1）')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口（默认: 8765）')
+    add_account_arguments(parser)
+    args = parser.parse_args()
+
+    account = account_from_args(args)
+    server = MockWizServer(account, host=args.host, port=args.port, **server_options_from_args(args))
+    print(f"🧪 模拟账号: {len(account.notes)} 篇笔记，{len(account.categories)} 个分类，"
+          f"资源共 {account.total_bytes / 1024 / 1024:.1f} MB")
+    print(f"🌐 服务器地址: {server.base_url}")
+    print(f"   统计信息: {server.base_url}/__stats")
+    print("   按 Ctrl+C 停止")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
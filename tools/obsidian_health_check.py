@@ -7,15 +7,21 @@ Obsidian 仓库健康检查工具
     python3 obsidian_health_check.py --vault "/path/to/your/vault"
     python3 obsidian_health_check.py --quick  # 快速检查
     python3 obsidian_health_check.py --full   # 完整检查（包括相似度分析）
+    python3 obsidian_health_check.py --full --similarity dice   # 线性时间的 Dice 相似度（大仓库更快，不考虑段落顺序）
 """
 
 import os
 import re
-import hashlib
 from pathlib import Path
 from collections import defaultdict
 from datetime import datetime
-import difflib
+
+try:
+    from file_hash_cache import DEFAULT_HASH_WORKERS, HASH_MODES, FileHashCache
+    from text_similarity import DEFAULT_SIMILARITY, SIMILARITY_METHODS, SimilarityScorer, similar_pairs
+except ImportError:
+    from tools.file_hash_cache import DEFAULT_HASH_WORKERS, HASH_MODES, FileHashCache
+    from tools.text_similarity import DEFAULT_SIMILARITY, SIMILARITY_METHODS, SimilarityScorer, similar_pairs
 
 
 class ObsidianHealthChecker:
@@ -27,8 +33,17 @@ class ObsidianHealthChecker:
     MEDIA_EXTENSIONS = {'.mp3', '.mp4', '.mov', '.avi', '.wav', '.flac'}
     ARCHIVE_EXTENSIONS = {'.zip', '.rar', '.7z', '.tar', '.gz'}
 
-    def __init__(self, vault_path: str):
+    # 相似度超过该值认为是相似内容
+    SIMILARITY_THRESHOLD = 0.8
+
+    def __init__(self, vault_path: str, similarity: str = DEFAULT_SIMILARITY, hash_cache=True,
+                 hash_workers: int = DEFAULT_HASH_WORKERS, hash_mode: str = 'thread'):
         self.vault_path = Path(vault_path)
+        self.similarity = similarity
+        self.hash_cache_setting = hash_cache  # True: 仓库内默认位置；字符串: 自定义路径；False: 仅内存
+        self._hash_cache = None
+        self.hash_workers = hash_workers      # 并行计算哈希的线程/进程数（1 为串行）
+        self.hash_mode = hash_mode            # 'thread' 或 'process'
         self.results = {
             'score': 0,
             'check_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
@@ -75,14 +90,16 @@ class ObsidianHealthChecker:
         else:
             return '其他'
 
+    @property
+    def hash_cache(self) -> FileHashCache:
+        """文件哈希缓存，首次用到时才打开"""
+        if self._hash_cache is None:
+            self._hash_cache = FileHashCache.for_vault(self.vault_path, self.hash_cache_setting)
+        return self._hash_cache
+
     def get_file_hash(self, file_path: Path) -> str:
-        """计算文件内容的 MD5 哈希值"""
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            return hashlib.md5(content.encode('utf-8')).hexdigest()
-        except Exception as e:
-            return None
+        """计算文件内容的哈希值（BLAKE2b，大小/修改时间未变的文件使用缓存）"""
+        return self.hash_cache.full_hash(file_path)
 
     def get_content_normalized(self, file_path: Path) -> str:
         """获取标准化内容（去除空格、换行等）"""
@@ -259,11 +276,11 @@ class ObsidianHealthChecker:
             print(f"   ✅ 所有附件文件都存在")
 
     def _check_duplicate_files(self, md_files):
-        """检查完全相同的文件"""
+        """检查完全相同的文件（并行计算哈希，分组顺序与 md_files 一致）"""
         hash_map = defaultdict(list)
 
-        for md_file in md_files:
-            file_hash = self.get_file_hash(md_file)
+        hashes = self.hash_cache.hash_many(md_files, workers=self.hash_workers, mode=self.hash_mode)
+        for md_file, file_hash in zip(md_files, hashes):
             if file_hash:
                 hash_map[file_hash].append(md_file)
 
@@ -276,6 +293,8 @@ class ObsidianHealthChecker:
                     'count': len(files)
                 })
 
+        self.hash_cache.flush()
+
         if self.results['duplicates']['files']:
             print(f"   ⚠️  发现 {len(self.results['duplicates']['files'])} 组完全相同的文件")
         else:
@@ -304,27 +323,16 @@ class ObsidianHealthChecker:
             print(f"   ✅ 没有发现重复的文件名")
 
     def _check_similar_content(self, md_files):
-        """检查内容相似的文件"""
-        for i, file1 in enumerate(md_files):
-            content1 = self.get_content_normalized(file1)
-            if not content1:
-                continue
-
-            for file2 in md_files[i+1:]:
-                content2 = self.get_content_normalized(file2)
-                if not content2:
-                    continue
-
-                # 计算相似度
-                similarity = difflib.SequenceMatcher(None, content1, content2).ratio()
-
-                # 如果相似度超过 80%，认为是相似内容
-                if similarity > 0.8:
-                    self.results['duplicates']['content'].append({
-                        'file1': str(file1.relative_to(self.vault_path)),
-                        'file2': str(file2.relative_to(self.vault_path)),
-                        'similarity': f"{similarity*100:.1f}%"
-                    })
+        """检查内容相似的文件（每个文件只读取一次，按长度排序后用上界提前结束比较）"""
+        contents = [self.get_content_normalized(f) for f in md_files]
+        scorer = SimilarityScorer(self.SIMILARITY_THRESHOLD, self.similarity)
+        for i, j, similarity in similar_pairs(contents, scorer):
+            if similarity > self.SIMILARITY_THRESHOLD:
+                self.results['duplicates']['content'].append({
+                    'file1': str(md_files[i].relative_to(self.vault_path)),
+                    'file2': str(md_files[j].relative_to(self.vault_path)),
+                    'similarity': f"{similarity*100:.1f}%"
+                })
 
         if self.results['duplicates']['content']:
             print(f"   ⚠️  发现 {len(self.results['duplicates']['content'])} 对内容相似的文件")
@@ -594,6 +602,15 @@ def main():
                         default=os.getcwd())
     parser.add_argument('--quick', action='store_true', help='快速检查模式（跳过相似度分析）')
     parser.add_argument('--full', action='store_true', help='完整检查模式（包括相似度分析）')
+    parser.add_argument('--similarity', choices=SIMILARITY_METHODS, default=DEFAULT_SIMILARITY,
+                        help=f'相似度算法（默认 {DEFAULT_SIMILARITY}：SequenceMatcher；dice：线性时间，'
+                             f'但不考虑段落顺序，段落调换的笔记也会报告为相似）')
+    parser.add_argument('--no-hash-cache', action='store_true',
+                        help='不读写 .obsidian/vault_tools_hashes.db 文件哈希缓存')
+    parser.add_argument('--hash-workers', type=int, default=DEFAULT_HASH_WORKERS,
+                        help=f'并行计算哈希的线程/进程数（默认 {DEFAULT_HASH_WORKERS}，1 为串行）')
+    parser.add_argument('--hash-mode', choices=HASH_MODES, default='thread',
+                        help='并行方式：thread（默认）或 process')
 
     args = parser.parse_args()
 
@@ -604,7 +621,9 @@ def main():
         print(f"❌ 仓库路径不存在: {vault_path}")
         return
 
-    checker = ObsidianHealthChecker(vault_path)
+    checker = ObsidianHealthChecker(vault_path, similarity=args.similarity,
+                                    hash_cache=not args.no_hash_cache,
+                                    hash_workers=args.hash_workers, hash_mode=args.hash_mode)
     quick_mode = args.quick and not args.full
     checker.run_full_check(quick_mode=quick_mode)
 
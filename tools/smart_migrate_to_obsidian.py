@@ -7,30 +7,64 @@
 import os
 import re
 import shutil
-import hashlib
 from pathlib import Path
 from datetime import datetime
 
+try:
+    from file_hash_cache import DEFAULT_HASH_WORKERS, HASH_MODES, FileHashCache
+except ImportError:
+    from tools.file_hash_cache import DEFAULT_HASH_WORKERS, HASH_MODES, FileHashCache
+
 class SmartNoteMigrator:
-    def __init__(self, source_dir, vault_dir):
+    def __init__(self, source_dir, vault_dir, hash_cache=True, hash_workers=DEFAULT_HASH_WORKERS,
+                 hash_mode="thread"):
         self.source_dir = Path(source_dir)
         self.vault_dir = Path(vault_dir)
+        # 文件哈希缓存（位于 vault 的 .obsidian 下）：True 为默认位置，字符串为自定义路径，False 仅内存
+        self.hash_cache_setting = hash_cache
+        self._hash_cache = None
+        self.hash_workers = hash_workers  # 并行计算哈希的线程/进程数（1 为串行）
+        self.hash_mode = hash_mode        # "thread" 或 "process"
         self.results = {
             "total_notes": 0,
             "already_migrated": 0,
             "need_migration": 0,
             "migrated": 0,
+            "unchanged_resources": 0,
             "errors": [],
             "migration_list": []
         }
 
+    @property
+    def hash_cache(self):
+        """首次用到时才打开"""
+        if self._hash_cache is None:
+            self._hash_cache = FileHashCache.for_vault(self.vault_dir, self.hash_cache_setting)
+        return self._hash_cache
+
     def calculate_file_hash(self, file_path):
-        """计算文件的 MD5 哈希值"""
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        """计算文件的哈希值（BLAKE2b，大小/修改时间未变的文件使用缓存）"""
+        return self.hash_cache.full_hash(file_path)
+
+    def prefetch_resource_hashes(self, pairs):
+        """并行计算目标已存在且大小相同的资源文件的哈希，随后的 copy_resource 直接命中缓存"""
+        paths = []
+        for source_file, target_file in pairs:
+            try:
+                if source_file.stat().st_size == target_file.stat().st_size:
+                    paths.extend((source_file, target_file))
+            except OSError:
+                continue
+        if paths:
+            self.hash_cache.hash_many(paths, workers=self.hash_workers, mode=self.hash_mode)
+
+    def copy_resource(self, source_file, target_file):
+        """复制资源文件；目标已存在且内容相同时跳过，返回是否实际复制"""
+        if target_file.exists() and self.hash_cache.identical(source_file, target_file):
+            self.results["unchanged_resources"] += 1
+            return False
+        shutil.copy2(source_file, target_file)
+        return True
 
     def extract_image_links(self, content):
         """提取 Markdown 中的图片链接"""
@@ -230,6 +264,11 @@ class SmartNoteMigrator:
         print(f"  📎 Markdown 附件链接: {len(attachment_links)} 个")
         print(f"  📎 WikiLink 附件链接: {len(wikilink_attachments)} 个")
 
+        resource_paths = [link[1] for link in image_links + attachment_links + wikilink_attachments]
+        self.prefetch_resource_hashes(
+            (source_note.parent / path, target_files_dir / Path(path).name) for path in resource_paths
+        )
+
         # 复制资源并更新链接
         new_content = source_content
         copied_images = 0
@@ -248,7 +287,7 @@ class SmartNoteMigrator:
 
             # 复制图片
             try:
-                shutil.copy2(source_img, target_img)
+                self.copy_resource(source_img, target_img)
                 copied_images += 1
 
                 # 更新链接
@@ -262,7 +301,7 @@ class SmartNoteMigrator:
         print(f"  ✅ 复制图片: {copied_images}/{len(image_links)} 个")
 
         # 处理附件
-        for text, att_path in attachment_links:
+        for text, att_path, link_type in attachment_links:
             source_att = source_note.parent / att_path
 
             if not source_att.exists():
@@ -273,7 +312,7 @@ class SmartNoteMigrator:
             target_att = target_files_dir / att_name
 
             try:
-                shutil.copy2(source_att, target_att)
+                self.copy_resource(source_att, target_att)
                 copied_attachments += 1
 
                 old_link = f"]({att_path})"
@@ -299,7 +338,7 @@ class SmartNoteMigrator:
             target_att = target_files_dir / att_name
 
             try:
-                shutil.copy2(source_att, target_att)
+                self.copy_resource(source_att, target_att)
                 copied_wikilinks += 1
 
                 # 更新链接 - 将 WikiLink 转换为标准 Markdown 链接
@@ -381,6 +420,9 @@ class SmartNoteMigrator:
                 self.results["need_migration"] += 1
                 self.migrate_note(md_file)
 
+        if self._hash_cache is not None:
+            self._hash_cache.flush()
+
         # 生成报告
         self.generate_report()
 
@@ -398,6 +440,8 @@ class SmartNoteMigrator:
         report.append(f"已完整迁移: {self.results['already_migrated']}")
         report.append(f"需要迁移: {self.results['need_migration']}")
         report.append(f"本次迁移: {self.results['migrated']}")
+        if self.results['unchanged_resources']:
+            report.append(f"内容未变、跳过复制的资源: {self.results['unchanged_resources']}")
 
         if self.results["migration_list"]:
             report.append("\n## 迁移详情")
@@ -435,10 +479,17 @@ def main():
     parser = argparse.ArgumentParser(description='智能笔记迁移工具')
     parser.add_argument('--source-dir', required=True, help='为知笔记源目录路径')
     parser.add_argument('--vault-dir', required=True, help='Obsidian vault 目录路径')
+    parser.add_argument('--no-hash-cache', action='store_true',
+                        help='不读写 vault 中 .obsidian/vault_tools_hashes.db 文件哈希缓存')
+    parser.add_argument('--hash-workers', type=int, default=DEFAULT_HASH_WORKERS,
+                        help=f'并行计算哈希的线程/进程数（默认 {DEFAULT_HASH_WORKERS}，1 为串行）')
+    parser.add_argument('--hash-mode', choices=HASH_MODES, default='thread',
+                        help='并行方式：thread（默认）或 process')
     args = parser.parse_args()
 
     # 执行迁移
-    migrator = SmartNoteMigrator(args.source_dir, args.vault_dir)
+    migrator = SmartNoteMigrator(args.source_dir, args.vault_dir, hash_cache=not args.no_hash_cache,
+                                 hash_workers=args.hash_workers, hash_mode=args.hash_mode)
     migrator.run()
 
 
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+文本相似度计算（供 vault_cleaner.py fuzzy 模式和 obsidian_health_check.py 共用）
+
+SimilarityScorer 先用廉价的上界排除不可能达到阈值的笔记对，只对剩下的对计算相似度：
+  1. 长度上界：相似度 ≤ 2·min(la, lb) / (la + lb)，O(1)，对所有算法都成立
+  2. 字符多重集上界：即 SequenceMatcher.quick_ratio()，对 ratio / exact 成立
+     （用 Counter 在 C 层统计字符，比 difflib 自带的逐字符循环快得多）
+
+三种相似度算法：
+  dice   字符 4-gram 多重集的 Dice 系数 2·|A∩B| / (|A|+|B|)，线性时间（需显式选择）
+         与 SequenceMatcher 的 2·M / (la+lb) 同一量纲，整段增删时两者几乎相等；
+         但不考虑片段顺序，段落调换位置的笔记得分比 ratio 高
+  ratio  difflib.SequenceMatcher(None, a, b).ratio()，即旧版输出（清理和健康检查的默认值）；
+         文本超过 200 字符时会启用 autojunk，把高频字符当作噪声，长文本结果可能偏低
+  exact  关闭 autojunk 的 SequenceMatcher，最接近「最长匹配」定义，但长文本极慢，仅作参照
+
+直接运行本文件可在仓库上抽样比较各算法的耗时与结果差异：
+  python3 tools/text_similarity.py /path/to/vault
+  python3 tools/text_similarity.py /path/to/vault --pairs 300 --threshold 0.8 --methods dice ratio exact
+"""
+import argparse
+import difflib
+import random
+import re
+import sys
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+
+SIMILARITY_METHODS = ("dice", "ratio", "exact")
+DEFAULT_SIMILARITY = "ratio"
+DICE_SHINGLE = 4           # dice 使用的字符 n-gram 长度（实测与 exact 偏差最小）
+PROFILE_CACHE_SIZE = 1024  # 缓存最近使用的文本特征（字符计数 / n-gram 计数）
+
+
+class SimilarityScorer:
+    """带上界剪枝的相似度计算器
+
+    score() 返回 0~1 的相似度；被上界排除时返回该上界（必然低于 threshold），
+    调用方只需比较 score >= threshold。stats 记录各阶段排除的数量。
+    """
+
+    def __init__(self, threshold: float, method: str = DEFAULT_SIMILARITY, shingle: int = DICE_SHINGLE):
+        if method not in SIMILARITY_METHODS:
+            raise ValueError(f"未知的相似度算法: {method}（可选: {', '.join(SIMILARITY_METHODS)}）")
+        self.threshold = threshold
+        self.method = method
+        self.shingle = shingle
+        self.stats = {"pairs": 0, "length": 0, "quick": 0, "scored": 0}
+        self._profiles: "OrderedDict[Tuple[str, str], Tuple[Counter, int]]" = OrderedDict()
+
+    def score(self, a: str, b: str) -> float:
+        self.stats["pairs"] += 1
+        if a == b:
+            return 1.0
+        la, lb = len(a), len(b)
+        if not la or not lb:
+            return 0.0
+
+        bound = 2.0 * min(la, lb) / (la + lb)
+        if bound < self.threshold:
+            self.stats["length"] += 1
+            return bound
+
+        if self.method != "dice":
+            bound = self._intersection(self._profile("chars", a), self._profile("chars", b)) * 2.0 / (la + lb)
+            if bound < self.threshold:
+                self.stats["quick"] += 1
+                return bound
+
+        self.stats["scored"] += 1
+        if self.method == "dice":
+            return self.dice(a, b)
+        return difflib.SequenceMatcher(None, a, b, autojunk=self.method == "ratio").ratio()
+
+    def dice(self, a: str, b: str) -> float:
+        """字符 n-gram 多重集的 Dice 系数（线性时间）"""
+        counts_a, total_a = self._profile("shingles", a)
+        counts_b, total_b = self._profile("shingles", b)
+        return 2.0 * self._intersection((counts_a, total_a), (counts_b, total_b)) / (total_a + total_b)
+
+    @staticmethod
+    def _intersection(a: Tuple[Counter, int], b: Tuple[Counter, int]) -> int:
+        """两个多重集交集的大小（遍历较小的一方）"""
+        small, large = (a[0], b[0]) if len(a[0]) <= len(b[0]) else (b[0], a[0])
+        total = 0
+        for key, count in small.items():
+            other = large.get(key)
+            if other:
+                total += count if count < other else other
+        return total
+
+    def _profile(self, kind: str, text: str) -> Tuple[Counter, int]:
+        """返回 (计数, 元素总数)；同一篇笔记会与多篇比较，按 LRU 缓存"""
+        key = (kind, text)
+        cached = self._profiles.get(key)
+        if cached is not None:
+            self._profiles.move_to_end(key)
+            return cached
+        if kind == "chars":
+            counts = Counter(text)
+            profile = (counts, len(text))
+        else:
+            k = self.shingle
+            if len(text) <= k:
+                counts = Counter([text])
+            else:
+                counts = Counter(text[i:i + k] for i in range(len(text) - k + 1))
+            profile = (counts, sum(counts.values()))
+        self._profiles[key] = profile
+        if len(self._profiles) > PROFILE_CACHE_SIZE:
+            self._profiles.popitem(last=False)
+        return profile
+
+    def describe(self) -> str:
+        stats = self.stats
+        return (f"比较 {stats['pairs']} 对，长度上界排除 {stats['length']}，"
+                f"字符上界排除 {stats['quick']}，计算 {stats['scored']} 对（{self.method}）")
+
+
+def similar_pairs(texts: Sequence[str], scorer: SimilarityScorer) -> List[Tuple[int, int, float]]:
+    """两两比较 texts，按 (i, j) 顺序返回相似度 ≥ scorer.threshold 的 (i, j, similarity)，i < j
+
+    按长度排序后，对每篇只向更长的方向比较；一旦长度上界低于阈值，后面更长的文本也不可能
+    达到阈值，直接结束内层循环。
+    """
+    order = sorted((i for i, text in enumerate(texts) if text), key=lambda i: len(texts[i]))
+    found = []
+    for pos, i in enumerate(order):
+        length = len(texts[i])
+        for j in order[pos + 1:]:
+            other = len(texts[j])
+            if 2.0 * length / (length + other) < scorer.threshold:
+                break
+            similarity = scorer.score(texts[i], texts[j])
+            if similarity >= scorer.threshold:
+                found.append((min(i, j), max(i, j), similarity))
+    found.sort()
+    return found
+
+
+# ── 基准测试 ──────────────────────────────────────────────
+
+def load_texts(vault: Path, min_length: int = 200) -> List[str]:
+    """读取仓库中的 Markdown 笔记，按 obsidian_health_check 的方式标准化（去 frontmatter、合并空白、小写）"""
+    texts = []
+    for path in sorted(vault.rglob("*.md")):
+        if any(part.startswith(".") for part in path.relative_to(vault).parts):
+            continue
+        try:
+            content = path.read_text(encoding="utf-8", errors="ignore")
+        except OSError:
+            continue
+        if content.startswith("---"):
+            parts = content.split("---", 2)
+            if len(parts) >= 3:
+                content = parts[2]
+        content = re.sub(r"\s+", " ", content).lower().strip()
+        if len(content) >= min_length:
+            texts.append(content)
+    return texts
+
+
+def sample_pairs(texts: Sequence[str], count: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """一半是随机笔记对，一半是对笔记做整段替换得到的近似副本（覆盖阈值附近的情况）"""
+    rng = random.Random(seed)
+    pairs = []
+    for n in range(count):
+        a = rng.choice(texts)
+        if n % 2 == 0 and len(texts) > 1:
+            pairs.append((a, rng.choice(texts)))
+            continue
+        b = a
+        fraction = rng.choice((0.02, 0.05, 0.1, 0.15, 0.2, 0.3))
+        for _ in range(3):
+            size = max(1, int(len(a) * fraction / 3))
+            start = rng.randrange(max(1, len(b) - size))
+            donor = rng.choice(texts)
+            b = b[:start] + donor[:size] + b[start + size:]
+        pairs.append((a, b))
+    return pairs
+
+
+def run_benchmark(pairs: Sequence[Tuple[str, str]], methods: Sequence[str], threshold: float,
+                  baseline: str = "ratio") -> Dict[str, Dict]:
+    """对同一批笔记对分别运行各算法（不剪枝的原始值与带剪枝的判定），与 baseline 比较"""
+    raw = {}
+    report = {}
+    for method in methods:
+        scorer = SimilarityScorer(0.0, method)  # 阈值 0：不剪枝，得到原始相似度
+        started = time.perf_counter()
+        raw[method] = [scorer.score(a, b) for a, b in pairs]
+        elapsed = time.perf_counter() - started
+
+        pruned = SimilarityScorer(threshold, method)
+        started = time.perf_counter()
+        decisions = [pruned.score(a, b) >= threshold for a, b in pairs]
+        pruned_elapsed = time.perf_counter() - started
+        report[method] = {"seconds": elapsed, "pruned_seconds": pruned_elapsed,
+                          "decisions": decisions, "stats": dict(pruned.stats)}
+
+    reference = raw.get(baseline)
+    for method, entry in report.items():
+        if reference is None:
+            break
+        errors = [abs(x - y) for x, y in zip(raw[method], reference)]
+        entry["max_error"] = max(errors) if errors else 0.0
+        entry["mean_error"] = sum(errors) / len(errors) if errors else 0.0
+        entry["disagree"] = sum(1 for x, y in zip(raw[method], reference)
+                                if (x >= threshold) != (y >= threshold))
+        entry["pruned_mismatch"] = sum(1 for decision, value in zip(entry["decisions"], raw[method])
+                                       if decision != (value >= threshold))
+    return report
+
+
+def print_benchmark(report: Dict[str, Dict], pairs: int, threshold: float, baseline: str):
+    print(f"\n{'=' * 70}")
+    print(f"📈 相似度算法对比（{pairs} 对，阈值 {threshold}，基准 {baseline}）")
+    print(f"{'=' * 70}")
+    for method, entry in report.items():
+        stats = entry["stats"]
+        print(f"  {method:<6} 原始 {entry['seconds'] * 1000:8.1f} ms，剪枝后 {entry['pruned_seconds'] * 1000:8.1f} ms"
+              f"（上界排除 {stats['length'] + stats['quick']}/{stats['pairs']}）")
+        if "max_error" in entry:
+            print(f"         与 {baseline} 偏差: 最大 {entry['max_error']:.3f}，平均 {entry['mean_error']:.3f}，"
+                  f"判定不一致 {entry['disagree']} 对；剪枝误判 {entry['pruned_mismatch']} 对")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="在 Obsidian 仓库上比较相似度算法的耗时与结果",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument("vault_dir", help="Obsidian Vault 目录路径")
+    parser.add_argument("--pairs", type=int, default=200, help="抽样笔记对数量（默认 200）")
+    parser.add_argument("--threshold", type=float, default=0.8, help="判定阈值（默认 0.8）")
+    parser.add_argument("--methods", nargs="+", choices=SIMILARITY_METHODS, default=["dice", "ratio"],
+                        help="参与比较的算法（默认 dice ratio；exact 在长文本上很慢）")
+    parser.add_argument("--baseline", choices=SIMILARITY_METHODS, default="ratio",
+                        help="作为参照的算法（默认 ratio，即旧版输出）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vault = Path(args.vault_dir).expanduser()
+    if not vault.is_dir():
+        print(f"❌ 目录不存在: {vault}")
+        sys.exit(1)
+    texts = load_texts(vault)
+    if not texts:
+        print("❌ 没有找到足够长的笔记")
+        sys.exit(1)
+    methods = list(dict.fromkeys(args.methods + [args.baseline]))
+    pairs = sample_pairs(texts, args.pairs, args.seed)
+    print(f"📝 读取 {len(texts)} 篇笔记，抽样 {len(pairs)} 对")
+    print_benchmark(run_benchmark(pairs, methods, args.threshold, args.baseline),
+                    len(pairs), args.threshold, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
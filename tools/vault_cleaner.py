@@ -9,10 +9,20 @@ Obsidian 仓库清理工具
   orphan   检测孤儿文件（默认排除 .pdf/.xls/.xlsx/.xmind，预览列出文件详情）
   fix      修复失效引用，将孤儿文件重新链接到笔记
 
+dedup 模式特性：
+  - 先按文件大小分组，大小相同的再比较头尾 64 KB，仍相同的才计算完整 BLAKE2b，报告实际读取的字节数
+  - 哈希缓存在 .obsidian/vault_tools_hashes.db，文件大小/mtime/inode 未变时不再读取（--no-hash-cache 关闭）
+  - 哈希并行计算（--hash-workers N，--hash-mode thread|process），分组顺序与串行一致
+
 fuzzy 模式特性：
   - 默认阈值 0.8，可通过 --threshold 调整（如 --threshold 0.25）
   - 模板保护：文件名含 template/模板/tpl 的笔记不会被删除
   - 代码块内容保留比较（不删除代码块内的差异）
+  - MinHash/LSH 在整个仓库中查找候选（标题不同的近似重复也能发现），只对候选计算精确相似度
+  - 标题不同的近似笔记默认只报告；--cross-title 时相似度 ≥ 0.9（且达到 --threshold）才删除
+  - 每组只删除与保留笔记直接匹配的笔记（A~B~C 的链不会连带删除 C）
+  - 相似度先用长度/字符上界剪枝，默认用 SequenceMatcher（ratio）计算；--similarity dice 用线性时间的
+    4-gram Dice 筛选，达到阈值的对再用 ratio 复核，删除范围不会超出 ratio 的判定
 
 推荐流程：fix → fuzzy → dedup → orphan → clean
 
@@ -22,6 +32,7 @@ fuzzy 模式特性：
   python3 tools/vault_cleaner.py fuzzy /path/to/vault             # 近似重复检测（预览）
   python3 tools/vault_cleaner.py fuzzy /path/to/vault --apply     # 删除近似重复
   python3 tools/vault_cleaner.py fuzzy /path/to/vault --threshold 0.25 --apply  # 低阈值
+  python3 tools/vault_cleaner.py fuzzy /path/to/vault --similarity dice           # Dice 筛选 + ratio 复核
   python3 tools/vault_cleaner.py dedup /path/to/vault             # 检测重复（预览）
   python3 tools/vault_cleaner.py dedup /path/to/vault --apply     # 执行去重删除
   python3 tools/vault_cleaner.py clean /path/to/vault              # 检测空笔记/空目录（预览）
@@ -30,15 +41,22 @@ fuzzy 模式特性：
   python3 tools/vault_cleaner.py orphan /path/to/vault --apply    # 删除孤儿文件
 """
 import argparse
-import difflib
 import hashlib
 import os
 import re
 import sys
+import zlib
 from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Optional, Set, Tuple
 
+try:
+    from file_hash_cache import DEFAULT_HASH_WORKERS, HASH_MODES, PARTIAL_HASH_SIZE, FileHashCache
+    from text_similarity import DEFAULT_SIMILARITY, SIMILARITY_METHODS, SimilarityScorer
+except ImportError:
+    from tools.file_hash_cache import DEFAULT_HASH_WORKERS, HASH_MODES, PARTIAL_HASH_SIZE, FileHashCache
+    from tools.text_similarity import DEFAULT_SIMILARITY, SIMILARITY_METHODS, SimilarityScorer
+
 
 # 去重时扫描的扩展名（含笔记文件）
 DEDUP_EXTENSIONS = {
@@ -64,6 +82,15 @@ _RESOURCE_DIR_NAMES = {"attachments", "images", "all_image", "all_images"}
 # 默认排除扩展名（可通过 config.json 的 cleanup.exclude_extensions 或 --exclude-ext 覆盖）
 DEFAULT_EXCLUDE_EXT = {".pdf", ".xls", ".xlsx", ".xmind"}
 
+# fuzzy 模式：MinHash/LSH 候选生成参数
+MINHASH_SHINGLE = 5          # shingle 长度（字符）
+MINHASH_PERMUTATIONS = 128   # 签名长度
+LSH_THRESHOLD_SLACK = 0.75   # 相似度阈值换算为 Jaccard 阈值后再乘以此系数，偏向召回
+LSH_MIN_JACCARD = 0.15       # Jaccard 阈值下限，过低时几乎所有笔记都会成为候选
+FUZZY_TITLE_GROUP_LIMIT = 20  # 同标题且不超过此数量的笔记仍两两精确比对（更大的组只比对 LSH 候选）
+FUZZY_CROSS_TITLE_MIN = 0.9   # --cross-title 时标题不同的笔记至少达到此相似度才删除
+_MASK64 = (1 << 64) - 1
+
 # 默认模板保护关键词（可通过 config.json 的 cleanup.protected_filenames 覆盖）
 _PROTECTED_KEYWORDS = {"template", "模板", "tpl"}
 
@@ -111,14 +138,133 @@ def _is_resource_dir(path: Path, vault_dir: Path) -> bool:
     return False
 
 
+class MinHashLSH:
+    """
+    近似重复候选生成：字符 shingle + MinHash 签名 + LSH 分段（banding）
+
+    - 纯文本切成 MINHASH_SHINGLE 个字符的 shingle（中文没有空格分词，按字符切分）
+    - 每个 shingle 只哈希一次，按哈希值分到 num_perm 个桶中取最小值（one permutation hashing），
+      空桶从右侧最近的非空桶借值（旋转补齐），得到 num_perm 维签名
+    - 签名分成 bands 段、每段 rows 行，任一段完全相同的两篇笔记成为候选对；
+      bands/rows 按目标 Jaccard 阈值选择，使误报与漏报概率的积分之和最小
+    每篇笔记只处理一次，候选对只来自同一个桶，整体接近线性；精确相似度只对候选对计算。
+    """
+
+    def __init__(self, jaccard_threshold: float, num_perm: int = MINHASH_PERMUTATIONS,
+                 shingle: int = MINHASH_SHINGLE):
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self.bands, self.rows = self.optimal_bands(jaccard_threshold, num_perm)
+        self.buckets: List[Dict[tuple, List]] = [defaultdict(list) for _ in range(self.bands)]
+
+    @staticmethod
+    def jaccard_threshold(threshold: float) -> float:
+        """把 SequenceMatcher 相似度阈值换算为 shingle 集合的 Jaccard 阈值
+
+        整段增删时 Jaccard ≈ r / (2 - r)；零散的字符修改对 shingle 影响更大，再乘以
+        LSH_THRESHOLD_SLACK 留出余量（宁可多出候选，由精确比对排除）。
+        """
+        jaccard = threshold / (2 - threshold) * LSH_THRESHOLD_SLACK
+        return min(1.0, max(LSH_MIN_JACCARD, jaccard))
+
+    @staticmethod
+    def optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+        """选择 (bands, rows)：两篇 Jaccard 为 s 的笔记成为候选的概率是 1 - (1 - s^rows)^bands"""
+        def integrate(f, a, b, steps=50):
+            if b <= a:
+                return 0.0
+            width = (b - a) / steps
+            return sum(f(a + (i + 0.5) * width) for i in range(steps)) * width
+
+        best, best_error = (1, num_perm), None
+        for bands in range(1, num_perm + 1):
+            for rows in range(1, num_perm // bands + 1):
+                false_positive = integrate(lambda s: 1 - (1 - s ** rows) ** bands, 0.0, threshold)
+                false_negative = integrate(lambda s: (1 - s ** rows) ** bands, threshold, 1.0)
+                error = false_positive + false_negative
+                if best_error is None or error < best_error:
+                    best, best_error = (bands, rows), error
+        return best
+
+    def signature(self, text: str) -> Optional[List[int]]:
+        """计算文本的 MinHash 签名；空文本返回 None"""
+        k = self.shingle
+        if not text:
+            return None
+        if len(text) <= k:
+            shingles = {text}
+        else:
+            shingles = {text[i:i + k] for i in range(len(text) - k + 1)}
+
+        n = self.num_perm
+        bins = [None] * n
+        for shingle in shingles:
+            # crc32 再做一次乘法散列（高位混合充分），高位决定桶，整个值参与取最小
+            h = (zlib.crc32(shingle.encode("utf-8")) * 0x9E3779B97F4A7C15) & _MASK64
+            j = (h >> 40) % n
+            current = bins[j]
+            if current is None or h < current:
+                bins[j] = h
+
+        if None in bins:
+            # 旋转补齐：空桶取右侧第 t 个非空桶的值再加 t 个偏移，保证两篇笔记的补齐方式一致
+            filled = bins[:]
+            for j in range(n):
+                if bins[j] is None:
+                    t = 1
+                    while bins[(j + t) % n] is None:
+                        t += 1
+                    filled[j] = bins[(j + t) % n] + t * (_MASK64 + 1)
+            bins = filled
+        return bins
+
+    def add(self, key, text: str) -> bool:
+        """把一篇笔记加入索引；文本为空时不加入，返回 False"""
+        signature = self.signature(text)
+        if signature is None:
+            return False
+        rows = self.rows
+        for band, buckets in enumerate(self.buckets):
+            buckets[tuple(signature[band * rows:(band + 1) * rows])].append(key)
+        return True
+
+    def candidate_pairs(self) -> Set[Tuple]:
+        """所有至少在一个分段中落入同一个桶的笔记对（按加入顺序排列的二元组）"""
+        pairs = set()
+        for buckets in self.buckets:
+            for members in buckets.values():
+                if len(members) < 2:
+                    continue
+                for i in range(len(members)):
+                    for j in range(i + 1, len(members)):
+                        pairs.add((members[i], members[j]))
+        return pairs
+
+
 class VaultCleaner:
     """Obsidian 仓库清理器"""
 
-    def __init__(self, vault_dir: str, apply: bool = False, exclude_ext: Optional[Set[str]] = None):
+    def __init__(self, vault_dir: str, apply: bool = False, exclude_ext: Optional[Set[str]] = None,
+                 similarity: str = DEFAULT_SIMILARITY, hash_cache=True,
+                 hash_workers: int = DEFAULT_HASH_WORKERS, hash_mode: str = "thread"):
         self.vault_dir = Path(vault_dir).resolve()
         self.apply = apply
         self.exclude_ext = exclude_ext or set()
+        self.similarity = similarity  # fuzzy 模式的相似度算法，见 text_similarity.SIMILARITY_METHODS
         self.errors: List[Dict] = []
+        # 文件哈希缓存：True 为仓库内默认位置，字符串为自定义路径，False 只在本次运行内缓存
+        self.hash_cache_setting = hash_cache
+        self._hash_cache: Optional[FileHashCache] = None
+        self.hash_workers = hash_workers  # 并行计算哈希的线程/进程数（1 为串行）
+        self.hash_mode = hash_mode        # "thread"（I/O 密集）或 "process"
+        self.hash_stats: Dict[str, int] = {}
+
+    @property
+    def hash_cache(self) -> FileHashCache:
+        """首次用到时才打开（不做 dedup 时不在仓库中创建缓存文件）"""
+        if self._hash_cache is None:
+            self._hash_cache = FileHashCache.for_vault(self.vault_dir, self.hash_cache_setting)
+        return self._hash_cache
 
     # ── 去重 ──────────────────────────────────────────────
 
@@ -128,13 +274,16 @@ class VaultCleaner:
         all_files = self._scan_resource_files()
         print(f"  找到 {len(all_files)} 个资源文件\n")
 
-        print("🔢 计算文件哈希...")
-        hash_groups = self._group_by_hash(all_files)
-        dup_groups = {h: paths for h, paths in hash_groups.items() if len(paths) > 1}
+        print("🔢 计算文件哈希（先比较大小，再比较头尾，最后完整哈希）...")
+        dup_groups = self._group_by_hash(all_files)
+        stats = self.hash_stats
+        print(f"  读取 {self._format_size(stats['bytes_read'])} / {self._format_size(stats['total_bytes'])}"
+              f"（头尾哈希 {stats['partial']} 个，完整哈希 {stats['full']} 个；{self.hash_cache.describe()}）\n")
 
         if not dup_groups:
             print("✅ 没有发现重复文件")
-            return {"total_files": len(all_files), "dup_groups": 0, "dup_files": 0, "removed": 0}
+            return {"total_files": len(all_files), "dup_groups": 0, "dup_files": 0, "removed": 0,
+                    "bytes_read": stats["bytes_read"]}
 
         total_dup_files = sum(len(paths) - 1 for paths in dup_groups.values())
         print(f"⚠️  发现 {len(dup_groups)} 组重复，共 {total_dup_files} 个冗余文件\n")
@@ -171,6 +320,7 @@ class VaultCleaner:
             "dup_files": total_dup_files,
             "removed": removed,
             "removed_paths": removed_paths,
+            "bytes_read": stats["bytes_read"],
             "errors": len(self.errors),
         }
 
@@ -337,8 +487,19 @@ class VaultCleaner:
 
     # ── 近似重复检测 ──────────────────────────────────────
 
-    def fuzzy(self, threshold: float = 0.8) -> Dict:
-        """检测近似重复笔记（按标题+去除链接后的纯文本比对）"""
+    def fuzzy(self, threshold: float = 0.8, cross_title: bool = False) -> Dict:
+        """
+        检测近似重复笔记（按标题+去除链接后的纯文本比对）
+
+        候选来源：纯文本完全相同、同标题（短内容直接视为重复，小组两两比对）、
+        MinHash/LSH 在整个仓库中找到的内容相近笔记（标题不同也能发现）；
+        候选对再由 SimilarityScorer 计算相似度（先用上界剪枝），达到 threshold 才算重复。
+        dice 不考虑片段顺序、得分偏高，只用于筛选：达到阈值的对再用 ratio 复核。
+
+        标题不同、内容也不完全相同的笔记默认只报告不删除；cross_title=True 时相似度达到
+        max(threshold, FUZZY_CROSS_TITLE_MIN) 才删除。每组只删除与保留笔记直接匹配的笔记，
+        A~B、B~C 这样的链不会让只与 B 相似的 C 被删除。
+        """
         print("📝 扫描所有笔记...")
         md_files = self._find_all_md()
         print(f"  找到 {len(md_files)} 个笔记\n")
@@ -363,38 +524,32 @@ class VaultCleaner:
 
         print(f"  有效笔记: {len(notes)} 个\n")
 
-        # 第一轮：按标题分组（同名笔记高度疑似重复）
-        print("🔍 第一轮：按标题分组...")
-        title_groups = defaultdict(list)
-        for note in notes:
-            title_groups[note["title"]].append(note)
-
         matches = []
-        for title, group in title_groups.items():
-            if len(group) < 2:
-                continue
-            # 组内两两比较
-            for i in range(len(group)):
-                for j in range(i + 1, len(group)):
-                    a, b = group[i], group[j]
-                    # 两个都是短内容笔记 → 同标题即视为重复
-                    if a["short"] and b["short"]:
-                        matches.append({
-                            "a": a, "b": b,
-                            "similarity": 1.0,
-                            "reason": "同标题（短内容）",
-                        })
-                    else:
-                        sim = self._similarity(a["pure"], b["pure"])
-                        if sim >= threshold:
-                            matches.append({
-                                "a": a, "b": b,
-                                "similarity": sim,
-                                "reason": "同标题",
-                            })
-
-        # 第二轮：按纯文本哈希分组（标题不同但内容相同）
-        print("🔍 第二轮：按纯文本哈希分组...")
+        compared = set()
+        scorer = SimilarityScorer(threshold, self.similarity)
+        confirm = SimilarityScorer(threshold, "ratio") if self.similarity == "dice" else None
+
+        def link(a, b, reason):
+            compared.add((a["rel"], b["rel"]) if a["rel"] < b["rel"] else (b["rel"], a["rel"]))
+            matches.append({"a": a, "b": b, "similarity": 1.0, "reason": reason})
+
+        def measure(a, b):
+            sim = scorer.score(a["pure"], b["pure"])
+            if sim >= threshold and confirm is not None:
+                sim = confirm.score(a["pure"], b["pure"])
+            return sim
+
+        def compare(a, b, reason):
+            pair_key = (a["rel"], b["rel"]) if a["rel"] < b["rel"] else (b["rel"], a["rel"])
+            if pair_key in compared:
+                return
+            compared.add(pair_key)
+            sim = measure(a, b)
+            if sim >= threshold:
+                matches.append({"a": a, "b": b, "similarity": sim, "reason": reason})
+
+        # 第一轮：纯文本完全相同的笔记归为一组（与组内第一篇配对，线性），每组只留一篇参与后续比对
+        print("🔍 第一轮：按纯文本哈希分组...")
         pure_hash_groups = defaultdict(list)
         for note in notes:
             if note["short"]:
@@ -402,24 +557,44 @@ class VaultCleaner:
             h = hashlib.md5(note["pure"].encode("utf-8")).hexdigest()
             pure_hash_groups[h].append(note)
 
-        seen_pairs = set()
-        for h, group in pure_hash_groups.items():
+        representatives = []
+        for group in pure_hash_groups.values():
+            representatives.append(group[0])
+            for other in group[1:]:
+                link(group[0], other, "内容相同")
+
+        # 第二轮：同标题的短内容笔记直接视为重复；小的同标题组仍两两精确比对
+        print("🔍 第二轮：按标题分组...")
+        title_groups = defaultdict(list)
+        for note in notes:
+            title_groups[note["title"]].append(note)
+
+        for title, group in title_groups.items():
             if len(group) < 2:
                 continue
-            for i in range(len(group)):
-                for j in range(i + 1, len(group)):
-                    pair_key = tuple(sorted([group[i]["rel"], group[j]["rel"]]))
-                    if pair_key in seen_pairs:
-                        continue
-                    seen_pairs.add(pair_key)
-                    sim = self._similarity(group[i]["pure"], group[j]["pure"])
-                    if sim >= threshold:
-                        matches.append({
-                            "a": group[i],
-                            "b": group[j],
-                            "similarity": sim,
-                            "reason": "内容相同",
-                        })
+            short = [n for n in group if n["short"]]
+            for other in short[1:]:
+                link(short[0], other, "同标题（短内容）")
+            if len(group) <= FUZZY_TITLE_GROUP_LIMIT:
+                for i in range(len(group)):
+                    for j in range(i + 1, len(group)):
+                        if not (group[i]["short"] and group[j]["short"]):
+                            compare(group[i], group[j], "同标题")
+
+        # 第三轮：MinHash/LSH 在整个仓库中找内容相近的候选对，只对候选计算精确相似度
+        jaccard = MinHashLSH.jaccard_threshold(threshold)
+        index = MinHashLSH(jaccard)
+        print(f"🔍 第三轮：MinHash/LSH 候选（Jaccard ≥ {jaccard:.2f}，{index.bands} 段 × {index.rows} 行）...")
+        for i, note in enumerate(representatives):
+            index.add(i, note["pure"])
+        candidates = index.candidate_pairs()
+        print(f"  候选对: {len(candidates)} 个（全部两两比对需 {len(representatives) * (len(representatives) - 1) // 2} 次）")
+        for i, j in sorted(candidates):
+            a, b = representatives[i], representatives[j]
+            compare(a, b, "同标题" if a["title"] == b["title"] else "内容相似")
+        print(f"  相似度: {scorer.describe()}")
+        if confirm is not None:
+            print(f"  复核: {confirm.describe()}")
 
         # 去重
         unique_matches = []
@@ -439,7 +614,42 @@ class VaultCleaner:
             print("✅ 没有发现近似重复笔记")
             return {"total_notes": len(notes), "matches": 0, "removed": 0}
 
-        # 用 union-find 将匹配对聚合成组
+        # 标题不同的近似笔记（LSH 跨标题候选）默认只报告；--cross-title 时要求更高的相似度
+        cross_min = max(threshold, FUZZY_CROSS_TITLE_MIN)
+        deletable, report_only = [], []
+        for m in unique_matches:
+            if m["reason"] == "内容相似" and not (cross_title and m["similarity"] >= cross_min):
+                report_only.append(m)
+            else:
+                deletable.append(m)
+
+        # 已知的判定结果：(rel, rel) -> (相似度, 原因)；未比对过的笔记对在 direct() 中按需比对
+        verdicts = {}
+        for m in report_only:
+            verdicts[tuple(sorted([m["a"]["rel"], m["b"]["rel"]]))] = None
+        for m in deletable:
+            verdicts[tuple(sorted([m["a"]["rel"], m["b"]["rel"]]))] = (m["similarity"], m["reason"])
+
+        def direct(keep, other):
+            """other 是否与 keep 直接匹配（可删除），返回 (相似度, 原因) 或 None"""
+            key = tuple(sorted([keep["rel"], other["rel"]]))
+            if key not in verdicts:
+                verdict = None
+                if not keep["short"] and keep["pure"] == other["pure"]:
+                    verdict = (1.0, "内容相同")
+                elif keep["title"] == other["title"]:
+                    if keep["short"] and other["short"]:
+                        verdict = (1.0, "同标题（短内容）")
+                    else:
+                        sim = measure(keep, other)
+                        verdict = (sim, "同标题") if sim >= threshold else None
+                elif cross_title:
+                    sim = measure(keep, other)
+                    verdict = (sim, "内容相似") if sim >= cross_min else None
+                verdicts[key] = verdict
+            return verdicts[key]
+
+        # 用 union-find 把可删除的匹配对聚合成连通分量，再在分量内逐个选出保留笔记
         parent = {}
 
         def find(x):
@@ -453,68 +663,71 @@ class VaultCleaner:
             if px != py:
                 parent[px] = py
 
-        for m in unique_matches:
+        for m in deletable:
             union(m["a"]["rel"], m["b"]["rel"])
 
-        groups = defaultdict(list)
-        for note_rel in set(find(m["a"]["rel"]) for m in unique_matches):
-            # 收集该组所有成员
-            members = set()
-            for m in unique_matches:
-                members.add(m["a"]["rel"])
-                members.add(m["b"]["rel"])
-            # 只保留属于当前组的
-            group_members = [r for r in members if find(r) == note_rel]
-            if len(group_members) >= 2:
-                groups[note_rel] = group_members
-
-        # 为每组计算最高相似度和原因
-        group_info = {}
-        for root, members in groups.items():
-            best_sim = 0
-            best_reason = ""
-            for m in unique_matches:
-                if m["a"]["rel"] in members and m["b"]["rel"] in members:
-                    if m["similarity"] > best_sim:
-                        best_sim = m["similarity"]
-                        best_reason = m["reason"]
-            group_info[root] = {"similarity": best_sim, "reason": best_reason}
-
-        # 按相似度排序
-        sorted_groups = sorted(groups.items(), key=lambda x: -group_info[x[0]]["similarity"])
+        components = defaultdict(list)
+        for rel in sorted({r for m in deletable for r in (m["a"]["rel"], m["b"]["rel"])}):
+            components[find(rel)].append(rel)
 
         # 构建 notes 索引
         note_by_rel = {n["rel"]: n for n in notes}
 
+        # 分量内：选出保留笔记，只删除与它直接匹配的笔记；剩下的笔记继续选下一个保留笔记
+        groups = []
+        for members in components.values():
+            remaining = [note_by_rel[r] for r in members]
+            while len(remaining) >= 2:
+                keep, _ = self._pick_group_keeper(remaining)
+                drops = []
+                for other in remaining:
+                    if other is not keep:
+                        verdict = direct(keep, other)
+                        if verdict is not None:
+                            drops.append((other, verdict))
+                dropped = {id(keep)} | {id(other) for other, _ in drops}
+                remaining = [n for n in remaining if id(n) not in dropped]
+                if drops:
+                    groups.append((keep, drops))
+
+        # 按相似度排序
+        groups.sort(key=lambda g: -max(v[0] for _, v in g[1]))
+
         print(f"\n{'=' * 60}")
         print(f"📊 近似重复检测结果（阈值 {threshold*100:.0f}%）")
         print(f"{'=' * 60}")
         print(f"笔记总数:     {len(notes)}")
-        print(f"重复组数:     {len(sorted_groups)}")
-        total_drops = sum(len(members) - 1 for _, members in sorted_groups)
+        print(f"重复组数:     {len(groups)}")
+        total_drops = sum(len(drops) for _, drops in groups)
         print(f"冗余笔记数:   {total_drops}")
+        if report_only:
+            print(f"仅报告:       {len(report_only)} 对标题不同的相似笔记（不删除）")
 
-        if not sorted_groups:
-            print("✅ 没有发现近似重复笔记")
-            return {"total_notes": len(notes), "matches": 0, "removed": 0}
+        if report_only:
+            hint = (f"相似度低于 {cross_min*100:.0f}%" if cross_title
+                    else f"加 --cross-title 后相似度 ≥ {cross_min*100:.0f}% 的才会删除")
+            print(f"\n🔎 标题不同的相似笔记（仅报告，{hint}）:")
+            for m in sorted(report_only, key=lambda m: -m["similarity"]):
+                print(f"    {m['similarity']*100:.1f}%  {m['a']['rel']}  ↔  {m['b']['rel']}")
+
+        if not groups:
+            print("✅ 没有发现可删除的近似重复笔记")
+            return {"total_notes": len(notes), "matches": len(unique_matches), "removed": 0,
+                    "removed_paths": [], "report_only": len(report_only), "errors": 0}
 
         # 显示匹配结果
         removed = 0
         removed_paths = []
         print(f"\n{'─' * 60}")
 
-        for idx, (root, members) in enumerate(sorted_groups, 1):
-            info = group_info[root]
-            sim_pct = info["similarity"] * 100
-            member_notes = [note_by_rel[r] for r in members if r in note_by_rel]
-            keep, drops = self._pick_group_keeper(member_notes)
-
-            print(f"\n  #{idx}  相似度 {sim_pct:.1f}%  ({info['reason']})  [{len(members)} 个副本]")
+        for idx, (keep, drops) in enumerate(groups, 1):
+            best_sim, best_reason = max((v for _, v in drops), key=lambda v: v[0])
+            print(f"\n  #{idx}  相似度 {best_sim*100:.1f}%  ({best_reason})  [{len(drops) + 1} 个副本]")
             print(f"    ✅ 保留: {keep['rel']}")
-            for drop in drops:
-                print(f"    🗑️  删除: {drop['rel']}")
+            for drop, (sim, reason) in drops:
+                print(f"    🗑️  删除: {drop['rel']}  ({sim*100:.1f}%，{reason})")
 
-            for drop in drops:
+            for drop, _ in drops:
                 # 修复指向被删笔记的引用
                 ref_count = self._redirect_note_refs(drop, keep, md_files)
                 if ref_count > 0:
@@ -543,6 +756,7 @@ class VaultCleaner:
             "matches": len(unique_matches),
             "removed": removed,
             "removed_paths": removed_paths,
+            "report_only": len(report_only),
             "errors": len(self.errors),
         }
 
@@ -606,11 +820,6 @@ class VaultCleaner:
         # 用文件名（stem 已不含 .md）
         return md_file.stem
 
-    @staticmethod
-    def _similarity(a: str, b: str) -> float:
-        """计算两个字符串的相似度（0~1）"""
-        return difflib.SequenceMatcher(None, a, b).ratio()
-
     def _pick_note_keeper(self, a: Dict, b: Dict) -> Tuple[Dict, Dict]:
         """选择保留哪个笔记：优先路径更短、不在临时草稿目录的"""
         draft_keywords = ("临时草稿", "temp", "draft", "草稿")
@@ -732,27 +941,74 @@ class VaultCleaner:
         return files
 
     def _group_by_hash(self, files: List[Path]) -> Dict[str, List[Path]]:
-        """按文件内容哈希分组"""
-        groups = defaultdict(list)
-        for i, fpath in enumerate(files):
-            if (i + 1) % 500 == 0:
-                print(f"  已计算 {i + 1}/{len(files)}...")
-            h = self._file_hash(fpath)
-            if h:
-                groups[h].append(fpath)
-        return dict(groups)
-
-    @staticmethod
-    def _file_hash(fpath: Path) -> Optional[str]:
-        """计算文件 MD5"""
-        try:
-            hasher = hashlib.md5()
-            with open(fpath, "rb") as f:
-                while chunk := f.read(8192):
-                    hasher.update(chunk)
-            return hasher.hexdigest()
-        except Exception:
-            return None
+        """按文件内容分组，只返回有重复的组
+
+        分三级筛选，尽量少读文件：
+          1. 按 st_size 分组，大小唯一的文件不可能有重复，不读取内容
+          2. 大小相同的文件计算头尾各 PARTIAL_HASH_SIZE 字节的哈希（不超过两倍大小的文件即整个文件）
+          3. 头尾仍相同的大文件才用 BLAKE2b 计算完整哈希
+        第 2、3 级按 hash_workers / hash_mode 并行计算，经由 FileHashCache（未变化的文件直接使用
+        上次的结果）；实际读取的字节数记录在 self.hash_stats。
+        """
+        stats = self.hash_stats = {"files": 0, "total_bytes": 0, "partial": 0, "full": 0, "bytes_read": 0}
+        read_before = self.hash_cache.stats["bytes_read"]
+        by_size = defaultdict(list)
+        for fpath in files:
+            try:
+                size = fpath.stat().st_size
+            except OSError:
+                continue
+            by_size[size].append(fpath)
+            stats["files"] += 1
+            stats["total_bytes"] += size
+
+        collisions = [(size, paths) for size, paths in by_size.items() if len(paths) > 1]
+        pending = [fpath for size, paths in collisions if size > 0 for fpath in paths]
+        print(f"  大小相同的文件: {len(pending)} 个（其余 {stats['files'] - len(pending)} 个大小唯一，跳过）")
+
+        # 头尾哈希：所有大小相同的文件一起并行计算
+        partial = dict(zip(pending, self._hash_batch(pending, "partial")))
+        stats["partial"] = len(pending)
+        candidates = []  # (size, 头尾哈希, 文件列表)，保持扫描顺序
+        for size, paths in collisions:
+            if size == 0:
+                candidates.append((0, None, paths))  # 空文件内容必然相同
+                continue
+            by_partial = defaultdict(list)
+            for fpath in paths:
+                if partial[fpath]:
+                    by_partial[partial[fpath]].append(fpath)
+            candidates.extend((size, h, same) for h, same in by_partial.items() if len(same) > 1)
+
+        # 完整哈希：头尾仍相同的大文件（小文件的头尾即全部内容）
+        need_full = [fpath for size, h, same in candidates if size > 2 * PARTIAL_HASH_SIZE for fpath in same]
+        full = dict(zip(need_full, self._hash_batch(need_full, "full")))
+        stats["full"] = len(need_full)
+
+        groups = {}
+        for size, partial_hash, same in candidates:
+            if size == 0:
+                groups["0"] = same
+            elif size <= 2 * PARTIAL_HASH_SIZE:
+                groups[f"{size}:{partial_hash}"] = same
+            else:
+                by_full = defaultdict(list)
+                for fpath in same:
+                    if full[fpath]:
+                        by_full[full[fpath]].append(fpath)
+                groups.update((f"{size}:{h}", paths) for h, paths in by_full.items() if len(paths) > 1)
+        stats["bytes_read"] = self.hash_cache.stats["bytes_read"] - read_before
+        self.hash_cache.flush()
+        return groups
+
+    def _hash_batch(self, files: List[Path], kind: str) -> List[Optional[str]]:
+        """经由哈希缓存并行计算一批文件的哈希（结果与 files 顺序一致，分组顺序不受完成顺序影响）"""
+        def progress(done: int, total: int):
+            if done % 500 == 0:
+                print(f"  已计算 {done}/{total}...")
+
+        return self.hash_cache.hash_many(files, kind, workers=self.hash_workers, mode=self.hash_mode,
+                                         progress=progress)
 
     def _pick_keeper(self, paths: List[Path]) -> Tuple[Path, List[Path]]:
         """选择保留的文件：优先路径最短的（通常在顶层 attachments/）"""
@@ -1220,6 +1476,18 @@ def main():
                         help="排除的文件扩展名（默认排除 .pdf .xls .xlsx .xmind，仅对 orphan 模式有效）")
     parser.add_argument("--threshold", type=float, default=0.8, metavar="0.0-1.0",
                         help="近似重复相似度阈值（默认 0.8，仅对 fuzzy 模式有效）")
+    parser.add_argument("--cross-title", action="store_true",
+                        help=f"同时删除标题不同的近似笔记（相似度需 ≥ max(--threshold, {FUZZY_CROSS_TITLE_MIN})；"
+                             "默认只报告，仅对 fuzzy 模式有效）")
+    parser.add_argument("--similarity", choices=SIMILARITY_METHODS, default=DEFAULT_SIMILARITY,
+                        help=f"相似度算法（默认 {DEFAULT_SIMILARITY}：SequenceMatcher；dice：线性时间的 4-gram Dice "
+                             "筛选，达到阈值的再用 ratio 复核；exact：关闭 autojunk，较慢）")
+    parser.add_argument("--no-hash-cache", action="store_true",
+                        help="不读写 .obsidian/vault_tools_hashes.db 文件哈希缓存（仅对 dedup 模式有效）")
+    parser.add_argument("--hash-workers", type=int, default=DEFAULT_HASH_WORKERS, metavar="N",
+                        help=f"并行计算哈希的线程/进程数（默认 {DEFAULT_HASH_WORKERS}，1 为串行，仅对 dedup 模式有效）")
+    parser.add_argument("--hash-mode", choices=HASH_MODES, default="thread",
+                        help="并行方式：thread（默认，适合磁盘/网络 I/O）或 process")
     parser.add_argument("--fix-untitled", action="store_true",
                         help="清理笔记开头的「无标题」占位符（仅对 clean 模式有效）")
 
@@ -1253,7 +1521,9 @@ def main():
     else:
         exclude_ext = DEFAULT_EXCLUDE_EXT
 
-    cleaner = VaultCleaner(str(vault), apply=args.apply, exclude_ext=exclude_ext)
+    cleaner = VaultCleaner(str(vault), apply=args.apply, exclude_ext=exclude_ext,
+                           similarity=args.similarity, hash_cache=not args.no_hash_cache,
+                           hash_workers=args.hash_workers, hash_mode=args.hash_mode)
 
     if args.mode == "dedup":
         result = cleaner.dedup()
@@ -1269,7 +1539,7 @@ def main():
         print(f"{'=' * 60}\n")
 
     elif args.mode == "fuzzy":
-        result = cleaner.fuzzy(threshold=args.threshold)
+        result = cleaner.fuzzy(threshold=args.threshold, cross_title=args.cross_title)
 
     elif args.mode == "clean":
         result = cleaner.clean(fix_untitled=args.fix_untitled)
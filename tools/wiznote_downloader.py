@@ -1,23 +1,50 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import sys
 import json
 import zipfile
-import io
+import tempfile
 import getpass
 from markdownify import markdownify as md
 import shutil
 from pathlib import Path
 import time
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import asynccontextmanager, contextmanager
 import threading
+import queue
+import multiprocessing
+import html
 import argparse
+import asyncio
+import sqlite3
+import hashlib
+import zlib
+import bisect
+import itertools
+import uuid
 import ssl
 import certifi
 from urllib.parse import urlparse
 
 try:
-    from websocket import create_connection
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
+
+# Linux 的 FICLONE ioctl 用于 reflink（写时复制）；其他平台回退到硬链接或复制
+FICLONE = 0x40049409 if fcntl is not None and sys.platform.startswith("linux") else None
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False  # 仅 --engine async 需要
+
+try:
+    from websocket import WebSocketTimeoutException, create_connection
     WEBSOCKET_AVAILABLE = True
 except ImportError:
     WEBSOCKET_AVAILABLE = False
@@ -39,21 +66,1861 @@ AS_URL = "https://as.wiz.cn"
 DEFAULT_MAX_RETRIES = 2
 DEFAULT_TIMEOUT = 15
 DEFAULT_MAX_WORKERS = 5
+DEFAULT_LIST_WORKERS = 8  # 同时扫描的分类数（边扫描边下载）
+DEFAULT_CONVERT_WORKERS = None  # HTML 转 Markdown 的线程数，None 表示与转换进程数相同
+
+# HTML 转 Markdown 进程池：进程数（0 表示在线程内转换）、单篇超时/秒、大小上限、
+# 小于 INLINE_CONVERT_SIZE 的文档直接在线程内转换
+DEFAULT_CONVERT_PROCESSES = min(4, os.cpu_count() or 1)
+DEFAULT_CONVERT_TIMEOUT = 60
+MAX_CONVERT_HTML_SIZE = 20 * 1024 * 1024
+INLINE_CONVERT_SIZE = 32 * 1024
+DEFAULT_WRITE_WORKERS = 1  # 写入 Markdown 文件的线程数
+PIPELINE_QUEUE_FACTOR = 2  # 流水线每个阶段的队列长度 = 该阶段线程数 × 此系数
+
+# 笔记调度：按列表元数据估算工作量，重的笔记先开始、轻的笔记填补空隙。
+# 流水线第一阶段是容量为 SCHEDULE_WINDOW 的优先队列；没有大小信息时每个附件按 ATTACHMENT_WEIGHT 估算，
+# 协作笔记（WebSocket + 逐张下载图片）额外加 COLLAB_WEIGHT
+SCHEDULE_WINDOW = 256
+ATTACHMENT_WEIGHT = 256 * 1024
+COLLAB_WEIGHT = 1024 * 1024
 DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_OUTPUT_BASE = "wiznote_download"
+STATE_DB_NAME = ".wiz_state.db"  # 断点续传状态库（位于下载目录内）
+RESULTS_JOURNAL_NAME = "download_results.jsonl"  # 每篇笔记的处理结果（位于下载目录内，报告由此生成）
+HTTP_CACHE_NAME = ".wiz_http_cache.db"  # --http-cache 未指定路径时的响应缓存（位于下载目录内）
+ASSET_STORE_DIR = ".wiz_blobs"  # 按内容寻址的图片/附件存储（位于下载目录内）
+
+# 全局同时进行的 HTTP 请求数（两种引擎通用）、线程引擎连接池大小、async 引擎单主机连接上限
+DEFAULT_CONCURRENCY = 16
+DEFAULT_POOL_SIZE = None  # None 表示与 --concurrency 相同
+DEFAULT_PER_HOST_LIMIT = 8
+
+# 自适应限速（AIMD）：初始速率、速率上限、速率下限（请求/秒）；--rate 0 关闭限速
+DEFAULT_RATE = 20
+DEFAULT_MAX_RATE = 100
+MIN_RATE = 1
+
+NOTE_LIST_PAGE_SIZE = 100
+
+# 请求统计：耗时直方图的桶上界（秒），运行结束后写入下载目录
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_JSON_NAME = "download_metrics.json"
+METRICS_PROM_NAME = "download_metrics.prom"
+
+# 协作笔记 WebSocket 连接池：最多同时保持的已认证连接数（同一连接可并发获取多篇笔记）
+DEFAULT_COLLAB_CONNECTIONS = 2
+
+# 原始内容归档（--archive / --replay）：归档目录内的数据库，以及随正文一起保存的笔记上下文字段
+ARCHIVE_DIR_NAME = ".wiz_archive"
+ARCHIVE_DB_NAME = "archive.db"
+ARCHIVE_NOTE_FIELDS = ("attachments", "images_found", "images_downloaded", "attachments_found",
+                       "attachments_downloaded", "failed_images", "failed_attachments")
+
+# 响应缓存（--http-cache）：列表页的有效期/秒；正文、资源/附件列表按笔记版本校验，不受有效期限制
+DEFAULT_HTTP_CACHE_TTL = 3600
+DEFAULT_HTTP_CACHE_SIZE = 512  # MB，超出后按最近访问时间淘汰
+
+# 批量导出（--batch 清单）
+DEFAULT_BATCH_OUTPUT = "wiznote_batch"
+DEFAULT_BATCH_PARALLEL = 2  # 同时导出的账号/知识库数
+BATCH_REPORT_NAME = "batch_report.md"
+BATCH_SUMMARY_NAME = "batch_summary.json"
+
+# ZIP 笔记包边下载边写入临时文件，超过该大小后落盘，不再整包放在内存里
+ZIP_SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+ZIP_CHUNK_SIZE = 64 * 1024
+
+# 资源列表 / 附件列表接口的查询参数
+RESOURCE_LIST_PARAMS = {
+    "downloadInfo": "0",
+    "downloadData": "1"
+}
+ATTACHMENT_LIST_PARAMS = {
+    'extra': '1',
+    'clientType': 'web',
+    'clientVersion': '4.0',
+    'lang': 'zh-cn'
+}
+
+
+class DownloadState:
+    """
+    下载状态日志（SQLite）
+
+    记录每篇笔记的列表元数据、处理状态以及每个图片/附件的完成情况，
+    用于 --resume 断点续传：已扫描的分类不再请求列表，未完成的笔记和资源会被重做。
+
+    笔记状态: pending（已列出）→ in_progress（处理中）→ done / collaborative / encrypted / error
+              服务器上已不存在的笔记标记为 deleted
+    资源状态: pending（下载中）→ done
+
+    version/modified 是最近一次列表返回的值，synced_version/synced_modified 是最近一次
+    成功下载时的值，两者不一致说明笔记在服务器上被修改过（用于 --incremental）。
+    """
+
+    FINISHED_STATUSES = ("done", "encrypted")
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS notes (
+                guid TEXT PRIMARY KEY,
+                kb_guid TEXT,
+                title TEXT,
+                category TEXT,
+                version TEXT,
+                modified TEXT,
+                synced_version TEXT,
+                synced_modified TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                md_path TEXT,
+                meta TEXT,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS assets (
+                note_guid TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                PRIMARY KEY (note_guid, kind, name)
+            );
+            CREATE TABLE IF NOT EXISTS categories (
+                kb_guid TEXT NOT NULL,
+                category TEXT NOT NULL,
+                scanned INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (kb_guid, category)
+            );
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            -- 旧版资源索引：按（资源名, 大小）或（大小, CRC32）查找 blob，不能确认内容，不再使用
+            DROP TABLE IF EXISTS blobs;
+            DROP TABLE IF EXISTS blob_index;
+        """)
+        self.conn.commit()
+
+    @staticmethod
+    def note_guid(note):
+        return note.get('guid') or note.get('documentGuid') or note.get('docGuid')
+
+    @staticmethod
+    def note_version(note):
+        """从列表元数据中提取 (version, modified)，用于判断笔记是否变化"""
+        version = note.get('version', note.get('dataVersion'))
+        modified = (note.get('dataModified') or note.get('modified')
+                    or note.get('dateModified') or note.get('infoModified'))
+        return (
+            str(version) if version is not None else None,
+            str(modified) if modified is not None else None,
+        )
+
+    # ── 键值 ──────────────────────────────────────────────
+
+    def get_value(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_value(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False)),
+            )
+            self.conn.commit()
+
+    def delete_value(self, key):
+        with self.lock:
+            self.conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            self.conn.commit()
+
+    # ── 分类与列表 ────────────────────────────────────────
+
+    def is_category_scanned(self, kb_guid, category):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT scanned FROM categories WHERE kb_guid = ? AND category = ?",
+                (kb_guid, category),
+            ).fetchone()
+        return bool(row and row[0])
+
+    def record_listing(self, kb_guid, notes):
+        """写入列表页返回的笔记元数据（已存在的笔记保留其状态）"""
+        now = time.time()
+        rows = []
+        for note in notes:
+            guid = self.note_guid(note)
+            if not guid:
+                continue
+            version, modified = self.note_version(note)
+            rows.append((
+                guid, kb_guid,
+                note.get('title') or note.get('documentTitle') or note.get('docTitle'),
+                note.get('category', note.get('documentCategory', '/')),
+                version, modified,
+                json.dumps(note, ensure_ascii=False), now,
+            ))
+        with self.lock:
+            self.conn.executemany(
+                """
+                INSERT INTO notes (guid, kb_guid, title, category, version, modified, meta, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(guid) DO UPDATE SET
+                    kb_guid = excluded.kb_guid,
+                    title = excluded.title,
+                    category = excluded.category,
+                    version = excluded.version,
+                    modified = excluded.modified,
+                    meta = excluded.meta,
+                    status = CASE WHEN notes.status = 'deleted' THEN 'pending' ELSE notes.status END
+                """,
+                rows,
+            )
+            self.conn.commit()
+
+    def mark_category_scanned(self, kb_guid, category):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO categories (kb_guid, category, scanned) VALUES (?, ?, 1)",
+                (kb_guid, category),
+            )
+            self.conn.commit()
+
+    def reset_scanned(self, kb_guid):
+        """新一轮完整扫描开始前清除分类扫描标记"""
+        with self.lock:
+            self.conn.execute("UPDATE categories SET scanned = 0 WHERE kb_guid = ?", (kb_guid,))
+            self.conn.commit()
+
+    def load_notes(self, kb_guid):
+        """按列表顺序读回已记录的笔记元数据"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT meta FROM notes WHERE kb_guid = ? AND meta IS NOT NULL AND status != 'deleted' ORDER BY rowid",
+                (kb_guid,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    # ── 笔记状态 ──────────────────────────────────────────
+
+    def get_status(self, guid):
+        with self.lock:
+            row = self.conn.execute("SELECT status FROM notes WHERE guid = ?", (guid,)).fetchone()
+        return row[0] if row else None
+
+    def is_finished(self, guid):
+        return self.get_status(guid) in self.FINISHED_STATUSES
+
+    def finished_guids(self, kb_guid):
+        """已完成且此后未在服务器上修改过的笔记"""
+        placeholders = ", ".join("?" for _ in self.FINISHED_STATUSES)
+        with self.lock:
+            rows = self.conn.execute(
+                f"""
+                SELECT guid FROM notes
+                WHERE kb_guid = ? AND status IN ({placeholders})
+                  AND synced_version IS version AND synced_modified IS modified
+                """,
+                (kb_guid, *self.FINISHED_STATUSES),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def synced_notes(self, kb_guid):
+        """返回 {guid: (status, synced_version, synced_modified)}"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT guid, status, synced_version, synced_modified FROM notes WHERE kb_guid = ?",
+                (kb_guid,),
+            ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def mark_deleted(self, kb_guid, listed_guids):
+        """将本次列表中不存在的已下载笔记标记为 deleted，并返回这些笔记"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT guid, title, category, md_path FROM notes WHERE kb_guid = ? AND status != 'deleted'",
+                (kb_guid,),
+            ).fetchall()
+            deleted = [row for row in rows if row[0] not in listed_guids]
+            self.conn.executemany(
+                "UPDATE notes SET status = 'deleted', updated_at = ? WHERE guid = ?",
+                [(time.time(), row[0]) for row in deleted],
+            )
+            self.conn.commit()
+        return [
+            {"note_guid": guid, "title": title, "path": (category or "/").strip("/"), "md_path": md_path}
+            for guid, title, category, md_path in deleted
+        ]
+
+    def mark_note(self, guid, status, md_path=None):
+        """更新笔记状态；完成（done）时把当前列表版本记为已同步版本"""
+        with self.lock:
+            self.conn.execute(
+                """
+                UPDATE notes SET
+                    status = ?,
+                    md_path = COALESCE(?, md_path),
+                    synced_version = CASE WHEN ? = 'done' THEN version ELSE synced_version END,
+                    synced_modified = CASE WHEN ? = 'done' THEN modified ELSE synced_modified END,
+                    updated_at = ?
+                WHERE guid = ?
+                """,
+                (status, md_path, status, status, time.time(), guid),
+            )
+            self.conn.commit()
+
+    # ── 资源状态 ──────────────────────────────────────────
+
+    def is_asset_incomplete(self, note_guid, kind, name):
+        """资源曾开始下载但未完成（文件可能被截断）"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status FROM assets WHERE note_guid = ? AND kind = ? AND name = ?",
+                (note_guid, kind, name),
+            ).fetchone()
+        return bool(row and row[0] != "done")
+
+    def mark_asset(self, note_guid, kind, name, status):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO assets (note_guid, kind, name, status) VALUES (?, ?, ?, ?)",
+                (note_guid, kind, name, status),
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class ResponseCache:
+    """
+    只读 JSON 接口的磁盘响应缓存（SQLite，--http-cache）
+
+    反复调整转换参数重新运行时，分类、笔记列表、正文和资源/附件列表从本地读取，不再请求服务器：
+    - 键为 URL + 查询参数；只缓存 HTTP 200 且 returnCode 为 200（或非 JSON）的响应
+    - 带笔记版本（列表元数据中的 version/modified）的条目：版本一致即命中，不受 TTL 限制；
+      笔记在服务器上修改后版本变化，旧条目作废并被新响应覆盖
+    - 不带版本的条目（分类、笔记列表页）超过 TTL 即过期
+    - 总大小超过上限时按最近访问时间淘汰（LRU），淘汰到上限的 90%
+    """
+
+    def __init__(self, path, ttl=DEFAULT_HTTP_CACHE_TTL, max_bytes=DEFAULT_HTTP_CACHE_SIZE * 1024 * 1024,
+                 clock=time.time):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                version TEXT,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+        """)
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.bytes_served = 0
+
+    @staticmethod
+    def key(url, params=None):
+        if not params:
+            return url
+        return f"{url}?{json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)}"
+
+    @staticmethod
+    def cacheable(status, body):
+        """只缓存成功的响应：HTTP 200，JSON 响应还要求 returnCode 为 200"""
+        if status != 200:
+            return False
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return True
+        if not isinstance(data, dict):
+            return True
+        code = data.get('returnCode', data.get('return_code', 200))
+        return code == 200
+
+    def get(self, key, version=None):
+        """返回缓存的响应体；不存在、已过期或版本不一致时返回 None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT version, body, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            now = self.clock()
+            if row is not None:
+                cached_version, body, stored_at = row
+                if version is not None:
+                    valid = cached_version == version
+                else:
+                    valid = cached_version is None and now - stored_at <= self.ttl
+                if valid:
+                    # 访问时间随下一次写入一起提交，命中时不单独提交事务
+                    self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    self.hits += 1
+                    self.bytes_served += len(body)
+                    return bytes(body)
+            self.misses += 1
+            return None
+
+    def put(self, key, body, version=None):
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            now = self.clock()
+            row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.total_bytes -= row[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, version, body, size, stored_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, version, sqlite3.Binary(body), size, now, now))
+            self.total_bytes += size
+            self.stored += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self.conn.commit()
+
+    def _evict(self, target):
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= size
+            self.evicted += 1
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class NoteArchive:
+    """
+    原始笔记内容归档（--archive），供 --replay 离线重新转换
+
+    - archive.db：每篇笔记一行，保存列表元数据、进入转换阶段前的正文（ZIP 包或 view 接口的 HTML、
+      Lite/协作笔记的 Markdown，zlib 压缩）、附件列表和图片/附件统计
+    - blobs/：笔记资源目录（<title>_files）中的文件按 SHA-256 存放，以 reflink/硬链接写入，
+      相同内容只存一份
+    - meta 表记录归档来源的下载目录（source），--replay 默认写回该目录
+    同一篇笔记再次归档时覆盖旧记录。
+    """
+
+    def __init__(self, root, source=None):
+        self.root = Path(root)
+        self.blobs = self.root / "blobs"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.root / ARCHIVE_DB_NAME), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS notes (
+                guid TEXT PRIMARY KEY,
+                note TEXT NOT NULL,
+                is_markdown INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                extra TEXT NOT NULL,
+                assets TEXT NOT NULL,
+                archived_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        if source is not None:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('source', ?)",
+                              (str(Path(source).resolve()),))
+        self.conn.commit()
+
+    @staticmethod
+    def exists(root):
+        return (Path(root) / ARCHIVE_DB_NAME).exists()
+
+    @staticmethod
+    def source_of(root):
+        """归档来源的下载目录；旧版归档没有记录时，默认位置（下载目录/.wiz_archive）取上级目录，否则为 None"""
+        root = Path(root)
+        conn = sqlite3.connect(str(root / ARCHIVE_DB_NAME))
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            conn.close()
+        if row:
+            return Path(row[0])
+        if root.name == ARCHIVE_DIR_NAME:
+            return root.resolve().parent
+        return None
+
+    @staticmethod
+    def file_digest(path):
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def record(self, note, ctx):
+        """在转换阶段开始前归档一篇笔记（ctx 为流水线中的笔记上下文）"""
+        assets = []
+        assets_path = ctx["assets_path"]
+        if assets_path.is_dir():
+            for path in sorted(p for p in assets_path.rglob("*") if p.is_file()):
+                digest = self.file_digest(path)
+                blob = self.blobs / digest[:2] / digest
+                if not blob.exists():
+                    blob.parent.mkdir(exist_ok=True)
+                    link_file(path, blob)
+                assets.append([path.relative_to(assets_path).as_posix(), digest])
+
+        extra = {key: ctx[key] for key in ARCHIVE_NOTE_FIELDS}
+        body = zlib.compress(ctx["content"].encode("utf-8"), 6)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO notes (guid, note, is_markdown, body, extra, assets, archived_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ctx["guid"], json.dumps(note, ensure_ascii=False), int(bool(ctx["is_markdown"])),
+                 sqlite3.Binary(body), json.dumps(extra, ensure_ascii=False),
+                 json.dumps(assets, ensure_ascii=False), time.time()))
+            self.conn.commit()
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def iter_notes(self, batch=500):
+        """按归档顺序逐批读取笔记，不把整个归档放进内存"""
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, note, is_markdown, body, extra, assets FROM notes "
+                    "WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, batch)).fetchall()
+            if not rows:
+                return
+            for rowid, note, is_markdown, body, extra, assets in rows:
+                last = rowid
+                yield {
+                    "note": json.loads(note),
+                    "is_markdown": bool(is_markdown),
+                    "content": zlib.decompress(body).decode("utf-8"),
+                    "extra": json.loads(extra),
+                    "assets": json.loads(assets),
+                }
+
+    def restore_assets(self, assets, assets_path):
+        """把归档的资源文件链接回笔记的资源目录"""
+        for rel_path, digest in assets:
+            target = Path(assets_path) / rel_path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            link_file(self.blobs / digest[:2] / digest, target)
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class ResultJournal:
+    """
+    笔记处理结果日志（JSONL，位于下载目录）
+
+    每篇笔记的结果、每个下载失败的图片/附件各写一行，内存中只保留各类记录的计数；
+    下载报告从日志中逐行读取生成，内存占用与笔记数、失败数无关。
+
+    记录类型（kind）: success / skip / error / collaborative / encrypted（笔记结果），
+                     failed_image / failed_attachment（下载失败的资源）
+    每条记录带 note_guid；断点续传时由 carry_over 保留已完成笔记的旧记录，再追加本次的结果。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self._file = None
+
+    def append(self, kind, record):
+        line = json.dumps(dict(record, kind=kind), ensure_ascii=False, default=str)
+        with self.lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "w", encoding="utf-8")
+            self._file.write(line + "\n")
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def carry_over(self, keep_guids):
+        """
+        断点续传：保留上次日志中 keep_guids（已完成笔记）的记录，之后的结果追加在其后
+
+        其余笔记本次会重新处理并重新记录，它们的旧记录（包括旧的失败记录）丢弃。
+        返回保留的笔记结果记录数（不含失败资源记录）。
+        """
+        with self.lock:
+            if self._file is not None or not self.path.exists():
+                return 0
+            counts = {}
+            tmp_path = self.path.with_name(self.path.name + ".part")
+            with open(self.path, encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+                for line in src:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 上次中断时只写了一半的行
+                    if record.get("note_guid") not in keep_guids:
+                        continue
+                    dst.write(line if line.endswith("\n") else line + "\n")
+                    kind = record.get("kind")
+                    counts[kind] = counts.get(kind, 0) + 1
+            os.replace(tmp_path, self.path)
+            self.counts = counts
+            self._file = open(self.path, "a", encoding="utf-8")
+        return sum(n for kind, n in counts.items() if kind not in ("failed_image", "failed_attachment"))
+
+    def count(self, kind):
+        return self.counts.get(kind, 0)
+
+    def iter(self, kind):
+        """按写入顺序逐条读取某类记录"""
+        if not self.count(kind):
+            return
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("kind") == kind:
+                    yield record
+
+    def view(self, kind):
+        return JournalView(self, kind)
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class JournalView:
+    """结果日志中某一类记录的列表式视图：append/extend 写入日志，len/迭代从计数和文件读取"""
+
+    def __init__(self, journal, kind):
+        self.journal = journal
+        self.kind = kind
+
+    def append(self, record):
+        self.journal.append(self.kind, record)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def __len__(self):
+        return self.journal.count(self.kind)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        return self.journal.iter(self.kind)
+
+
+def link_file(src, dst, hardlink=False):
+    """
+    把 blob 放到目标位置：优先 reflink（写时复制，Linux btrfs/xfs 等），不支持时复制
+
+    hardlink=True 时改为退回硬链接（都不支持时再复制）：不占额外空间，但所有链接共用
+    一个 inode，在任一笔记中修改这份文件都会同时改变其他笔记和资源存储中的内容。
+    """
+    dst = Path(dst)
+    tmp_path = dst.with_name(dst.name + ".link")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    linked = False
+    if FICLONE is not None:
+        try:
+            with open(src, 'rb') as s, open(tmp_path, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            linked = True
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+    if not linked and hardlink:
+        try:
+            os.link(src, tmp_path)
+            linked = True
+        except OSError:
+            pass
+    if not linked:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+class AssetStore:
+    """
+    按内容寻址的资源存储（位于下载目录的 .wiz_blobs/）
+
+    图片、附件和 ZIP 笔记包中的资源边写入边计算 SHA-256，写入 .wiz_blobs/<前两位>/<摘要>，
+    再以 reflink（不支持时复制）放到各笔记的 <title>_files 目录；摘要已有 blob 的资源
+    不再重复存储。hardlink=True 时退回硬链接，不占额外空间，但各笔记共用同一个
+    inode（见 link_file）。写入前无法确认内容，所以不按名称、大小或 CRC32 跳过下载或解压。
+    """
+
+    def __init__(self, root, hardlink=False):
+        self.root = Path(root)
+        self.tmp_dir = self.root / "tmp"
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.hardlink = hardlink
+        self.lock = threading.Lock()
+        self.stored = 0         # 新写入的 blob 数
+        self.deduped = 0        # 内容已有 blob、未重复存储的资源数
+        self.bytes_reused = 0   # 因去重省下的存储字节数
+
+    def blob_path(self, digest):
+        return self.root / digest[:2] / digest
+
+    def writer(self):
+        return BlobWriter(self)
+
+    def part_path(self, target):
+        """目标文件对应的续传临时文件（同一目标路径每次得到相同的文件名）"""
+        key = hashlib.sha1(str(Path(target).resolve()).encode("utf-8")).hexdigest()
+        return self.tmp_dir / f"{key}.part"
+
+    def commit_file(self, tmp_path, digest, size, target):
+        """把已写完的临时文件归档为 blob（摘要已有 blob 时丢弃临时文件），并链接到 target"""
+        blob = self.blob_path(digest)
+        if blob.exists():
+            Path(tmp_path).unlink()
+            with self.lock:
+                self.deduped += 1
+                self.bytes_reused += size
+        else:
+            blob.parent.mkdir(exist_ok=True)
+            os.replace(tmp_path, blob)
+            with self.lock:
+                self.stored += 1
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        link_file(blob, target, hardlink=self.hardlink)
+        return blob
+
+
+class BlobWriter:
+    """流式写入一个 blob：数据先写入 .wiz_blobs/tmp/ 并同时计算摘要，commit 时归档并链接到目标位置"""
+
+    def __init__(self, store):
+        self.store = store
+        self.tmp_path = store.tmp_dir / f"{uuid.uuid4().hex}.tmp"
+        self.file = open(self.tmp_path, 'wb')
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self, target):
+        self.file.close()
+        blob = self.store.commit_file(self.tmp_path, self.hasher.hexdigest(), self.size, target)
+        self.committed = True
+        return blob
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if not self.committed:
+            self.file.close()
+            self.tmp_path.unlink(missing_ok=True)
+        return False
+
+
+class IncompleteDownloadError(Exception):
+    """收到的字节数与 Content-Length / Content-Range 不一致"""
+
+
+class PartialDownload:
+    """
+    可续传的单个文件下载
+
+    数据写入 .part 临时文件（使用资源存储时位于 .wiz_blobs/tmp/），完整性按
+    Content-Length / Content-Range 校验通过后才原子重命名为目标文件或存入资源存储，
+    中断时不会留下被误认为"已存在"的半截文件。
+    重试或下次运行时按已有 .part 的长度发送 Range 请求续传；If-Range 携带首次响应的
+    ETag / Last-Modified，服务器上的文件变化或不支持 Range 时返回 200，从头重新下载。
+    """
+
+    def __init__(self, target, store=None, name=None, state=None):
+        self.target = Path(target)
+        self.store = store if name else None
+        self.name = name
+        self.state = state
+        if self.store is not None:
+            self.part_path = self.store.part_path(self.target)
+        else:
+            self.part_path = self.target.with_name(self.target.name + ".part")
+        self.file = None
+        self.hasher = None
+        self.received = 0
+        self.expected = None
+        self.resumed_bytes = 0  # 续传时跳过的字节数
+
+    def _validator_key(self):
+        return f"partial:{self.part_path}"
+
+    def request_headers(self):
+        """续传时的 Range / If-Range 请求头"""
+        offset = self.part_path.stat().st_size if self.part_path.exists() else 0
+        if not offset:
+            return {}
+        headers = {"Range": f"bytes={offset}-"}
+        validator = self.state.get_value(self._validator_key()) if self.state is not None else None
+        if validator:
+            headers["If-Range"] = validator
+        return headers
+
+    def begin(self, status, headers):
+        """
+        根据响应状态和响应头准备写入
+
+        只有 206 且 Content-Range 的起点等于 .part 长度时续写，只有 200 时从头写入。
+        返回 False 表示续传范围无效（416，或 206 的起点与 .part 不符），已删除 .part，
+        调用方应不带 Range 重新请求；其他状态抛出 IncompleteDownloadError 并保留 .part。
+        """
+        offset = self.part_path.stat().st_size if self.part_path.exists() else 0
+        if status == 206:
+            start, total = self.parse_content_range(headers.get("Content-Range"))
+            if start != offset:
+                # 拼接到错误的位置会得到损坏的文件：丢弃 .part，从头下载
+                self.part_path.unlink(missing_ok=True)
+                if self.state is not None:
+                    self.state.delete_value(self._validator_key())
+                return False
+            mode = 'ab'
+            self.expected = total
+        elif status == 200:
+            # 首次下载，或服务器忽略 Range / 文件已变化：从头开始
+            offset = 0
+            mode = 'wb'
+            length = headers.get("Content-Length")
+            self.expected = int(length) if length and length.isdigit() else None
+        elif status == 416:
+            self.part_path.unlink(missing_ok=True)
+            return False
+        else:
+            raise IncompleteDownloadError(f"无法续传的响应状态: HTTP {status}")
+        if headers.get("Content-Encoding", "identity") != "identity":
+            self.expected = None  # 压缩传输时 Content-Length 不是文件大小
+
+        validator = headers.get("ETag") or headers.get("Last-Modified")
+        if validator and self.state is not None and mode == 'wb':
+            self.state.set_value(self._validator_key(), validator)
+
+        self.part_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.store is not None:
+            self.hasher = hashlib.sha256()
+            if offset:
+                # 续传：先把已下载部分计入摘要
+                with open(self.part_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(ZIP_CHUNK_SIZE), b""):
+                        self.hasher.update(chunk)
+        self.file = open(self.part_path, mode)
+        self.received = offset
+        self.resumed_bytes = offset
+        return True
+
+    @staticmethod
+    def parse_content_range(value):
+        """解析 "bytes start-end/total"，返回 (start, total)，无法解析时返回 (None, None)"""
+        match = re.match(r'bytes\s+(\d+)-\d+/(\d+|\*)', value or "")
+        if not match:
+            return None, None
+        total = match.group(2)
+        return int(match.group(1)), (int(total) if total != "*" else None)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        if self.hasher is not None:
+            self.hasher.update(chunk)
+        self.received += len(chunk)
+
+    def finish(self):
+        """校验长度后完成下载（长度不符时保留 .part 供续传并抛出 IncompleteDownloadError）"""
+        self.file.close()
+        self.file = None
+        if self.expected is not None and self.received != self.expected:
+            raise IncompleteDownloadError(f"收到 {self.received} 字节，应为 {self.expected} 字节")
+        if self.state is not None:
+            self.state.delete_value(self._validator_key())
+        if self.store is not None:
+            self.store.commit_file(self.part_path, self.hasher.hexdigest(), self.received, self.target)
+        else:
+            os.replace(self.part_path, self.target)
+
+    def abort(self):
+        """中断：关闭文件，保留 .part 以便续传"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class RequestScheduler:
+    """
+    线程引擎的请求调度器
+
+    笔记、图片、附件下载共用同一个 requests.Session：
+    - 挂载按并发数定大小的 HTTPAdapter（pool_block=True），连接全部复用，不再出现
+      "Connection pool is full, discarding connection" 和重复 TLS 握手
+    - 全局信号量限制同时进行的请求数，嵌套线程池（笔记 × 图片/附件）不会放大并发
+    """
+
+    def __init__(self, session, concurrency=DEFAULT_CONCURRENCY, pool_size=DEFAULT_POOL_SIZE,
+                 semaphore=None):
+        self.concurrency = max(1, concurrency)
+        self.pool_size = max(1, pool_size or self.concurrency)
+        # 批量导出时多个账号传入同一个信号量，共用全局并发预算
+        self.semaphore = semaphore or threading.BoundedSemaphore(self.concurrency)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._counter_lock = threading.Lock()
+
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, pool_block=True)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+    @contextmanager
+    def slot(self):
+        """占用一个在途请求名额，直到响应体读取完毕"""
+        with self.semaphore:
+            with self._counter_lock:
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                yield
+            finally:
+                with self._counter_lock:
+                    self.in_flight -= 1
+
+
+class AdaptiveRateLimiter:
+    """
+    AIMD 自适应限速器（两种引擎、所有接口共用）
+
+    - 每个请求发出前按当前速率排队（令牌间隔 = 1 / rate）
+    - 成功响应：加性增长，约每秒 +increase 个请求/秒，直到 max_rate
+    - 429 / 503 / 其他 5xx / 超时：乘性减半；带 Retry-After 时所有请求暂停到指定时间
+    - 延迟明显高于基线（服务器开始排队）时小幅降速
+    同一轮拥塞中并发线程收到的多个错误只降速一次（cooldown）。
+    """
+
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, rate=DEFAULT_RATE, max_rate=DEFAULT_MAX_RATE, min_rate=MIN_RATE,
+                 increase=1.0, decrease=0.5, latency_factor=3.0, cooldown=1.0,
+                 clock=time.monotonic):
+        self.enabled = rate > 0
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate, min_rate)
+        self.rate = min(max(rate, min_rate), self.max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.clock = clock
+
+        self.next_time = 0.0       # 下一个请求最早可发出的时间
+        self.blocked_until = 0.0   # Retry-After 暂停截止时间
+        self.last_decrease = None
+        self.latency_ewma = None
+        self.latency_baseline = None
+
+        # 统计
+        self.throttled = 0         # 收到 429/503 的次数
+        self.server_errors = 0     # 其他 5xx 次数
+        self.decreases = 0
+        self._lock = threading.Lock()
+
+    # ── 排队 ──────────────────────────────────────────────
+
+    def reserve(self):
+        """预约一个发送时间，返回需要等待的秒数（供同步/异步两种等待方式使用）"""
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            now = self.clock()
+            start = max(now, self.next_time, self.blocked_until)
+            self.next_time = start + 1.0 / self.rate
+            return start - now
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    # ── 反馈 ──────────────────────────────────────────────
+
+    @staticmethod
+    def parse_retry_after(value):
+        """解析 Retry-After（秒数；HTTP 日期格式按无法解析处理）"""
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            return None
+
+    def on_response(self, status, latency, retry_after=None):
+        """根据一个响应的状态码、Retry-After 和耗时调整速率"""
+        if not self.enabled:
+            return
+        retry_after = self.parse_retry_after(retry_after)
+        with self._lock:
+            now = self.clock()
+            if status in self.THROTTLE_STATUSES or retry_after is not None and status >= 400:
+                self.throttled += 1
+                if retry_after is not None:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+                self._decrease(now, self.decrease)
+            elif status >= 500:
+                self.server_errors += 1
+                self._decrease(now, self.decrease)
+            elif status < 400:
+                if self._latency_degraded(latency):
+                    self._decrease(now, 0.9)
+                else:
+                    self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_error(self):
+        """连接错误或超时：视同服务器过载"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._decrease(self.clock(), self.decrease)
+
+    def _latency_degraded(self, latency):
+        if latency is None:
+            return False
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+        if self.latency_baseline is None or self.latency_ewma < self.latency_baseline:
+            self.latency_baseline = self.latency_ewma
+        return self.latency_ewma > self.latency_baseline * self.latency_factor + 0.05
+
+    def _decrease(self, now, factor):
+        if self.last_decrease is not None and now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.decreases += 1
+        self.rate = max(self.min_rate, self.rate * factor)
+        # 降速后基线跟随当前延迟，避免持续降速
+        self.latency_baseline = self.latency_ewma
+
+    def retry_delay(self, attempt):
+        """重试前的等待时间：Retry-After 剩余时间与指数退避取较大者"""
+        with self._lock:
+            blocked = max(0.0, self.blocked_until - self.clock())
+        return max(blocked, 0.5 * (2 ** attempt))
+
+    def describe(self):
+        return f"{self.rate:.1f} req/s" if self.enabled else "不限速"
+
+
+class BandwidthLimiter:
+    """
+    下载带宽限制（字节/秒，所有流式下载共用）
+
+    每读到一个数据块按块大小预约时间，允许 burst 秒的突发；批量导出时多个账号共用同一个实例。
+    与 AdaptiveRateLimiter 一样分为 reserve（计算等待时间）和同步/异步两种等待方式。
+    """
+
+    def __init__(self, bytes_per_sec=0, burst=0.25, clock=time.monotonic):
+        self.enabled = bytes_per_sec > 0
+        self.rate = float(bytes_per_sec)
+        self.burst = burst
+        self.clock = clock
+        self.next_time = 0.0
+        self.bytes = 0
+        self.waited = 0.0  # 因限速累计等待的秒数
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """为 size 字节预约带宽，返回需要等待的秒数"""
+        if not self.enabled or size <= 0:
+            return 0.0
+        with self._lock:
+            now = self.clock()
+            self.next_time = max(self.next_time, now - self.burst) + size / self.rate
+            self.bytes += size
+            delay = max(0.0, self.next_time - now)
+            self.waited += delay
+            return delay
+
+    def acquire(self, size):
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, size):
+        delay = self.reserve(size)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def describe(self):
+        return f"{self.rate / 1024 / 1024:.1f} MB/s" if self.enabled else "不限速"
+
+
+class ExportBudget:
+    """批量导出时各账号共用的预算：在途请求数（信号量）、自适应限速器和下载带宽"""
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, max_rate=DEFAULT_MAX_RATE,
+                 max_bandwidth=0):
+        self.concurrency = max(1, concurrency)
+        self.semaphore = threading.BoundedSemaphore(self.concurrency)
+        self.rate_limiter = AdaptiveRateLimiter(rate=rate, max_rate=max_rate)
+        self.bandwidth = BandwidthLimiter(max_bandwidth * 1024 * 1024)
+
+
+class RequestMetrics:
+    """
+    按接口汇总请求耗时、次数、字节数、状态码、异常和重试次数
+
+    两种引擎的所有 HTTP 请求和协作笔记 WebSocket 都在这里记录；运行结束后写出
+    download_metrics.json（可选 Prometheus 文本格式），与 download_report.md 放在一起。
+    耗时从发出请求算起，流式下载包含读取响应体的时间。
+    """
+
+    # 接口名与 URL 路径的对应关系（按顺序匹配）
+    ENDPOINT_PATTERNS = [
+        ("login", re.compile(r"/as/user/login$")),
+        ("categories", re.compile(r"/ks/category/")),
+        ("note_list", re.compile(r"/ks/note/list/")),
+        ("collab_token", re.compile(r"/ks/note/[^/]+/[^/]+/tokens$")),
+        ("note_download", re.compile(r"/ks/note/download/")),
+        ("note_view", re.compile(r"/ks/note/view/")),
+        ("attachment_list", re.compile(r"/ks/note/attachments/")),
+        ("attachment_download", re.compile(r"/ks/attachment/download/")),
+        ("collab_image", re.compile(r"/editor/[^/]+/[^/]+/resources/")),
+    ]
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.started = time.time()
+
+    @classmethod
+    def endpoint(cls, url, params=None):
+        """根据 URL 判断接口名；带 downloadData 参数的 /ks/note/download 是资源列表，其余 URL 视为资源文件"""
+        path = urlparse(url).path
+        for name, pattern in cls.ENDPOINT_PATTERNS:
+            if pattern.search(path):
+                if name == "note_download" and params and "downloadData" in params:
+                    return "resource_list"
+                return name
+        return "resource"
+
+    @staticmethod
+    def response_size(response):
+        """已读取的响应体字节数：流式响应取底层连接读取的字节数，否则取响应体长度"""
+        raw = getattr(response, "raw", None)
+        if raw is not None and hasattr(raw, "tell"):
+            try:
+                return raw.tell()
+            except Exception:
+                pass
+        content = getattr(response, "_content", None)
+        if isinstance(content, bytes):
+            return len(content)
+        try:
+            return int(response.headers.get("Content-Length") or 0)
+        except (AttributeError, TypeError, ValueError):
+            return 0
+
+    def _stats(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = {
+                "count": 0,
+                "bytes": 0,
+                "retries": 0,
+                "status": {},
+                "errors": {},
+                "latency_sum": 0.0,
+                "latency_max": 0.0,
+                "buckets": [0] * (len(self.buckets) + 1),  # 最后一个桶为 +Inf
+            }
+        return stats
+
+    def record(self, endpoint, status, latency, size=0, error=None):
+        """记录一次请求；status 为 None 表示没有收到响应，error 为异常类型名"""
+        index = bisect.bisect_left(self.buckets, latency)
+        with self.lock:
+            stats = self._stats(endpoint)
+            stats["count"] += 1
+            stats["bytes"] += size or 0
+            stats["latency_sum"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+            stats["buckets"][index] += 1
+            if status is not None:
+                key = str(status)
+                stats["status"][key] = stats["status"].get(key, 0) + 1
+            if error:
+                stats["errors"][error] = stats["errors"].get(error, 0) + 1
+
+    def record_retry(self, endpoint):
+        with self.lock:
+            self._stats(endpoint)["retries"] += 1
+
+    def _quantile(self, stats, q):
+        """按直方图估算分位数（返回所在桶的上界，落在 +Inf 桶时返回最大值）"""
+        target = q * stats["count"]
+        seen = 0
+        for bound, count in zip(self.buckets, stats["buckets"]):
+            seen += count
+            if seen >= target:
+                return bound
+        return stats["latency_max"]
+
+    def snapshot(self):
+        """返回可直接写成 JSON 的统计结果"""
+        with self.lock:
+            endpoints = {}
+            for name, stats in sorted(self.endpoints.items()):
+                count = stats["count"]
+                cumulative, buckets = 0, {}
+                for bound, n in zip(self.buckets + (float("inf"),), stats["buckets"]):
+                    cumulative += n
+                    buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+                endpoints[name] = {
+                    "count": count,
+                    "bytes": stats["bytes"],
+                    "retries": stats["retries"],
+                    "status": dict(stats["status"]),
+                    "errors": dict(stats["errors"]),
+                    "latency": {
+                        "sum": round(stats["latency_sum"], 6),
+                        "mean": round(stats["latency_sum"] / count, 6) if count else 0.0,
+                        "max": round(stats["latency_max"], 6),
+                        "p50": self._quantile(stats, 0.5) if count else None,
+                        "p90": self._quantile(stats, 0.9) if count else None,
+                        "p99": self._quantile(stats, 0.99) if count else None,
+                        "buckets": buckets,
+                    },
+                }
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "elapsed": round(time.time() - self.started, 3),
+            "totals": {
+                "requests": sum(e["count"] for e in endpoints.values()),
+                "bytes": sum(e["bytes"] for e in endpoints.values()),
+                "retries": sum(e["retries"] for e in endpoints.values()),
+                "errors": sum(sum(e["errors"].values()) for e in endpoints.values()),
+                "latency_sum": round(sum(e["latency"]["sum"] for e in endpoints.values()), 3),
+            },
+            "endpoints": endpoints,
+        }
+
+    def to_prometheus(self, snapshot=None):
+        """Prometheus 文本格式（textfile collector 可直接读取）"""
+        snapshot = snapshot or self.snapshot()
+        lines = [
+            "# HELP wiz_requests_total Requests sent by wiznote_downloader, by endpoint and status.",
+            "# TYPE wiz_requests_total counter",
+        ]
+        endpoints = snapshot["endpoints"]
+        for name, stats in endpoints.items():
+            for status, count in sorted(stats["status"].items()):
+                lines.append(f'wiz_requests_total{{endpoint="{name}",status="{status}"}} {count}')
+        lines += ["# HELP wiz_request_errors_total Requests that raised an exception, by endpoint and type.",
+                  "# TYPE wiz_request_errors_total counter"]
+        for name, stats in endpoints.items():
+            for error, count in sorted(stats["errors"].items()):
+                lines.append(f'wiz_request_errors_total{{endpoint="{name}",error="{error}"}} {count}')
+        lines += ["# HELP wiz_request_retries_total Retried requests, by endpoint.",
+                  "# TYPE wiz_request_retries_total counter"]
+        lines += [f'wiz_request_retries_total{{endpoint="{name}"}} {stats["retries"]}'
+                  for name, stats in endpoints.items()]
+        lines += ["# HELP wiz_response_bytes_total Response body bytes received, by endpoint.",
+                  "# TYPE wiz_response_bytes_total counter"]
+        lines += [f'wiz_response_bytes_total{{endpoint="{name}"}} {stats["bytes"]}'
+                  for name, stats in endpoints.items()]
+        lines += ["# HELP wiz_request_duration_seconds Request latency, by endpoint.",
+                  "# TYPE wiz_request_duration_seconds histogram"]
+        for name, stats in endpoints.items():
+            for bound, count in stats["latency"]["buckets"].items():
+                lines.append(f'wiz_request_duration_seconds_bucket{{endpoint="{name}",le="{bound}"}} {count}')
+            lines.append(f'wiz_request_duration_seconds_sum{{endpoint="{name}"}} {stats["latency"]["sum"]}')
+            lines.append(f'wiz_request_duration_seconds_count{{endpoint="{name}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, output_path, prometheus=False):
+        """写出 download_metrics.json（以及可选的 download_metrics.prom），返回写出的文件列表"""
+        snapshot = self.snapshot()
+        written = []
+        json_path = Path(output_path) / METRICS_JSON_NAME
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        written.append(json_path)
+        if prometheus:
+            prom_path = Path(output_path) / METRICS_PROM_NAME
+            with open(prom_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus(snapshot))
+            written.append(prom_path)
+        return written
+
+
+def html_to_markdown(html_content):
+    """HTML 转 Markdown（模块级函数，可在子进程中执行）"""
+    return md(html_content, heading_style="ATX")
+
+
+def html_to_plain_text(html_content):
+    """兜底转换：去掉标签只保留文字（用于超大或转换超时的文档）"""
+    text = re.sub(r'(?is)<(script|style)\b.*?</\1>', '', html_content)
+    text = re.sub(r'(?i)<br\s*/?>|</(p|div|li|tr|h[1-6])>', '\n', text)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = html.unescape(text)
+    return re.sub(r'\n{3,}', '\n\n', text).strip() + '\n'
+
+
+def _convert_worker(conn):
+    """转换子进程：就绪后逐个接收 HTML，返回 (True, markdown) 或 (False, 异常)；收到 None 时退出"""
+    conn.send("ready")
+    while True:
+        try:
+            html_content = conn.recv()
+        except EOFError:
+            return
+        if html_content is None:
+            return
+        try:
+            conn.send((True, html_to_markdown(html_content)))
+        except Exception as e:
+            conn.send((False, e))
+
+
+class MarkdownConverter:
+    """
+    HTML → Markdown 转换器
+
+    markdownify 是纯 Python 的 CPU 密集操作，在下载线程中执行会被 GIL 串行化。
+    较大的 HTML 交给最多 processes 个常驻子进程转换，可利用多核；
+    小文档在当前线程直接转换，省去进程间传输的开销。
+    每个子进程同一时间只转换一篇：等待空闲子进程的时间不计入超时，计时从子进程收到文档开始。
+    超过大小上限或转换超时的文档改为纯文本兜底，超时时只终止正在转换这篇的子进程。
+    """
+
+    def __init__(self, processes=DEFAULT_CONVERT_PROCESSES, timeout=DEFAULT_CONVERT_TIMEOUT,
+                 max_size=MAX_CONVERT_HTML_SIZE, inline_size=INLINE_CONVERT_SIZE):
+        self.processes = max(0, processes)
+        self.timeout = timeout
+        self.max_size = max_size
+        self.inline_size = inline_size
+        self.fallbacks = 0  # 使用纯文本兜底的文档数
+        self.terminated = 0  # 因超时被终止的子进程数
+        self._slots = threading.BoundedSemaphore(self.processes) if self.processes else None
+        self._idle = []      # 空闲的子进程 [(process, conn)]
+        self._lock = threading.Lock()
+
+    def convert(self, html_content):
+        """返回 (markdown, fallback_reason)；fallback_reason 为 None 表示正常转换"""
+        size = len(html_content)
+        if self.max_size and size > self.max_size:
+            return self._fallback(html_content, f"HTML 过大（{size // 1024} KB）")
+        if self.processes == 0 or size <= self.inline_size:
+            return html_to_markdown(html_content), None
+
+        for _attempt in range(2):
+            with self._slots:  # 排队等待空闲的子进程（不计入超时）
+                try:
+                    worker = self._take_worker()
+                except (EOFError, OSError):
+                    break  # 无法启动子进程：在当前线程转换
+                conn = worker[1]
+                try:
+                    conn.send(html_content)
+                    if not conn.poll(self.timeout):
+                        # 正在执行的转换无法取消，只能终止这个子进程；其他子进程不受影响
+                        self._discard(worker, terminate=True)
+                        with self._lock:
+                            self.terminated += 1
+                        return self._fallback(html_content, f"转换超过 {self.timeout} 秒")
+                    ok, value = conn.recv()
+                except (EOFError, OSError):
+                    # 子进程意外退出，换一个新的子进程重试一次
+                    self._discard(worker)
+                    continue
+                with self._lock:
+                    self._idle.append(worker)
+            if ok:
+                return value, None
+            raise value
+        return html_to_markdown(html_content), None
+
+    def _fallback(self, html_content, reason):
+        with self._lock:
+            self.fallbacks += 1
+        return html_to_plain_text(html_content), reason
+
+    def _take_worker(self):
+        """取一个空闲子进程，没有时启动新的并等它就绪（启动耗时不计入超时）"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        parent, child = multiprocessing.Pipe()
+        # spawn：子进程不继承下载线程的状态（fork 多线程进程不安全）
+        process = multiprocessing.get_context("spawn").Process(
+            target=_convert_worker, args=(child,), name="wiz-convert", daemon=True)
+        process.start()
+        child.close()
+        try:
+            parent.recv()
+        except (EOFError, OSError):
+            MarkdownConverter._discard((process, parent), terminate=True)
+            raise
+        return process, parent
+
+    @staticmethod
+    def _discard(worker, terminate=False):
+        process, conn = worker
+        if terminate:
+            process.terminate()
+        conn.close()
+        process.join(timeout=5)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for process, conn in idle:
+            try:
+                conn.send(None)
+            except OSError:
+                process.terminate()
+            conn.close()
+            process.join(timeout=5)
+
+
+class ListedNoteCounter:
+    """
+    代替 all_notes 列表传给 scan_folder_recursive：只计数、不保存笔记
+
+    线程引擎边扫描边下载，笔记已写入状态库并送入流水线，无需在内存中保留完整列表。
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def extend(self, notes):
+        self.count += len(notes)
+
+    def __len__(self):
+        return self.count
+
+
+class NotePipeline:
+    """
+    线程引擎的分阶段流水线
+
+    笔记依次经过：获取正文 → 下载图片/附件 → HTML 转 Markdown → 写入文件。
+    每个阶段有独立的线程数和有界队列：
+    - CPU 密集的转换不再占用网络线程，网络慢时也不会拖住转换
+    - 队列满时上游（包括扫描线程）阻塞等待，内存占用与账号大小无关
+    处理结果（含提前结束的 skip/加密/错误）放入 results 队列，由主线程汇总。
+    """
+
+    _STOP = object()
+
+    def __init__(self, migrator, output_base, workers):
+        self.migrator = migrator
+        self.output_base = output_base
+        self.results = queue.Queue()
+        m = migrator
+        self.stages = [
+            ("fetch", lambda note, ctx: m._fetch_note_body(ctx)),
+            ("assets", lambda note, ctx: m._fetch_note_assets(ctx)),
+            ("convert", m._convert_note),
+            ("write", lambda note, ctx: m._write_note(ctx)),
+        ]
+        self.workers = [max(1, workers.get(name, 1)) for name, _ in self.stages]
+        self.queues = [queue.Queue(maxsize=n * PIPELINE_QUEUE_FACTOR) for n in self.workers]
+        # 第一阶段按工作量排序：窗口内最重的笔记先取出，相同权重按提交顺序
+        self.queues[0] = queue.PriorityQueue(maxsize=max(SCHEDULE_WINDOW, self.workers[0] * PIPELINE_QUEUE_FACTOR))
+        self._order = itertools.count()
+        self._running = [0] * len(self.stages)
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for index, count in enumerate(self.workers):
+            self._running[index] = count
+            for i in range(count):
+                thread = threading.Thread(target=self._worker, args=(index,),
+                                          name=f"wiz-{self.stages[index][0]}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def submit(self, note, weight=0):
+        """提交一个笔记，weight 越大越先处理（队列满时阻塞，形成背压）"""
+        self.queues[0].put((-weight, next(self._order), (note, None)))
+
+    def close(self):
+        """不再提交新笔记：各阶段处理完已有任务后依次退出"""
+        for _ in range(self.workers[0]):
+            self.queues[0].put((float("inf"), next(self._order), self._STOP))
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _run_stage(self, index, note, ctx):
+        m = self.migrator
+        if index == 0:
+            ctx, early_result = m._prepare_note(note, self.output_base)
+            if ctx is None:
+                return ctx, early_result, True
+        try:
+            result = self.stages[index][1](note, ctx)
+        except Exception as e:
+            return ctx, m._error_result(ctx, str(e)), True
+        return ctx, result, result is not None or index == len(self.stages) - 1
+
+    def _worker(self, index):
+        inbox = self.queues[index]
+        while True:
+            item = inbox.get()
+            if index == 0:
+                item = item[2]  # 去掉优先级
+            if item is self._STOP:
+                break
+            note, ctx = item
+            ctx, result, finished = self._run_stage(index, note, ctx)
+            if finished:
+                self.migrator._record_note_state(note, result)
+                self.results.put(result)
+            else:
+                self.queues[index + 1].put((note, ctx))
+
+        # 本阶段最后一个线程退出时，通知下一阶段
+        with self._lock:
+            self._running[index] -= 1
+            last = self._running[index] == 0
+        if last and index + 1 < len(self.stages):
+            for _ in range(self.workers[index + 1]):
+                self.queues[index + 1].put(self._STOP)
+
+
+class CollaborationConnection:
+    """
+    一条已认证的协作编辑 WebSocket 连接（ShareJS 协议）
+
+    后台线程持续接收消息，按响应中的 (c, d) 把 fetch 结果分发给等待的线程，
+    因此多个线程可以同时在同一连接上获取不同笔记（多路复用）。
+    """
+
+    def __init__(self, ws, url):
+        self.ws = ws
+        self.url = url
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.waiters = {}       # doc_guid -> [Event, 原始响应]
+        self.closed = False
+        self.fetches = 0
+        self.reader = threading.Thread(target=self._read_loop, name="wiz-collab-reader", daemon=True)
+
+    def start(self):
+        self.reader.start()
+        return self
+
+    @property
+    def in_flight(self):
+        with self.lock:
+            return len(self.waiters)
+
+    def fetch(self, hs_request, doc_guid, f_request, timeout):
+        """发送本笔记的握手和 fetch 请求，等待内容响应；失败或超时返回 None"""
+        waiter = [threading.Event(), None]
+        with self.lock:
+            if self.closed or doc_guid in self.waiters:
+                return None
+            self.waiters[doc_guid] = waiter
+            self.fetches += 1
+        try:
+            with self.send_lock:
+                self.ws.send(json.dumps(hs_request))
+                self.ws.send(json.dumps(f_request))
+            waiter[0].wait(timeout)
+        except Exception:
+            self.close()
+        finally:
+            with self.lock:
+                self.waiters.pop(doc_guid, None)
+        return waiter[1]
+
+    def _read_loop(self):
+        while not self.closed:
+            try:
+                raw = self.ws.recv()
+            except WebSocketTimeoutException:
+                continue  # 空闲连接，继续等待
+            except Exception:
+                break
+            try:
+                message = json.loads(raw)
+            except (TypeError, ValueError):
+                continue
+            if not isinstance(message, dict) or message.get("a") != "f":
+                continue  # 握手响应等与 fetch 无关的消息
+            with self.lock:
+                waiter = self.waiters.get(message.get("d"))
+                if waiter is None and "d" not in message and len(self.waiters) == 1:
+                    waiter = next(iter(self.waiters.values()))
+            if waiter is None:
+                continue
+            if "data" in message:
+                waiter[1] = raw
+                waiter[0].set()
+            elif "error" in message:
+                waiter[0].set()
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            waiters = list(self.waiters.values())
+        for waiter in waiters:
+            waiter[0].set()
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+
+class CollaborationClient:
+    """
+    协作笔记 WebSocket 连接池
+
+    - 连接建立并完成握手后保持打开，后续笔记复用连接，不再每篇笔记一次 TLS 握手和三次握手
+    - 每篇笔记仍使用自己的 editor token 发送一次 hs（认证该笔记），随后发送 fetch
+    - 同一连接上可以同时进行多篇笔记的 fetch（按响应中的文档 ID 分发）
+    - 复用连接获取失败时，为该笔记单独建立新连接重试一次（兼容不允许复用的服务器）
+    """
+
+    def __init__(self, migrator, max_connections=DEFAULT_COLLAB_CONNECTIONS, timeout=30):
+        self.migrator = migrator
+        self.max_connections = max(1, max_connections)
+        self.timeout = timeout
+        self.connections = []
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.opening = 0  # 正在建立的连接数（计入上限）
+        self.opened = 0   # 建立过的连接数
+        self.reused = 0   # 复用已有连接完成的获取数
+
+    def editor_url(self, doc_guid):
+        m = self.migrator
+        parsed = urlparse(m.kapi_url)
+        scheme = "ws" if parsed.scheme == "http" else "wss"
+        return f"{scheme}://{parsed.netloc}/editor/{m.kb_guid}/{doc_guid}"
+
+    def _handshake(self, doc_guid, editor_token):
+        m = self.migrator
+        return {
+            "a": "hs",
+            "id": None,
+            "auth": {
+                "appId": m.kb_guid,
+                "docId": doc_guid,
+                "userId": m.user_guid,
+                "permission": "w",
+                "token": editor_token
+            }
+        }
+
+    def _open(self, doc_guid, editor_token):
+        """建立新连接并完成握手（与参考实现一致：发送 3 次握手，只接收不验证）"""
+        url = self.editor_url(doc_guid)
+        print(f"    🔗 连接 WebSocket: {url}")
+        started = time.monotonic()
+        try:
+            conn = self._connect(url, doc_guid, editor_token)
+        except Exception as e:
+            self.migrator.metrics.record("websocket_connect", None, time.monotonic() - started,
+                                         error=type(e).__name__)
+            raise
+        self.migrator.metrics.record("websocket_connect", 101, time.monotonic() - started)
+        return conn
+
+    def _connect(self, url, doc_guid, editor_token):
+        options = {}
+        if url.startswith("wss://"):
+            options["sslopt"] = {"cert_reqs": ssl.CERT_REQUIRED, "ca_certs": certifi.where(),
+                                 "check_hostname": True}
+        ws = create_connection(url, header={"Cookie": f"x-live-editor-token={editor_token}"},
+                               timeout=self.timeout, **options)
+        try:
+            hs_msg = json.dumps(self._handshake(doc_guid, editor_token))
+            for i in range(3):
+                ws.send(hs_msg)
+                try:
+                    json.loads(ws.recv())
+                except json.JSONDecodeError:
+                    raise RuntimeError(f"握手 {i+1} 响应不是有效 JSON")
+        except Exception:
+            ws.close()
+            raise
+        with self.lock:
+            self.opened += 1
+        return CollaborationConnection(ws, url).start()
+
+    def _acquire(self, doc_guid, editor_token):
+        """优先复用空闲连接；都在忙且未达上限时新建连接，否则选负载最低的连接"""
+        with self.ready:
+            while True:
+                self.connections = [c for c in self.connections if not c.closed]
+                total = len(self.connections) + self.opening
+                if self.connections:
+                    best = min(self.connections, key=lambda c: c.in_flight)
+                    if best.in_flight == 0 or total >= self.max_connections:
+                        return best, True
+                if total < self.max_connections:
+                    self.opening += 1
+                    break
+                self.ready.wait()  # 连接正在建立中，等它可用
+        conn = None
+        try:
+            conn = self._open(doc_guid, editor_token)
+        finally:
+            with self.ready:
+                self.opening -= 1
+                if conn is not None:
+                    self.connections.append(conn)
+                self.ready.notify_all()
+        return conn, False
+
+    def fetch(self, doc_guid, editor_token):
+        """获取协作笔记的原始 fetch 响应（JSON 字符串），失败返回 None"""
+        started = time.monotonic()
+        raw = self._fetch(doc_guid, editor_token)
+        if raw is None:
+            self.migrator.metrics.record("websocket_fetch", None, time.monotonic() - started, error="NoResponse")
+        else:
+            self.migrator.metrics.record("websocket_fetch", 200, time.monotonic() - started, len(raw))
+        return raw
+
+    def _fetch(self, doc_guid, editor_token):
+        m = self.migrator
+        f_request = {"a": "f", "c": m.kb_guid, "d": doc_guid, "v": None}
+        hs_request = self._handshake(doc_guid, editor_token)
+
+        conn, reused = self._acquire(doc_guid, editor_token)
+        raw = conn.fetch(hs_request, doc_guid, f_request, self.timeout)
+        if raw is not None:
+            if reused:
+                with self.lock:
+                    self.reused += 1
+            return raw
+        if not reused:
+            return None
+
+        # 复用的连接上获取失败：为这篇笔记单独建立连接重试
+        self.migrator.metrics.record_retry("websocket_fetch")
+        conn = self._open(doc_guid, editor_token)
+        try:
+            return conn.fetch(hs_request, doc_guid, f_request, self.timeout)
+        finally:
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
+
+
+class CachedResponse:
+    """响应缓存命中时代替 requests.Response（只提供解析只读接口用到的属性）"""
+
+    status_code = 200
+
+    def __init__(self, url, content):
+        self.url = url
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='ignore')
+
+    def json(self):
+        return json.loads(self.content)
+
 
 class WizMigrator:
     def __init__(self, user_id, password, max_workers=DEFAULT_MAX_WORKERS,
                  max_retries=DEFAULT_MAX_RETRIES, timeout=DEFAULT_TIMEOUT,
                  connect_timeout=DEFAULT_CONNECT_TIMEOUT,
-                 on_progress=None):
+                 on_progress=None, output_base=DEFAULT_OUTPUT_BASE,
+                 resume=False, incremental=False, engine="thread",
+                 concurrency=DEFAULT_CONCURRENCY, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                 pool_size=DEFAULT_POOL_SIZE, rate=DEFAULT_RATE, max_rate=DEFAULT_MAX_RATE,
+                 list_workers=DEFAULT_LIST_WORKERS, convert_workers=DEFAULT_CONVERT_WORKERS,
+                 write_workers=DEFAULT_WRITE_WORKERS, convert_processes=DEFAULT_CONVERT_PROCESSES,
+                 convert_timeout=DEFAULT_CONVERT_TIMEOUT, asset_store=True, hardlink_assets=False,
+                 collab_connections=DEFAULT_COLLAB_CONNECTIONS, metrics_prometheus=False,
+                 max_bandwidth=0, budget=None, kb_guid=None, kb_server=None,
+                 http_cache=None, http_cache_ttl=DEFAULT_HTTP_CACHE_TTL,
+                 http_cache_size=DEFAULT_HTTP_CACHE_SIZE, archive=None):
         self.user_id = user_id
         self.password = password
         self.token = None
         self.kb_guid = None
         self.kapi_url = None
         self.user_guid = None  # 用户 GUID（用于 WebSocket 认证）
+        # 指定要导出的知识库（如团队知识库）；登录后覆盖账号默认的 kb_guid / API 地址
+        self.kb_guid_override = kb_guid
+        self.kb_server_override = kb_server
         self.session = requests.Session()
         self.processed_count = 0
+        self.resumed_notes = 0  # 断点续传时沿用上次结果的笔记数
         self.success_count = 0
         self.known_folders = set() # Track folders to avoid loops
 
@@ -68,12 +1935,13 @@ class WizMigrator:
         self.total_attachments_found = 0      # 发现的附件总数
         self.total_attachments_downloaded = 0  # 成功下载的附件数
 
-        # 失败记录（用于生成报告）
-        self.failed_notes = []
-        self.failed_images = []
-        self.failed_attachments = []
-        self.collaborative_notes = []  # 协作笔记（需要特殊处理）
-        self.encrypted_notes = []  # 加密笔记（需要用户解密）
+        # 处理结果写入下载目录的 JSONL 日志（用于生成报告），内存中只保留计数
+        self.results_journal = ResultJournal(Path(output_base) / RESULTS_JOURNAL_NAME)
+        self.failed_notes = self.results_journal.view("error")
+        self.failed_images = self.results_journal.view("failed_image")
+        self.failed_attachments = self.results_journal.view("failed_attachment")
+        self.collaborative_notes = self.results_journal.view("collaborative")  # 协作笔记（需要特殊处理）
+        self.encrypted_notes = self.results_journal.view("encrypted")  # 加密笔记（需要用户解密）
 
         self.lock = threading.Lock()  # 线程锁，保护计数器
 
@@ -82,6 +1950,76 @@ class WizMigrator:
         self.max_retries = max_retries
         self.timeout = timeout
         self.connect_timeout = connect_timeout
+        self.output_base = output_base
+        self.resume = resume
+        self.incremental = incremental
+        self.engine = engine
+        self.concurrency = concurrency
+        self.per_host_limit = per_host_limit
+        self.list_workers = max(1, list_workers)
+        # 流水线各阶段线程数：网络阶段沿用 --workers，转换和写入单独配置
+        self.pipeline_workers = {
+            "fetch": max_workers,
+            "assets": max_workers,
+            "convert": convert_workers or max(1, convert_processes),
+            "write": write_workers,
+        }
+
+        # 连接池与全局并发预算（线程引擎）；批量导出时并发名额、限速器和带宽由 budget 统一提供
+        self.budget = budget
+        if budget is not None:
+            self.scheduler = RequestScheduler(self.session, concurrency=budget.concurrency,
+                                              pool_size=pool_size, semaphore=budget.semaphore)
+        else:
+            self.scheduler = RequestScheduler(self.session, concurrency=concurrency, pool_size=pool_size)
+        # 按接口统计请求耗时/字节数/状态码，运行结束后写入 download_metrics.json
+        self.metrics = RequestMetrics()
+        self.metrics_prometheus = metrics_prometheus
+        # 自适应限速：按服务器反馈（状态码、Retry-After、延迟）调整请求速率
+        if budget is not None:
+            self.rate_limiter = budget.rate_limiter
+            self.bandwidth = budget.bandwidth
+        else:
+            self.rate_limiter = AdaptiveRateLimiter(rate=rate, max_rate=max_rate)
+            self.bandwidth = BandwidthLimiter(max_bandwidth * 1024 * 1024)
+        # HTML 转 Markdown 进程池（首次转换大文档时才启动）
+        self.converter = MarkdownConverter(processes=convert_processes, timeout=convert_timeout)
+        self.requests_saved = 0  # 因复用笔记元数据、跳过 ZIP 探测而省下的请求数
+
+        # 按内容寻址的资源存储：相同图片/附件只下载、只存储一次
+        self.use_asset_store = asset_store
+        self.hardlink_assets = hardlink_assets  # 各笔记的相同资源共用一个 inode（默认 reflink/复制）
+        self.asset_store = None
+
+        # 协作笔记 WebSocket 连接池（首次遇到协作笔记时才建立连接）
+        self.collab_connections = collab_connections
+        self.collab_client = None
+
+        # 原始内容归档：转换前的正文和资源文件（archive 为 True 时放在下载目录内），供 --replay 使用
+        self.archive = None
+        if archive:
+            self.archive = NoteArchive(Path(output_base) / ARCHIVE_DIR_NAME if archive is True else archive,
+                                       source=output_base)
+        self.replaying = False  # replay 期间重写所有笔记
+
+        # 只读接口的磁盘响应缓存（http_cache 为 True 时放在下载目录内）
+        self.response_cache = None
+        if http_cache:
+            cache_path = Path(output_base) / HTTP_CACHE_NAME if http_cache is True else http_cache
+            self.response_cache = ResponseCache(cache_path, ttl=http_cache_ttl,
+                                                max_bytes=http_cache_size * 1024 * 1024)
+
+        # 增量同步：服务器上已修改、需要覆盖本地文件的笔记
+        self.refresh_guids = set()
+        self.deleted_notes = []  # 服务器上已删除的笔记（仅报告，不删除本地文件）
+        self.listing_errors = 0  # 扫描未完成的分类数（有错误时不判定删除）
+        self.listing_lock = threading.Lock()  # 并发扫描分类时保护 known_folders / listing_errors
+
+        # 边扫描边下载：扫描线程把新发现的笔记直接提交到下载线程池（仅在 run 期间存在）
+        self._stream = None
+
+        # 断点续传状态库（首次需要时才创建）
+        self.state = None
 
         # Add headers to mimic browser
         self.session.headers.update({
@@ -115,57 +2053,192 @@ class WizMigrator:
         print(f"Logging in as {self.user_id}...")
         try:
             login_url = f"{AS_URL}/as/user/login"
-            payload = {
-                "user_id": self.user_id,
-                "password": self.password,
-                "client_type": "web",
-                "client_version": "4.0.0"
-            }
-
-            response = self.session.post(login_url, data=payload)
-            data = response.json()
-
-            if data.get('return_code') != 200 and data.get('returnCode') != 200:
-                error_msg = data.get('return_message') or data.get('returnMessage') or "登录失败"
-                print(f"Login failed: {error_msg}")
-                return False, error_msg
-
-            result = data.get('result', data)
-            self.token = result.get('token')
-            self.kb_guid = result.get('kb_guid') or result.get('kbGuid')
-            raw_kapi_url = result.get('kapi_url') or result.get('kbServer') or 'https://ks.wiz.cn'
-            self.kapi_url = self._normalize_kapi_url(raw_kapi_url)
-            self.user_guid = result.get('user_guid') or result.get('userGuid')  # 保存 user_guid
-
-            if not self.token or not self.kb_guid:
-                error_msg = (
-                    "登录失败：服务器未返回必要信息；如果账号启用了二次登录验证，"
-                    "请先在 WizNote X 或网页版关闭后重试"
-                )
-                print(f"Login failed: {error_msg}")
-                return False, error_msg
-
-            if not self.kapi_url:
-                error_msg = (
-                    "登录失败：服务器未返回有效的知识库 API 地址；如果账号启用了二次登录验证，"
-                    "请先在 WizNote X 或网页版关闭后重试"
-                )
-                print(f"Login failed: {error_msg}")
-                return False, error_msg
-
-            print(f"Login successful!")
-            print(f"KB GUID: {self.kb_guid}")
-
-            self.session.headers.update({
-                "X-Wiz-Token": self.token
-            })
-            return True, None
+            response = self._http("post", login_url, data=self._login_payload())
+            return self._apply_login_data(response.json())
 
         except Exception as e:
             error_msg = f"登录出错: {str(e)}"
             print(f"Error during login: {str(e)}")
             return False, error_msg
 
+    def _send(self, method, url, **kwargs):
+        """
+        发送一个请求，并把状态码、Retry-After 和耗时反馈给限速器
+
+        非流式请求在这里记入请求统计；流式请求由 _stream_get 在读完响应体后记录。
+        """
+        endpoint = self.metrics.endpoint(url, kwargs.get("params"))
+        started = time.monotonic()
+        try:
+            response = getattr(self.session, method)(url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.rate_limiter.on_error()
+            self.metrics.record(endpoint, None, time.monotonic() - started, error=type(e).__name__)
+            raise
+        latency = time.monotonic() - started
+        self.rate_limiter.on_response(response.status_code, latency, response.headers.get("Retry-After"))
+        if not kwargs.get("stream"):
+            self.metrics.record(endpoint, response.status_code, latency, RequestMetrics.response_size(response))
+        return response
+
+    def _http(self, method, url, **kwargs):
+        """
+        通过调度器发送非流式请求（响应体已完整读取后释放名额）
+
+        被限流（429/503）时按限速器给出的等待时间重试，最多 max_retries 次。
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()  # 先排队再占名额，等待期间不占用连接
+            with self.scheduler.slot():
+                response = self._send(method, url, **kwargs)
+            if (response.status_code not in AdaptiveRateLimiter.THROTTLE_STATUSES
+                    or attempt >= self.max_retries - 1):
+                return response
+            self.metrics.record_retry(self.metrics.endpoint(url, kwargs.get("params")))
+            time.sleep(self.rate_limiter.retry_delay(attempt))
+            attempt += 1
+
+    def _cached_get(self, url, params=None, version=None, **kwargs):
+        """
+        GET 只读接口，启用 --http-cache 时先查响应缓存
+
+        version 为笔记版本（见 _cache_version），给出时缓存按版本校验；否则按 TTL 过期。
+        """
+        cache = self.response_cache
+        if cache is None:
+            return self._http("get", url, params=params, **kwargs)
+        key = ResponseCache.key(url, params)
+        body = cache.get(key, version)
+        if body is not None:
+            return CachedResponse(url, body)
+        response = self._http("get", url, params=params, **kwargs)
+        if ResponseCache.cacheable(response.status_code, response.content):
+            cache.put(key, response.content, version)
+        return response
+
+    @staticmethod
+    def _cache_version(note):
+        """笔记版本（列表元数据中的 version/modified），作为正文/资源/附件缓存的校验值"""
+        version, modified = DownloadState.note_version(note)
+        if version is None and modified is None:
+            return None
+        return f"{version}|{modified}"
+
+    @contextmanager
+    def _stream_get(self, url, **kwargs):
+        """通过调度器发送流式请求，名额一直占用到响应体读取完毕"""
+        self.rate_limiter.acquire()
+        with self.scheduler.slot():
+            started = time.monotonic()
+            response = self._send("get", url, stream=True, **kwargs)
+            error = None
+            try:
+                yield response
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                response.close()
+                self.metrics.record(self.metrics.endpoint(url), response.status_code,
+                                    time.monotonic() - started, RequestMetrics.response_size(response), error)
+
+    def _login_payload(self):
+        return {
+            "user_id": self.user_id,
+            "password": self.password,
+            "client_type": "web",
+            "client_version": "4.0.0"
+        }
+
+    def _apply_login_data(self, data):
+        """解析登录响应并保存 token/kb_guid/API 地址，返回 (success, error_message)"""
+        if data.get('return_code') != 200 and data.get('returnCode') != 200:
+            error_msg = data.get('return_message') or data.get('returnMessage') or "登录失败"
+            print(f"Login failed: {error_msg}")
+            return False, error_msg
+
+        result = data.get('result', data)
+        self.token = result.get('token')
+        self.kb_guid = result.get('kb_guid') or result.get('kbGuid')
+        raw_kapi_url = result.get('kapi_url') or result.get('kbServer') or 'https://ks.wiz.cn'
+        self.kapi_url = self._normalize_kapi_url(raw_kapi_url)
+        self.user_guid = result.get('user_guid') or result.get('userGuid')  # 保存 user_guid
+        if self.kb_guid_override:
+            self.kb_guid = self.kb_guid_override
+        if self.kb_server_override:
+            self.kapi_url = self._normalize_kapi_url(self.kb_server_override)
+
+        if not self.token or not self.kb_guid:
+            error_msg = (
+                "登录失败：服务器未返回必要信息；如果账号启用了二次登录验证，"
+                "请先在 WizNote X 或网页版关闭后重试"
+            )
+            print(f"Login failed: {error_msg}")
+            return False, error_msg
+
+        if not self.kapi_url:
+            error_msg = (
+                "登录失败：服务器未返回有效的知识库 API 地址；如果账号启用了二次登录验证，"
+                "请先在 WizNote X 或网页版关闭后重试"
+            )
+            print(f"Login failed: {error_msg}")
+            return False, error_msg
+
+        print(f"Login successful!")
+        print(f"KB GUID: {self.kb_guid}")
+
+        self.session.headers.update({
+            "X-Wiz-Token": self.token
+        })
+        return True, None
+
+    def _get_state(self):
+        """获取（必要时创建）下载目录中的状态库"""
+        if self.state is None:
+            self.state = DownloadState(Path(self.output_base) / STATE_DB_NAME)
+        return self.state
+
+    def _get_asset_store(self):
+        """资源存储（--no-asset-store 时为 None），首次需要时创建"""
+        if not self.use_asset_store:
+            return None
+        with self.lock:
+            if self.asset_store is None:
+                self.asset_store = AssetStore(Path(self.output_base) / ASSET_STORE_DIR,
+                                              hardlink=self.hardlink_assets)
+            return self.asset_store
+
+    def _needs_refresh(self, note_guid):
+        """本地文件需要重写：上次处理中断（输出可能不完整），或增量同步发现笔记已修改"""
+        if self.replaying or note_guid in self.refresh_guids:
+            return True
+        return self.state is not None and self.state.get_status(note_guid) in ("in_progress", "error")
+
+    def _should_download_asset(self, note_guid, kind, name, path):
+        """资源文件不存在，或状态库显示上次下载中断时需要（重新）下载"""
+        if not path.exists():
+            return True
+        return self.state is not None and self.state.is_asset_incomplete(note_guid, kind, name)
+
+    def _download_asset(self, note_guid, kind, name, url, output_path):
+        """下载图片/附件并在状态库中记录完成情况"""
+        if self.state is not None:
+            self.state.mark_asset(note_guid, kind, name, "pending")
+        ok = self.download_file(url, output_path, name=name)
+        if ok and self.state is not None:
+            self.state.mark_asset(note_guid, kind, name, "done")
+        return ok
+
+    @staticmethod
+    def _write_text_atomic(path, text):
+        """先写临时文件再重命名，中断时不会留下半截笔记"""
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".part")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
     def sanitize_filename(self, name):
         """Make filename safe for filesystem"""
         safe = re.sub(r'[\\/*?:"<>|]', "_", name)
@@ -212,73 +2285,71 @@ class WizMigrator:
 
         return "".join(lines[idx:]).lstrip("\n")
 
-    def get_note_resources(self, doc_guid):
+    def get_note_resources(self, doc_guid, version=None):
         """
         获取笔记的资源列表（图片等）
         返回: {资源名: 下载URL}
         """
         try:
             url = f"{self.kapi_url}/ks/note/download/{self.kb_guid}/{doc_guid}"
-            params = {
-                "downloadInfo": "0",
-                "downloadData": "1"
-            }
+            params = RESOURCE_LIST_PARAMS
 
-            response = self.session.get(url, params=params)
-            data = response.json()
+            response = self._cached_get(url, params=params, version=version)
+            return self._parse_resources(response.json())
 
-            if data.get('returnCode') != 200 and data.get('return_code') != 200:
-                return {}
+        except Exception as e:
+            return {}
 
-            result = data.get('result', data)
-            resources = result.get('resources', [])
+    @staticmethod
+    def _parse_resources(data):
+        """从 /ks/note/download 的 JSON 响应中构建资源映射 {name: url}"""
+        if data.get('returnCode') != 200 and data.get('return_code') != 200:
+            return {}
 
-            # 构建资源映射 {name: url}
-            resources_map = {}
-            for res in resources:
-                if 'name' in res and 'url' in res:
-                    resources_map[res['name']] = res['url']
+        result = data.get('result', data)
+        resources = result.get('resources', [])
 
-            return resources_map
+        resources_map = {}
+        for res in resources:
+            if 'name' in res and 'url' in res:
+                resources_map[res['name']] = res['url']
 
-        except Exception as e:
-            return {}
+        return resources_map
 
-    def get_note_attachments(self, doc_guid):
+    def get_note_attachments(self, doc_guid, version=None):
         """
         获取笔记的附件列表
         返回: 附件信息列表
         """
         try:
             url = f"{self.kapi_url}/ks/note/attachments/{self.kb_guid}/{doc_guid}"
-            params = {
-                'extra': '1',
-                'clientType': 'web',
-                'clientVersion': '4.0',
-                'lang': 'zh-cn'
-            }
+            params = ATTACHMENT_LIST_PARAMS
 
-            response = self.session.get(url, params=params, timeout=(self.connect_timeout, self.timeout))
+            response = self._cached_get(url, params=params, version=version,
+                                        timeout=(self.connect_timeout, self.timeout))
 
             # 调试信息
             if response.status_code != 200:
                 print(f"    ⚠️  附件 API 返回 HTTP {response.status_code}")
                 return []
 
-            data = response.json()
-            code = data.get('returnCode', data.get('return_code'))
-
-            if code != 200:
-                print(f"    ⚠️  附件 API 返回错误码: {code}")
-                return []
-
-            attachments = data.get('result', [])
-            return attachments
+            return self._parse_attachments(response.json())
 
         except Exception as e:
             print(f"    ❌ 获取附件失败: {str(e)}")
             return []
 
+    @staticmethod
+    def _parse_attachments(data):
+        """从 /ks/note/attachments 的 JSON 响应中取出附件列表"""
+        code = data.get('returnCode', data.get('return_code'))
+
+        if code != 200:
+            print(f"    ⚠️  附件 API 返回错误码: {code}")
+            return []
+
+        return data.get('result', [])
+
     def get_collaboration_token(self, doc_guid):
         """
         获取协作笔记的 editor token
@@ -289,7 +2360,7 @@ class WizMigrator:
 
         try:
             url = f"{self.kapi_url}/ks/note/{self.kb_guid}/{doc_guid}/tokens"
-            response = self.session.post(url, timeout=(self.connect_timeout, self.timeout))
+            response = self._http("post", url, timeout=(self.connect_timeout, self.timeout))
 
             if response.status_code == 200:
                 data = response.json()
@@ -321,88 +2392,10 @@ class WizMigrator:
             print("    ❌ 无法获取协作笔记 token")
             return None, None
 
-        ws = None
         try:
-            # 构建 WebSocket URL
-            from urllib.parse import urlparse
-            parsed = urlparse(self.kapi_url)
-            ws_domain = parsed.netloc
-            ws_url = f"wss://{ws_domain}/editor/{self.kb_guid}/{doc_guid}"
-
-            print(f"    🔗 连接 WebSocket: {ws_url}")
-
-            # 创建 WebSocket 连接
-            ssl_context = ssl.create_default_context()
-            ssl_context.load_verify_locations(certifi.where())
-
-            ws = create_connection(
-                ws_url,
-                sslopt={"cert_reqs": ssl.CERT_REQUIRED, "ssl_version": ssl.PROTOCOL_TLS_CLIENT, "check_hostname": True},
-                header={"Cookie": f"x-live-editor-token={editor_token}"},
-                timeout=30
-            )
-
-            # ShareJS 协议握手请求
-            hs_request = {
-                "a": "hs",
-                "id": None,
-                "auth": {
-                    "appId": self.kb_guid,
-                    "docId": doc_guid,
-                    "userId": self.user_guid,
-                    "permission": "w",
-                    "token": editor_token
-                }
-            }
-
-            # 获取内容请求
-            f_request = {
-                "a": "f",
-                "c": self.kb_guid,
-                "d": doc_guid,
-                "v": None
-            }
-
-            # 执行 3 次握手（参考实现不验证响应内容，只接收即可）
-            hs_msg = json.dumps(hs_request)
-            for i in range(3):
-                ws.send(hs_msg)
-                try:
-                    result = ws.recv()
-                    # 只验证是否为有效 JSON，不验证具体内容
-                    try:
-                        response_data = json.loads(result)
-                        # ShareJS 可能返回 {"a":"init"} 或 {"a":"hs"} 等多种格式
-                        # 参考实现中不验证这些，继续发送后续请求即可
-                    except json.JSONDecodeError:
-                        print(f"    ⚠️  握手 {i+1} 响应不是有效 JSON")
-                        return None, None
-                except Exception as recv_error:
-                    print(f"    ⚠️  握手 {i+1} 接收超时: {str(recv_error)}")
-                    return None, None
-
-            # 发送获取请求
-            fetch_msg = json.dumps(f_request)
-            ws.send(fetch_msg)
-
-            # 接收确认响应（第一次）
-            try:
-                ack_response = ws.recv()
-                print(f"    ✅ 收到确认响应: {ack_response[:100]}")
-            except Exception as recv_error:
-                print(f"    ⚠️  获取确认响应超时: {str(recv_error)}")
-                return None, None
-
-            # 接收实际内容（第二次）
-            try:
-                content_response = ws.recv()
-            except Exception as recv_error:
-                print(f"    ⚠️  获取内容超时: {str(recv_error)}")
-                return None, None
-
-            # 验证响应不为空
-            if not content_response or content_response.strip() == '':
-                print("    ⚠️  服务器返回空响应")
+            content_response = self._get_collab_client().fetch(doc_guid, editor_token)
+            if not content_response:
+                print("    ⚠️  获取协作笔记内容超时或失败")
                 return None, None
 
             # 调试输出：显示原始响应
@@ -426,12 +2419,13 @@ class WizMigrator:
             # 提取图片资源列表
             image_resources = {}
             try:
+                parsed = urlparse(self.kapi_url)
                 data = json.loads(content_response)
                 resources = data.get('data', {}).get('data', {}).get('resources', {})
                 for res_name, res_info in resources.items():
                     if res_info.get('type', '').startswith('image/'):
                         image_resources[res_name] = {
-                            'url': f"https://{ws_domain}/editor/{self.kb_guid}/{doc_guid}/resources/{res_name}",
+                            'url': f"{parsed.scheme}://{parsed.netloc}/editor/{self.kb_guid}/{doc_guid}/resources/{res_name}",
                             'token': editor_token
                         }
             except:
@@ -442,13 +2436,13 @@ class WizMigrator:
         except Exception as e:
             print(f"    ❌ WebSocket 获取失败: {str(e)}")
             return None, None
-        finally:
-            # 确保关闭连接
-            if ws:
-                try:
-                    ws.close()
-                except:
-                    pass
+
+    def _get_collab_client(self):
+        """懒加载协作笔记连接池（多线程共享）"""
+        with self.lock:
+            if self.collab_client is None:
+                self.collab_client = CollaborationClient(self, max_connections=self.collab_connections)
+            return self.collab_client
 
     def download_collaboration_image(self, image_url, editor_token, output_path):
         """
@@ -460,58 +2454,66 @@ class WizMigrator:
                 "Cookie": f"x-live-editor-token={editor_token}"
             }
 
-            response = self.session.get(
+            with self._stream_get(
                 image_url,
                 headers=headers,
-                timeout=(self.connect_timeout, self.timeout),
-                stream=True
-            )
-
-            if response.status_code == 200:
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                with open(output_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                return True
+                timeout=(self.connect_timeout, self.timeout)
+            ) as response:
+                if response.status_code == 200:
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    with open(output_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=8192):
+                            if chunk:
+                                f.write(chunk)
+                                self.bandwidth.acquire(len(chunk))
+                    return True
         except Exception as e:
             print(f"    ❌ 协作图片下载失败: {str(e)}")
 
         return False
 
-    def download_file(self, url, output_path, description="文件"):
+    def download_file(self, url, output_path, description="文件", name=None):
         """
-        下载文件到本地（支持重试和超时）
+        下载文件到本地（支持重试、超时和断点续传）
+
+        数据先写入 .part，校验 Content-Length 后再重命名；重试和下次运行时按 Range 续传。
+        给出资源名 name 时经过资源存储：边下载边计算摘要，完成后写入 blob（内容已有时只保留
+        一份）再链接到 output_path。
         """
+        store = self._get_asset_store() if name else None
+        download = PartialDownload(output_path, store=store, name=name, state=self.state)
         for attempt in range(self.max_retries):
             try:
                 # 分离连接超时和读取超时
-                response = self.session.get(
-                    url,
-                    timeout=(self.connect_timeout, self.timeout),
-                    stream=True
-                )
-                response.raise_for_status()
-
-                # 创建目录
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-                # 下载文件
-                with open(output_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
+                with self._stream_get(url, headers=download.request_headers(),
+                                      timeout=(self.connect_timeout, self.timeout)) as response:
+                    if response.status_code != 416:
+                        response.raise_for_status()
+
+                    # 创建目录
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+                    if not download.begin(response.status_code, response.headers):
+                        raise IncompleteDownloadError("续传范围无效，重新下载")
+
+                    # 下载文件
+                    try:
+                        for chunk in response.iter_content(chunk_size=65536):
+                            if chunk:
+                                download.write(chunk)
+                                self.bandwidth.acquire(len(chunk))
+                        download.finish()
+                    except BaseException:
+                        download.abort()
+                        raise
 
                 return True
 
-            except requests.exceptions.Timeout:
-                if attempt < self.max_retries - 1:
-                    time.sleep(1)  # 短暂等待后重试
-                else:
-                    return False
-            except Exception as e:
+            except Exception:
                 if attempt < self.max_retries - 1:
-                    time.sleep(2 ** attempt)  # 指数退避
+                    # 限速器已按错误降速；等待 Retry-After 剩余时间或指数退避
+                    self.metrics.record_retry(self.metrics.endpoint(url))
+                    time.sleep(self.rate_limiter.retry_delay(attempt))
                 else:
                     return False
 
@@ -519,363 +2521,603 @@ class WizMigrator:
 
     def process_note(self, note, output_base):
         """Download and convert a single note"""
-        return self._process_note_internal(note, output_base)
+        result = self._process_note_internal(note, output_base)
+        self._record_note_state(note, result)
+        return result
 
-    def _process_note_internal(self, note, output_base):
-        """内部方法：实际处理笔记"""
+    def _record_note_state(self, note, result):
+        """将处理结果写入状态库（skip 说明本地已有完整文件，同样视为完成），并在结果中记下笔记 guid"""
+        if not result:
+            return
+        note_guid = DownloadState.note_guid(note)
+        result.setdefault("note_guid", note_guid)
+        if self.state is None:
+            return
+        status = result["status"]
+        if status in ("success", "skip"):
+            self.state.mark_note(note_guid, "done", md_path=result.get("md_path"))
+        else:
+            self.state.mark_note(note_guid, status)
+
+    IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg'}
+
+    COLLABORATIVE_INDICATORS = [
+        "当前客户端版本较低，无法编辑协作笔记",
+        "The current client version is too low to edit collaborative notes",
+        "协作笔记",
+        "collaborative notes",
+        "请升级客户端",
+        "upgrade the client"
+    ]
+
+    @staticmethod
+    def is_encrypted_note(note):
+        """列表元数据是否标记为加密笔记"""
+        is_encrypted = note.get('encrypted', note.get('isEncrypted', False))
+        if isinstance(is_encrypted, str):
+            return is_encrypted.lower() in ['true', '1', 'yes']
+        if isinstance(is_encrypted, int):
+            return is_encrypted == 1
+        return bool(is_encrypted)
+
+    @staticmethod
+    def _encrypted_result(note):
+        return {
+            "status": "encrypted",
+            "title": note.get('title') or note.get('documentTitle') or note.get('docTitle') or "Untitled",
+            "note_guid": DownloadState.note_guid(note),
+            "path": note.get('category', note.get('documentCategory', '/')).strip('/'),
+            "message": "加密笔记需要先在 WizNote 客户端中解密"
+        }
+
+    @staticmethod
+    def note_weight(note):
+        """
+        按列表元数据估算笔记的下载工作量（约等于字节数），用于调度
+
+        优先使用数据大小字段；没有时按附件数估算。Lite 笔记没有 ZIP 包和资源列表，
+        协作笔记需要 WebSocket 获取并逐张下载图片。
+        """
+        def number(*keys):
+            for key in keys:
+                try:
+                    value = int(note.get(key) or 0)
+                except (TypeError, ValueError):
+                    continue
+                if value:
+                    return value
+            return 0
+
+        size = number('dataSize', 'size', 'docSize')
+        attachments = number('attachmentCount', 'attachment_count', 'attachments')
+        weight = size or attachments * ATTACHMENT_WEIGHT
+        note_type = (note.get('type') or note.get('documentType') or '').lower()
+        if 'collaborat' in note_type:
+            weight += COLLAB_WEIGHT
+        return weight
+
+    def _schedule_notes(self, notes):
+        """
+        把笔记分为加密笔记和待下载笔记
+
+        加密笔记无需下载，直接返回结果，不进入线程池/流水线；待下载笔记按工作量从大到小排序（稳定排序）。
+        返回: (ordered_notes, encrypted_results)，ordered_notes 为 [(weight, note)]
+        """
+        encrypted, weighted = [], []
+        for note in notes:
+            if self.is_encrypted_note(note):
+                encrypted.append((note, self._encrypted_result(note)))
+            else:
+                weighted.append((self.note_weight(note), note))
+        weighted.sort(key=lambda item: -item[0])
+        return weighted, encrypted
+
+    def _prepare_note(self, note, output_base):
+        """
+        解析笔记元数据并确定输出路径
+
+        返回: (ctx, None) 需要继续处理；(None, result) 无需下载（无 GUID / 加密 / 已存在）
+        """
         # Handle different field naming conventions (snake_case vs camelCase)
         note_guid = note.get('guid') or note.get('documentGuid') or note.get('docGuid')
         note_title = note.get('title') or note.get('documentTitle') or note.get('docTitle')
         note_type = note.get('type', note.get('documentType', 'document'))
 
         if not note_guid:
-            return None
+            return None, None
 
         if not note_title:
             note_title = "Untitled"
 
-        # 检测是否为加密笔记
-        is_encrypted = note.get('encrypted', note.get('isEncrypted', False))
-        if isinstance(is_encrypted, str):
-            is_encrypted = is_encrypted.lower() in ['true', '1', 'yes']
-        elif isinstance(is_encrypted, int):
-            is_encrypted = is_encrypted == 1
-
-        if is_encrypted:
-            category = note.get('category', note.get('documentCategory', '/'))
-            rel_path = category.strip('/')
-            output_dir = Path(output_base) / rel_path
-
-            return {
-                "status": "encrypted",
-                "title": note_title,
-                "note_guid": note_guid,
-                "path": rel_path,
-                "message": "加密笔记需要先在 WizNote 客户端中解密"
-            }
-
-        # 检测是否为 Lite/Markdown 笔记
-        is_lite_note = note_type in ['lite', 'markdown'] or (note_type and 'lite' in note_type.lower())
-
         category = note.get('category', note.get('documentCategory', '/'))
         rel_path = category.strip('/')
 
+        if self.is_encrypted_note(note):
+            return None, self._encrypted_result(note)
+
+        # 检测是否为 Lite/Markdown 笔记、协作笔记（列表元数据中的类型）
+        is_lite_note = note_type in ['lite', 'markdown'] or (note_type and 'lite' in note_type.lower())
+        is_collaborative_type = bool(note_type) and 'collaborat' in note_type.lower()
+
         output_dir = Path(output_base) / rel_path
         output_dir.mkdir(parents=True, exist_ok=True)
 
         safe_title = self.sanitize_filename(note_title)
         md_file_path = output_dir / f"{safe_title}.md"
 
-        if md_file_path.exists():
-            return {"status": "skip", "title": safe_title}
+        if md_file_path.exists() and not self._needs_refresh(note_guid):
+            return None, {"status": "skip", "title": safe_title,
+                          "md_path": str(md_file_path.relative_to(output_base))}
+
+        if self.state is not None:
+            self.state.mark_note(note_guid, "in_progress")
+
+        assets_folder_name = f"{safe_title}_files"
+        ctx = {
+            "guid": note_guid,
+            "title": note_title,
+            "safe_title": safe_title,
+            "is_lite": is_lite_note,
+            "is_collaborative_type": is_collaborative_type,
+            "version": self._cache_version(note),  # 响应缓存按此校验正文/资源/附件列表
+            "listings": {},  # 本笔记任务内已获取的资源/附件列表（避免重复请求）
+            "output_base": output_base,
+            "output_dir": output_dir,
+            "rel_dir": str(output_dir.relative_to(output_base)),
+            "md_file_path": md_file_path,
+            "assets_folder_name": assets_folder_name,
+            "assets_path": output_dir / assets_folder_name,
+            # 图片/附件统计和失败记录
+            "images_found": 0,
+            "images_downloaded": 0,
+            "attachments_found": 0,
+            "attachments_downloaded": 0,
+            "failed_images": [],
+            "failed_attachments": [],
+        }
+        return ctx, None
+
+    def _spool_zip_package(self, url):
+        """
+        流式下载 ZIP 笔记包到 SpooledTemporaryFile（小包留在内存，大包自动落盘）
 
-        try:
-            html_content = None
-            images_found = 0
-            images_downloaded = 0
-            attachments_found = 0
-            attachments_downloaded = 0
-            assets_folder_name = f"{safe_title}_files"
-            final_assets_path = output_dir / assets_folder_name
-            failed_images_list = []  # 记录失败的图片
-            failed_attachments_list = []  # 记录失败的附件
-
-            # 方法 1: 尝试下载 ZIP（某些笔记支持）
-            download_url = f"{self.kapi_url}/ks/note/download/{self.kb_guid}/{note_guid}"
-            response = self.session.get(download_url, timeout=(self.connect_timeout, self.timeout))
+        根据第一个数据块的魔数（PK）判断是否为 ZIP，不是则立即放弃；返回临时文件或 None。
+        """
+        with self._stream_get(url, timeout=(self.connect_timeout, self.timeout)) as response:
+            if response.status_code != 200:
+                return None
+            spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_MEMORY)
+            try:
+                first = True
+                for chunk in response.iter_content(chunk_size=ZIP_CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    if first and not chunk.startswith(b'PK'):
+                        spool.close()
+                        return None
+                    first = False
+                    spool.write(chunk)
+                    self.bandwidth.acquire(len(chunk))
+            except Exception:
+                spool.close()
+                raise
+        if first:
+            spool.close()
+            return None
+        spool.seek(0)
+        return spool
 
-            if response.status_code == 200 and response.content.startswith(b'PK'):
-                # ZIP 下载成功
-                temp_extract_dir = output_dir / f"_temp_{note_guid}"
-                temp_extract_dir.mkdir(exist_ok=True)
+    def _extract_zip_package(self, ctx, zip_file):
+        """
+        解压 ZIP 笔记包，返回 HTML 内容（无 index.html 时返回 None）
 
-                try:
-                    with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-                        z.extractall(temp_extract_dir)
-
-                    index_html = temp_extract_dir / "index.html"
-                    if index_html.exists():
-                        with open(index_html, 'r', encoding='utf-8', errors='ignore') as f:
-                            html_content = f.read()
-
-                        resource_dir = temp_extract_dir / "index_files"
-
-                        if resource_dir.exists():
-                            if final_assets_path.exists():
-                                shutil.rmtree(final_assets_path)
-                            shutil.move(str(resource_dir), str(final_assets_path))
-
-                            # 统计图片和附件（区分文件类型）
-                            image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg'}
-                            # 递归查找所有文件（包括子目录）
-                            all_files = [f for f in final_assets_path.rglob('*') if f.is_file()]
-
-                            for file_path in all_files:
-                                ext = file_path.suffix.lower()
-                                if ext in image_extensions:
-                                    images_found += 1
-                                    images_downloaded += 1
-                                else:
-                                    # 其他文件算作附件
-                                    attachments_found += 1
-                                    attachments_downloaded += 1
-
-                            # 替换路径
-                            html_content = html_content.replace("index_files/", f"{assets_folder_name}/")
-
-                finally:
-                    if temp_extract_dir.exists():
-                        shutil.rmtree(temp_extract_dir)
-
-            # 方法 2: 如果 ZIP 失败，使用资源下载 API
-            if not html_content:
-                # 获取 HTML 内容
-                view_url = f"{self.kapi_url}/ks/note/view/{self.kb_guid}/{note_guid}"
-                resp = self.session.get(view_url, timeout=(self.connect_timeout, self.timeout))
+        index.html 直接读入内存；index_files/ 下的成员逐个流式解压到 <title>_files，
+        不再先解压到临时目录再移动。
+        """
+        final_assets_path = ctx["assets_path"]
+        prefix = "index_files/"
+
+        with zipfile.ZipFile(zip_file) as z:
+            if "index.html" not in z.namelist():
+                return None
+            with z.open("index.html") as f:
+                html_content = f.read().decode('utf-8', errors='ignore')
+
+            members = [info for info in z.infolist()
+                       if info.filename.startswith(prefix) and not info.is_dir()
+                       and info.filename != prefix]
+            if not members:
+                return html_content
+
+            if final_assets_path.exists():
+                shutil.rmtree(final_assets_path)
+            root = final_assets_path.resolve()
+
+            for info in members:
+                target = final_assets_path / info.filename[len(prefix):]
+                # 防止 ../ 等路径穿越到资源目录之外
+                if root not in target.resolve().parents:
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                store = self._get_asset_store()
+                if store is None:
+                    with z.open(info) as src, open(target, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, ZIP_CHUNK_SIZE)
+                else:
+                    with z.open(info) as src, store.writer() as writer:
+                        for chunk in iter(lambda: src.read(ZIP_CHUNK_SIZE), b""):
+                            writer.write(chunk)
+                        writer.commit(target)
+
+                # 统计图片和附件（区分文件类型）
+                if target.suffix.lower() in self.IMAGE_EXTENSIONS:
+                    ctx["images_found"] += 1
+                    ctx["images_downloaded"] += 1
+                else:
+                    # 其他文件算作附件
+                    ctx["attachments_found"] += 1
+                    ctx["attachments_downloaded"] += 1
 
-                # 尝试 JSON 解析
-                try:
-                    data = resp.json()
-                    result = data.get('result', data)
+        # 替换路径
+        return html_content.replace("index_files/", f"{ctx['assets_folder_name']}/")
 
-                    # 对于 Lite 笔记，内容可能直接是 Markdown
-                    if is_lite_note:
-                        html_content = result.get('body') or result.get('html') or result.get('text') or result.get('markdown')
-                    else:
-                        html_content = result.get('body') or result.get('html')
-                except:
-                    # 如果不是 JSON，检查是否是 RAW HTML
-                    if resp.status_code == 200 and '<html' in resp.text.lower()[:200]:
-                        html_content = resp.text
+    @staticmethod
+    def _parse_view_body(is_lite_note, status_code, text):
+        """解析 /ks/note/view 响应，返回笔记正文（HTML 或 Lite 笔记的 Markdown）"""
+        html_content = None
+        try:
+            data = json.loads(text)
+            result = data.get('result', data)
 
-                if html_content:
-                    # 资源文件夹（图片和附件都放在这里）
-                    assets_folder_name = f"{safe_title}_files"
-                    final_assets_path = output_dir / assets_folder_name
+            # 对于 Lite 笔记，内容可能直接是 Markdown
+            if is_lite_note:
+                html_content = result.get('body') or result.get('html') or result.get('text') or result.get('markdown')
+            else:
+                html_content = result.get('body') or result.get('html')
+        except Exception:
+            # 如果不是 JSON，检查是否是 RAW HTML
+            if status_code == 200 and '<html' in text.lower()[:200]:
+                html_content = text
+        return html_content
+
+    def _plan_image_downloads(self, ctx, resources):
+        """筛选需要下载的图片，返回 [(name, url, path)]；已存在的图片直接计入成功"""
+        ctx["assets_path"].mkdir(exist_ok=True)
+
+        # 过滤图片文件
+        image_resources = {
+            name: url for name, url in resources.items()
+            if any(name.lower().endswith(ext) for ext in self.IMAGE_EXTENSIONS)
+        }
+        ctx["images_found"] = len(image_resources)
+
+        pending = []
+        for img_name, img_url in image_resources.items():
+            img_path = ctx["assets_path"] / img_name
+            if self._should_download_asset(ctx["guid"], "image", img_name, img_path):
+                pending.append((img_name, img_url, img_path))
+            else:
+                # 图片已存在，计入成功
+                ctx["images_downloaded"] += 1
+        return pending
+
+    def _plan_attachment_downloads(self, ctx, attachments):
+        """筛选需要下载的附件，返回 [(name, url, path)]；已存在的附件直接计入成功"""
+        ctx["attachments_found"] = len(attachments)
+
+        # 附件也保存在同一个资源文件夹中
+        if not ctx["assets_path"].exists():
+            ctx["assets_path"].mkdir(exist_ok=True)
+
+        pending = []
+        for att in attachments:
+            # WizNote 附件使用 attGuid 字段
+            att_guid = att.get('attGuid')
+            att_name = att.get('name', 'unknown')
+
+            if not att_guid:
+                print(f"    ⚠️  附件缺少 attGuid: {att_name}")
+                ctx["failed_attachments"].append({
+                    "name": att_name,
+                    "reason": "缺少 attGuid",
+                    "note": ctx["safe_title"],
+                    "path": ctx["rel_dir"]
+                })
+                continue
+
+            att_path = ctx["assets_path"] / att_name
+            if self._should_download_asset(ctx["guid"], "attachment", att_name, att_path):
+                att_url = f"{self.kapi_url}/ks/attachment/download/{self.kb_guid}/{ctx['guid']}/{att_guid}"
+                pending.append((att_name, att_url, att_path))
+            else:
+                # 附件已存在，计入成功
+                ctx["attachments_downloaded"] += 1
+        return pending
+
+    def _record_asset_result(self, ctx, kind, name, url, ok):
+        """累计单个图片/附件的下载结果"""
+        if kind == "image":
+            if ok:
+                ctx["images_downloaded"] += 1
+            else:
+                ctx["failed_images"].append({
+                    "name": name,
+                    "url": url,
+                    "note": ctx["safe_title"],
+                    "path": ctx["rel_dir"]
+                })
+        else:
+            if ok:
+                ctx["attachments_downloaded"] += 1
+            else:
+                print(f"    ❌ 附件下载失败: {name}")
+                ctx["failed_attachments"].append({
+                    "name": name,
+                    "url": url,
+                    "note": ctx["safe_title"],
+                    "path": ctx["rel_dir"]
+                })
+
+    def _download_planned_assets(self, ctx, kind, pending, max_workers):
+        """使用线程池并发下载图片/附件"""
+        if not pending:
+            return
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._download_asset, ctx["guid"], kind, name, url, str(path)): (name, url)
+                for name, url, path in pending
+            }
+            # 等待所有下载完成
+            for future in as_completed(futures):
+                name, url = futures[future]
+                self._record_asset_result(ctx, kind, name, url, future.result())
 
-                    # 下载图片（使用线程池并发下载）
-                    resources = self.get_note_resources(note_guid)
-                    images_found = 0
-                    images_downloaded = 0
+    def _is_collaborative_html(self, html_content):
+        """检测是否为协作笔记（通过特征文本判断）"""
+        return any(indicator in html_content for indicator in self.COLLABORATIVE_INDICATORS)
 
-                    if resources:
-                        final_assets_path.mkdir(exist_ok=True)
+    def _fetch_collaboration_note(self, ctx):
+        """
+        通过 WebSocket 获取协作笔记内容（返回 Markdown）并下载其中的图片
 
-                        # 过滤图片文件
-                        image_resources = {
-                            name: url for name, url in resources.items()
-                            if any(name.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg'])
-                        }
+        返回: Markdown 内容；获取失败时返回 None
+        """
+        print(f"    🔄 检测到协作笔记，尝试 WebSocket 获取...")
+
+        collab_markdown, collab_images = self.get_collaboration_content(ctx["guid"])
+        if not collab_markdown:
+            return None
 
-                        images_found = len(image_resources)
-
-                        # 并发下载图片
-                        with ThreadPoolExecutor(max_workers=5) as executor:
-                            futures = {}
-                            for img_name, img_url in image_resources.items():
-                                img_path = final_assets_path / img_name
-                                if not img_path.exists():
-                                    future = executor.submit(self.download_file, img_url, str(img_path))
-                                    futures[future] = (img_name, img_url)
-                                else:
-                                    # 图片已存在，计入成功
-                                    images_downloaded += 1
-
-                            # 等待所有下载完成
-                            for future in as_completed(futures):
-                                img_name, img_url = futures[future]
-                                if future.result():
-                                    images_downloaded += 1
-                                else:
-                                    # 记录失败的图片
-                                    failed_images_list.append({
-                                        "name": img_name,
-                                        "url": img_url,
-                                        "note": safe_title,
-                                        "path": str(output_dir.relative_to(output_base))
-                                    })
-
-                        # 更新 HTML 中的图片路径
-                        html_content = html_content.replace("index_files/", f"{assets_folder_name}/")
-
-                    # 下载附件（使用线程池并发下载）
-                    attachments = self.get_note_attachments(note_guid)
-                    attachments_found = 0
-                    attachments_downloaded = 0
+        print(f"    ✅ 成功获取协作笔记内容（已转为 Markdown）")
 
-                    if attachments:
-                        attachments_found = len(attachments)
-
-                        # 附件也保存在同一个资源文件夹中
-                        if not final_assets_path.exists():
-                            final_assets_path.mkdir(exist_ok=True)
-
-                        # 并发下载附件
-                        with ThreadPoolExecutor(max_workers=3) as executor:
-                            futures = {}
-                            for att in attachments:
-                                # WizNote 附件使用 attGuid 字段
-                                att_guid = att.get('attGuid')
-                                att_name = att.get('name', 'unknown')
-
-                                if not att_guid:
-                                    print(f"    ⚠️  附件缺少 attGuid: {att_name}")
-                                    failed_attachments_list.append({
-                                        "name": att_name,
-                                        "reason": "缺少 attGuid",
-                                        "note": safe_title,
-                                        "path": str(output_dir.relative_to(output_base))
-                                    })
-                                    continue
-
-                                att_path = final_assets_path / att_name
-                                if not att_path.exists():
-                                    att_url = f"{self.kapi_url}/ks/attachment/download/{self.kb_guid}/{note_guid}/{att_guid}"
-                                    future = executor.submit(self.download_file, att_url, str(att_path))
-                                    futures[future] = (att_name, att_url)
-                                else:
-                                    # 附件已存在，计入成功
-                                    attachments_downloaded += 1
-
-                            # 等待所有下载完成
-                            for future in as_completed(futures):
-                                att_name, att_url = futures[future]
-                                if future.result():
-                                    attachments_downloaded += 1
-                                else:
-                                    # 记录失败的附件
-                                    print(f"    ❌ 附件下载失败: {att_name}")
-                                    failed_attachments_list.append({
-                                        "name": att_name,
-                                        "url": att_url,
-                                        "note": safe_title,
-                                        "path": str(output_dir.relative_to(output_base))
-                                    })
+        # 下载协作笔记中的图片
+        if collab_images:
+            note_guid = ctx["guid"]
+            final_assets_path = ctx["assets_path"]
+            final_assets_path.mkdir(exist_ok=True)
 
-            if not html_content:
-                return {"status": "error", "title": safe_title, "error": "无法获取笔记内容"}
-
-            # 检测是否为协作笔记（通过特征文本判断）
-            is_collaborative = False
-            collaborative_indicators = [
-                "当前客户端版本较低，无法编辑协作笔记",
-                "The current client version is too low to edit collaborative notes",
-                "协作笔记",
-                "collaborative notes",
-                "请升级客户端",
-                "upgrade the client"
-            ]
-
-            for indicator in collaborative_indicators:
-                if indicator in html_content:
-                    is_collaborative = True
-                    break
+            ctx["images_found"] = len(collab_images)
+            ctx["images_downloaded"] = 0
 
-            # 如果是协作笔记，尝试通过 WebSocket 获取内容
-            is_collaboration_note = False  # 标记是否成功获取协作笔记
-            if is_collaborative:
-                print(f"    🔄 检测到协作笔记，尝试 WebSocket 获取...")
-
-                # 尝试通过 WebSocket 获取协作笔记内容（返回 Markdown）
-                collab_markdown, collab_images = self.get_collaboration_content(note_guid)
-
-                if collab_markdown:
-                    print(f"    ✅ 成功获取协作笔记内容（已转为 Markdown）")
-                    html_content = collab_markdown  # 虽然变量名叫 html_content，但实际是 Markdown
-                    is_collaboration_note = True  # 标记为协作笔记
-
-                    # 下载协作笔记中的图片
-                    if collab_images:
-                        assets_folder_name = f"{safe_title}_files"
-                        final_assets_path = output_dir / assets_folder_name
-                        final_assets_path.mkdir(exist_ok=True)
-
-                        images_found = len(collab_images)
-                        images_downloaded = 0
-
-                        for img_name, img_info in collab_images.items():
-                            img_path = final_assets_path / img_name
-                            if not img_path.exists():
-                                if self.download_collaboration_image(img_info['url'], img_info['token'], str(img_path)):
-                                    images_downloaded += 1
-                                else:
-                                    failed_images_list.append({
-                                        "name": img_name,
-                                        "url": img_info['url'],
-                                        "note": safe_title,
-                                        "path": str(output_dir.relative_to(output_base))
-                                    })
-                            else:
-                                images_downloaded += 1
-
-                        # 更新 Markdown 中的图片路径（Markdown 格式）
-                        html_content = html_content.replace("index_files/", f"{assets_folder_name}/")
+            pending = []
+            for img_name, img_info in collab_images.items():
+                img_path = final_assets_path / img_name
+                if self._should_download_asset(note_guid, "image", img_name, img_path):
+                    pending.append((img_name, img_info, img_path))
                 else:
-                    # WebSocket 获取失败，记录为协作笔记，稍后手动处理
-                    view_page_url = f"https://as.wiz.cn/note-plus/note/{self.kb_guid}/{note_guid}"
-
-                    # 检测失败原因
-                    failure_reason = "unknown"
-                    if not WEBSOCKET_AVAILABLE:
-                        failure_reason = "missing_dependency"
-
-                    return {
-                        "status": "collaborative",
-                        "title": safe_title,
-                        "note_guid": note_guid,
-                        "view_url": view_page_url,
-                        "path": str(output_dir.relative_to(output_base)),
-                        "images_found": images_found,
-                        "images_downloaded": images_downloaded,
-                        "attachments_found": attachments_found,
-                        "attachments_downloaded": attachments_downloaded,
-                        "failed_images": failed_images_list,
-                        "failed_attachments": failed_attachments_list,
-                        "failure_reason": failure_reason
+                    ctx["images_downloaded"] += 1
+
+            # 并发下载图片（与普通笔记的资源下载一致）
+            if pending:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = {
+                        executor.submit(self._download_collab_image, note_guid, name, info, str(path)): (name, info)
+                        for name, info, path in pending
                     }
+                    for future in as_completed(futures):
+                        name, info = futures[future]
+                        self._record_asset_result(ctx, "image", name, info['url'], future.result())
+
+            # 更新 Markdown 中的图片路径（Markdown 格式）
+            collab_markdown = collab_markdown.replace("index_files/", f"{ctx['assets_folder_name']}/")
+
+        return collab_markdown
+
+    def _download_collab_image(self, note_guid, name, info, output_path):
+        """下载一张协作笔记图片并记录状态"""
+        if self.state is not None:
+            self.state.mark_asset(note_guid, "image", name, "pending")
+        ok = self.download_collaboration_image(info['url'], info['token'], output_path)
+        if ok and self.state is not None:
+            self.state.mark_asset(note_guid, "image", name, "done")
+        return ok
+
+    def _collaborative_failure(self, ctx):
+        """WebSocket 获取失败，记录为协作笔记，稍后手动处理"""
+        view_page_url = f"https://as.wiz.cn/note-plus/note/{self.kb_guid}/{ctx['guid']}"
+
+        # 检测失败原因
+        failure_reason = "unknown"
+        if not WEBSOCKET_AVAILABLE:
+            failure_reason = "missing_dependency"
+
+        return {
+            "status": "collaborative",
+            "title": ctx["safe_title"],
+            "note_guid": ctx["guid"],
+            "view_url": view_page_url,
+            "path": ctx["rel_dir"],
+            "images_found": ctx["images_found"],
+            "images_downloaded": ctx["images_downloaded"],
+            "attachments_found": ctx["attachments_found"],
+            "attachments_downloaded": ctx["attachments_downloaded"],
+            "failed_images": ctx["failed_images"],
+            "failed_attachments": ctx["failed_attachments"],
+            "failure_reason": failure_reason
+        }
+
+    def _error_result(self, ctx, error):
+        return {
+            "status": "error",
+            "title": ctx["safe_title"],
+            "error": error,
+            "note_guid": ctx["guid"],
+            "path": ctx["rel_dir"]
+        }
+
+    def _finalize_note(self, note, ctx, content, is_markdown, attachments):
+        """转换为 Markdown、追加附件链接并写入文件，返回成功结果"""
+        ctx["content"] = content
+        ctx["is_markdown"] = is_markdown
+        ctx["attachments"] = attachments
+        self._convert_note(note, ctx)
+        return self._write_note(ctx)
+
+    # ── 笔记处理的各个阶段（process_note 顺序执行；流水线中各阶段由独立线程池执行） ──
+    # 每个阶段返回 None 表示交给下一阶段，返回结果字典表示该笔记处理结束
+
+    def _fetch_note_body(self, ctx):
+        """阶段 1：获取笔记正文（ZIP 笔记包或 view 接口），结果存入 ctx["content"]"""
+        note_guid = ctx["guid"]
+        html_content = None
+        ctx["needs_assets"] = False
+        ctx["is_markdown"] = ctx["is_lite"]
+
+        # 方法 1: 尝试下载 ZIP（某些笔记支持；Lite/协作笔记没有 ZIP 包，不必探测）
+        if self._should_probe_zip(ctx):
+            download_url = f"{self.kapi_url}/ks/note/download/{self.kb_guid}/{note_guid}"
+            zip_file = self._spool_zip_package(download_url)
+            if zip_file is not None:
+                # ZIP 下载成功
+                with zip_file:
+                    html_content = self._extract_zip_package(ctx, zip_file)
+
+        # 方法 2: 如果 ZIP 失败，使用 view 接口获取正文，资源和附件在下一阶段下载
+        if not html_content:
+            view_url = f"{self.kapi_url}/ks/note/view/{self.kb_guid}/{note_guid}"
+            resp = self._cached_get(view_url, version=ctx["version"],
+                                    timeout=(self.connect_timeout, self.timeout))
+            html_content = self._parse_view_body(ctx["is_lite"], resp.status_code, resp.text)
+            ctx["needs_assets"] = bool(html_content)
+
+        if not html_content:
+            return {"status": "error", "title": ctx["safe_title"], "error": "无法获取笔记内容"}
+        ctx["content"] = html_content
+        return None
 
-            # 转换为 Markdown
-            # 如果是 Lite 笔记或协作笔记，直接使用内容（已经是 Markdown）
-            if is_lite_note or is_collaboration_note:
-                md_content = html_content
-            else:
-                # HTML 笔记需要转换为 Markdown
-                md_content = md(html_content, heading_style="ATX")
-
-            md_content = self.clean_opening_title(md_content, note_title)
-
-            # 添加附件链接（使用相对路径）
-            if attachments_downloaded > 0:
-                md_content += f"\n\n## 📎 附件\n\n"
-                attachments = self.get_note_attachments(note_guid)
-                for att in attachments:
-                    att_name = att.get('name', 'unknown')
-                    md_content += f"- [[{assets_folder_name}/{att_name}|{att_name}]]\n"
-
-            # 写入文件
-            frontmatter = f"---\ntitle: {note_title}\ndate: {note.get('created')}\ntags: {note.get('tags')}\n---\n\n"
-            with open(md_file_path, 'w', encoding='utf-8') as f:
-                f.write(frontmatter + md_content)
-
-            return {
-                "status": "success",
-                "title": safe_title,
-                "images_found": images_found,
-                "images_downloaded": images_downloaded,
-                "attachments_found": attachments_found,
-                "attachments_downloaded": attachments_downloaded,
-                "failed_images": failed_images_list,
-                "failed_attachments": failed_attachments_list
-            }
+    def _fetch_note_assets(self, ctx):
+        """阶段 2：下载图片和附件；协作笔记通过 WebSocket 获取内容"""
+        note_guid = ctx["guid"]
+
+        if ctx["needs_assets"]:
+            # 下载图片（使用线程池并发下载）
+            resources = self._note_listing(ctx, "resources")
+            if resources:
+                pending = self._plan_image_downloads(ctx, resources)
+                self._download_planned_assets(ctx, "image", pending, max_workers=5)
+
+                # 更新 HTML 中的图片路径
+                ctx["content"] = ctx["content"].replace("index_files/", f"{ctx['assets_folder_name']}/")
+
+            # 下载附件（使用线程池并发下载）
+            attachments = self._note_listing(ctx, "attachments")
+            if attachments:
+                pending = self._plan_attachment_downloads(ctx, attachments)
+                self._download_planned_assets(ctx, "attachment", pending, max_workers=3)
+
+        # 如果是协作笔记，尝试通过 WebSocket 获取内容
+        if self._is_collaborative_html(ctx["content"]):
+            collab_markdown = self._fetch_collaboration_note(ctx)
+            if not collab_markdown:
+                return self._collaborative_failure(ctx)
+            ctx["content"] = collab_markdown
+            ctx["is_markdown"] = True
+
+        ctx["attachments"] = []
+        if ctx["attachments_downloaded"] > 0:
+            ctx["attachments"] = self._note_listing(ctx, "attachments")
+        return None
+
+    def _should_probe_zip(self, ctx):
+        """列表元数据表明是 Lite/协作笔记时跳过 ZIP 探测（计入节省的请求）"""
+        if ctx["is_lite"] or ctx["is_collaborative_type"]:
+            self._count_saved_request()
+            return False
+        return True
+
+    def _note_listing(self, ctx, kind):
+        """获取本笔记的资源（resources）或附件（attachments）列表，同一笔记任务内只请求一次"""
+        listings = ctx["listings"]
+        if kind in listings:
+            self._count_saved_request()
+            return listings[kind]
+        if kind == "resources":
+            listings[kind] = self.get_note_resources(ctx["guid"], ctx["version"])
+        else:
+            listings[kind] = self.get_note_attachments(ctx["guid"], ctx["version"])
+        return listings[kind]
+
+    def _count_saved_request(self):
+        with self.lock:
+            self.requests_saved += 1
+
+    def _convert_note(self, note, ctx):
+        """阶段 3：HTML 转 Markdown（CPU 密集），追加附件链接和 frontmatter，结果存入 ctx["markdown"]"""
+        if self.archive is not None:
+            self.archive.record(note, ctx)
+
+        # 如果是 Lite 笔记或协作笔记，直接使用内容（已经是 Markdown）
+        if ctx["is_markdown"]:
+            md_content = ctx["content"]
+        else:
+            # HTML 笔记需要转换为 Markdown（大文档在进程池中转换）
+            md_content, fallback_reason = self.converter.convert(ctx["content"])
+            if fallback_reason:
+                print(f"    ⚠️  {ctx['safe_title']}: {fallback_reason}，已保存为纯文本")
+        ctx["content"] = None  # 正文已不再需要，尽早释放
+
+        md_content = self.clean_opening_title(md_content, ctx["title"])
+
+        # 添加附件链接（使用相对路径）
+        if ctx["attachments_downloaded"] > 0:
+            md_content += f"\n\n## 📎 附件\n\n"
+            for att in ctx["attachments"]:
+                att_name = att.get('name', 'unknown')
+                md_content += f"- [[{ctx['assets_folder_name']}/{att_name}|{att_name}]]\n"
+
+        frontmatter = f"---\ntitle: {ctx['title']}\ndate: {note.get('created')}\ntags: {note.get('tags')}\n---\n\n"
+        ctx["markdown"] = frontmatter + md_content
+        return None
 
+    def _write_note(self, ctx):
+        """阶段 4：原子写入 Markdown 文件，返回成功结果"""
+        self._write_text_atomic(ctx["md_file_path"], ctx.pop("markdown"))
+
+        return {
+            "status": "success",
+            "title": ctx["safe_title"],
+            "md_path": str(ctx["md_file_path"].relative_to(ctx["output_base"])),
+            "images_found": ctx["images_found"],
+            "images_downloaded": ctx["images_downloaded"],
+            "attachments_found": ctx["attachments_found"],
+            "attachments_downloaded": ctx["attachments_downloaded"],
+            "failed_images": ctx["failed_images"],
+            "failed_attachments": ctx["failed_attachments"]
+        }
+
+    def _process_note_internal(self, note, output_base):
+        """内部方法：依次执行各阶段处理笔记"""
+        ctx, early_result = self._prepare_note(note, output_base)
+        if ctx is None:
+            return early_result
+
+        try:
+            result = self._fetch_note_body(ctx) or self._fetch_note_assets(ctx) or self._convert_note(note, ctx)
+            if result:
+                return result
+            return self._write_note(ctx)
         except Exception as e:
-            return {
-                "status": "error",
-                "title": safe_title,
-                "error": str(e),
-                "note_guid": note_guid,
-                "path": str(output_dir.relative_to(output_base))
-            }
+            return self._error_result(ctx, str(e))
 
     def get_all_categories(self):
         """获取所有分类/文件夹列表"""
@@ -884,7 +3126,7 @@ class WizMigrator:
         # 方法 1: /ks/category/all
         try:
             url = f"{self.kapi_url}/ks/category/all/{self.kb_guid}"
-            resp = self.session.get(url, timeout=(self.connect_timeout, self.timeout))
+            resp = self._cached_get(url, timeout=(self.connect_timeout, self.timeout))
             print(f"  🔍 /ks/category/all 响应: HTTP {resp.status_code}")
 
             if resp.status_code == 200:
@@ -899,7 +3141,7 @@ class WizMigrator:
         # 方法 2: /ks/category/list
         try:
             url = f"{self.kapi_url}/ks/category/list/{self.kb_guid}"
-            resp = self.session.get(url, timeout=(self.connect_timeout, self.timeout))
+            resp = self._cached_get(url, timeout=(self.connect_timeout, self.timeout))
             print(f"  🔍 /ks/category/list 响应: HTTP {resp.status_code}")
 
             if resp.status_code == 200:
@@ -916,25 +3158,26 @@ class WizMigrator:
 
     def scan_folder_recursive(self, folder, output_base, all_notes):
         """Recursively scan a folder for notes AND subfolders"""
-        if folder in self.known_folders:
+        with self.listing_lock:
+            if folder in self.known_folders:
+                return
+            self.known_folders.add(folder)
+
+        # 断点续传：已完整扫描过的分类直接使用状态库中的列表
+        if self.resume and self.state is not None and self.state.is_category_scanned(self.kb_guid, folder):
+            print(f"\n📁 跳过（已扫描）: {folder}")
             return
-        self.known_folders.add(folder)
 
         print(f"\n📁 扫描: {folder}")
 
         # 1. Get Notes in this folder
         start = 0
+        complete = False
         while True:
             list_url = f"{self.kapi_url}/ks/note/list/category/{self.kb_guid}"
-            params = {
-                "category": folder,
-                "start": start,
-                "count": 100,
-                "with_abstract": 0,
-                "order": "created-desc"
-            }
+            params = self._note_list_params(folder, start)
             try:
-                resp = self.session.get(list_url, params=params, timeout=(self.connect_timeout, self.timeout))
+                resp = self._cached_get(list_url, params=params, timeout=(self.connect_timeout, self.timeout))
 
                 # 尝试解析 JSON
                 try:
@@ -954,19 +3197,87 @@ class WizMigrator:
                 if not notes:
                     if start == 0:
                         print(f"  ℹ️  此分类无笔记")
+                    complete = True
                     break
 
                 all_notes.extend(notes)
-                print(f"  ✅ 发现 {len(notes)} 个笔记（总计: {len(all_notes)}）")
+                self._get_state().record_listing(self.kb_guid, notes)
+                print(f"  ✅ {folder} 发现 {len(notes)} 个笔记（总计: {len(all_notes)}）")
+                self._dispatch_notes(notes)
 
                 start += len(notes)
-                if len(notes) < 100:
+                if len(notes) < NOTE_LIST_PAGE_SIZE:
+                    complete = True
                     break
             except Exception as e:
                 print(f"  ⚠️  扫描失败: {str(e)}")
                 break
 
+        if complete:
+            self._get_state().mark_category_scanned(self.kb_guid, folder)
+        else:
+            with self.listing_lock:
+                self.listing_errors += 1
+
+    @staticmethod
+    def _note_list_params(folder, start):
+        return {
+            "category": folder,
+            "start": start,
+            "count": NOTE_LIST_PAGE_SIZE,
+            "with_abstract": 0,
+            "order": "created-desc"
+        }
+
+    def select_changed_notes(self, all_notes):
+        """增量同步：根据列表元数据（version/modified）筛选新增或已修改的笔记（按 guid 去重）"""
+        synced = self._get_state().synced_notes(self.kb_guid)
+        return self._new_notes(all_notes, set(), synced=synced)[1]
+
+    def _new_notes(self, notes, seen, finished=None, synced=None):
+        """
+        按 guid 去重并筛选需要处理的笔记，返回 (新出现的笔记数, 需要处理的笔记)
+
+        seen 在多次调用间累积（边扫描边下载时跨分类去重）；finished 为断点续传时已完成的
+        guid，synced 为增量同步时上次同步的状态，两者都为 None 时处理所有新出现的笔记。
+        """
+        listed = 0
+        selected = []
+        for note in notes:
+            guid = DownloadState.note_guid(note)
+            if guid:
+                if guid in seen:
+                    continue
+                seen.add(guid)
+            listed += 1
+            if finished is not None and guid in finished:
+                continue
+            if synced is not None and not self._note_changed(note, synced):
+                continue
+            selected.append(note)
+        return listed, selected
+
+    def _note_changed(self, note, synced):
+        """增量同步：笔记是否新增或自上次同步后被修改（已修改的笔记记入 refresh_guids）"""
+        guid = DownloadState.note_guid(note)
+        row = synced.get(guid)
+        if row is None:
+            return True
+        status, synced_version, synced_modified = row
+        if status not in DownloadState.FINISHED_STATUSES:
+            return True
+        if (synced_version, synced_modified) != DownloadState.note_version(note):
+            self.refresh_guids.add(guid)
+            return True
+        return False
+
     def run(self):
+        if self.engine == "async":
+            if AIOHTTP_AVAILABLE:
+                return AsyncDownloadEngine(self).run()
+            print("⚠️  未安装 aiohttp，--engine async 不可用，改用线程引擎")
+            print("   安装命令: pip3 install aiohttp")
+
         login_result = self.login()
         if isinstance(login_result, tuple):
             login_success, _login_error = login_result
@@ -974,167 +3285,426 @@ class WizMigrator:
             # 兼容旧版返回布尔值的登录实现
             login_success = login_result
 
-        if not login_success:
-            return
+        if not login_success:
+            return
+
+        output_base = self.output_base
+        output_path = self._print_scan_header()
+
+        # 先尝试获取所有分类（断点续传时优先使用已保存的分类列表）
+        categories = self._load_saved_categories()
+        if categories is None:
+            categories = self.get_all_categories()
+            if categories:
+                self._get_state().set_value(f"categories:{self.kb_guid}", categories)
+
+        if categories:
+            # 如果获取到分类列表，扫描每个分类
+            folders = self._category_paths(categories)
+            print(f"\n📂 开始扫描 {len(categories)} 个分类（{self.list_workers} 个分类并发）...\n")
+        else:
+            # 如果获取不到分类，尝试扫描根目录
+            folders = ['/']
+            print("\n⚠️  无法获取分类列表，尝试扫描根目录...\n")
+
+        stages = "、".join(f"{name} {count}" for name, count in self.pipeline_workers.items())
+        print(f"🚀 边扫描边下载（流水线线程: {stages}；全局并发 {self.scheduler.concurrency} 个请求，"
+              f"连接池 {self.scheduler.pool_size}）...\n")
+
+        # 扫描线程发现笔记后立即送入流水线，不必等待所有分类扫描完成
+        start_time = time.time()
+        pipeline = NotePipeline(self, output_base, self.pipeline_workers).start()
+        listed = ListedNoteCounter()
+        try:
+            try:
+                with ThreadPoolExecutor(max_workers=self.list_workers) as lister:
+                    self._begin_stream(pipeline)
+                    if self.resume:
+                        # 断点续传：已扫描分类的笔记来自状态库
+                        self._dispatch_notes(self.state.load_notes(self.kb_guid))
+                    listing = {lister.submit(self.scan_folder_recursive, folder, output_base, listed): folder
+                               for folder in folders}
+                    self._drain_stream(listing)
+            finally:
+                # 无论汇总是否出错，都让流水线处理完已提交的笔记再退出
+                pipeline.close()
+                pipeline.join()
+                self.converter.close()
+        except BaseException:
+            self._close_outputs()
+            raise
+
+        stream, self._stream = self._stream, None
+        total = stream["submitted"]
+        if not self._finish_listing(stream["listed"], total, stream["seen"]):
+            self._close_outputs()
+            return
+
+        self._finish_run(total, start_time, output_path)
+
+    def _begin_stream(self, pipeline):
+        """准备边扫描边下载的共享状态（按 guid 去重、断点续传/增量同步筛选）"""
+        state = self._get_state() if (self.resume or self.incremental) else self.state
+        self._stream = {
+            "pipeline": pipeline,
+            "lock": threading.Lock(),
+            "seen": set(),       # 已出现过的笔记 guid（跨分类去重）
+            "listed": 0,         # 去重后的笔记数
+            "submitted": 0,      # 提交下载的笔记数
+            "finished": state.finished_guids(self.kb_guid) if self.resume else None,
+            "synced": state.synced_notes(self.kb_guid) if self.incremental and not self.resume else None,
+        }
+        if self.resume:
+            self._resume_journal(self._stream["finished"])
+
+    def _dispatch_notes(self, notes):
+        """
+        扫描线程回调：筛选新发现的笔记并立即送入流水线（未在 run 中时不做任何事）
+
+        同一页的笔记按工作量从大到小提交；加密笔记直接给出结果，不占用流水线。
+        """
+        stream = self._stream
+        if stream is None:
+            return
+        with stream["lock"]:
+            listed, selected = self._new_notes(notes, stream["seen"], stream["finished"], stream["synced"])
+            stream["listed"] += listed
+
+        pipeline = stream["pipeline"]
+        weighted, encrypted = self._schedule_notes(selected)
+        with stream["lock"]:
+            stream["submitted"] += len(selected)
+        for note, result in encrypted:
+            self._record_note_state(note, result)
+            pipeline.results.put_nowait(result)
+        for weight, note in weighted:
+            pipeline.submit(note, weight)  # 流水线队列满时在此等待
+
+    def _drain_stream(self, listing):
+        """
+        在主线程中汇总流水线结果，直到所有分类扫描完毕且所有笔记处理完成
+
+        listing 为 {扫描任务: 分类}；扫描任务抛出异常时记为该分类扫描失败（下次 --resume
+        重新扫描、不判定删除），不中断整个下载。
+        """
+        stream = self._stream
+        results = stream["pipeline"].results
+        completed = 0
+        listing_done = False
+        while True:
+            # 先判断扫描是否结束，再读取提交数：扫描结束后不会再有新笔记
+            if not listing_done:
+                listing_done = self._listing_finished(listing)
+            with stream["lock"]:
+                total = stream["submitted"]
+            if listing_done and completed >= total:
+                return
+            try:
+                result = results.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            completed += 1
+            self._handle_result(result, completed, total)
+
+    def _listing_finished(self, listing):
+        """
+        扫描任务（线程池 Future 或 asyncio Task，{任务: 分类}）是否全部结束
+
+        全部结束时把抛出异常的分类记为扫描失败，并打印扫描结果。
+        """
+        if not all(f.done() for f in listing):
+            return False
+        for f, folder in listing.items():
+            error = f.exception()
+            if error is not None:
+                print(f"  ⚠️  扫描失败 {folder}: {error}")
+                with self.listing_lock:
+                    self.listing_errors += 1
+        stream = self._stream
+        print(f"\n📊 扫描完成！发现 {stream['listed']} 个笔记，需下载 {stream['submitted']} 个\n")
+        return True
+
+    def _finish_listing(self, listed, total, seen_guids):
+        """
+        扫描结束后的断点续传/增量同步提示（两种引擎共用）
+
+        listed 为去重后的笔记数，total 为需要处理的笔记数，seen_guids 为列表中出现的全部 guid
+        （增量同步据此判定服务器上已删除的笔记）。返回 False 表示没有需要下载的笔记、无需生成报告。
+        """
+        if self.resume:
+            print(f"\n♻️  断点续传：共 {listed} 个笔记，已完成 {listed - total} 个，本次处理 {total} 个")
+            if listed and not total:
+                print("✅ 所有笔记均已下载完成，无需继续")
+                return False
+        elif self.incremental and listed:
+            last_sync = self._get_state().get_value(f"last_sync:{self.kb_guid}")
+            # 列表不完整时无法判断哪些笔记被删除
+            if self.listing_errors == 0:
+                self.deleted_notes = self._get_state().mark_deleted(self.kb_guid, seen_guids)
+            print(f"\n🔄 增量同步（上次同步: {last_sync['time'] if last_sync else '无'}）：")
+            print(f"   列表中 {listed} 个笔记，新增或已修改 {total} 个，服务器已删除 {len(self.deleted_notes)} 个")
+            if not total:
+                for note in self.deleted_notes:
+                    print(f"   🗑️  已删除: {note['path']}/{note['title']}")
+                print("✅ 自上次同步以来没有新增或修改的笔记")
+                self._save_sync_point(listed)
+                return False
+
+        if not listed:
+            self._print_no_notes()
+            return False
+        return True
+
+    def _print_no_notes(self):
+        print("\n❌ 未发现任何笔记！")
+        print("💡 可能的原因：")
+        print("   1. WizNote 账号中没有笔记")
+        print("   2. API 端点发生变化")
+        print("   3. 需要使用其他 API")
 
+    def _print_scan_header(self):
+        """打印扫描开始信息，返回下载目录的绝对路径"""
         print("\n" + "="*70)
         print("🔍 开始扫描笔记...")
         print("="*70)
 
-        output_base = "wiznote_download"
-        output_path = os.path.abspath(output_base)
+        output_path = os.path.abspath(self.output_base)
         print(f"📁 下载目录: {output_path}\n")
+        return output_path
+
+    def _load_saved_categories(self):
+        """断点续传时返回已保存的分类列表；否则返回 None（需要重新获取）"""
+        if self.resume:
+            categories = self._get_state().get_value(f"categories:{self.kb_guid}")
+            if categories is not None:
+                print(f"♻️  断点续传：使用已保存的分类列表（{len(categories)} 个）")
+            return categories
+        if (Path(self.output_base) / STATE_DB_NAME).exists():
+            # 非续传：重新完整扫描所有分类
+            self._get_state().reset_scanned(self.kb_guid)
+        return None
 
-        # 先尝试获取所有分类
-        categories = self.get_all_categories()
-
-        # 收集所有笔记
-        all_notes = []
+    @staticmethod
+    def _category_paths(categories):
+        """从分类列表中提取分类路径（分类可能是字符串或对象）"""
+        paths = []
+        for category in categories:
+            if isinstance(category, str):
+                # 分类是字符串路径
+                paths.append(category)
+            elif isinstance(category, dict):
+                # 分类是对象
+                cat_path = category.get('key') or category.get('category') or category.get('path')
+                if cat_path:
+                    paths.append(cat_path)
+        return paths
+
+    JOURNAL_KINDS = ("success", "skip", "collaborative", "encrypted")
+
+    def _journal_result(self, result):
+        """把笔记结果写入结果日志（失败的图片/附件由 _handle_result 单独记录）"""
+        kind = result["status"] if result["status"] in self.JOURNAL_KINDS else "error"
+        record = {k: v for k, v in result.items() if k not in ("failed_images", "failed_attachments")}
+        self.results_journal.append(kind, record)
+        # 失败的图片/附件也记下所属笔记，断点续传时随笔记一起保留或丢弃
+        for item in (result.get("failed_images") or []) + (result.get("failed_attachments") or []):
+            item.setdefault("note_guid", result.get("note_guid"))
+
+    def _resume_journal(self, finished):
+        """断点续传：沿用上次结果日志中已完成笔记的记录，报告统计整个导出而不只是本次运行"""
+        journal = self.results_journal
+        self.resumed_notes = journal.carry_over(finished)
+        for kind in ("success", "skip"):
+            for record in journal.iter(kind):
+                self.processed_count += 1
+                if kind == "success":
+                    self.success_count += 1
+                    self.total_images_found += record.get("images_found", 0)
+                    self.total_images_downloaded += record.get("images_downloaded", 0)
+                    self.total_attachments_found += record.get("attachments_found", 0)
+                    self.total_attachments_downloaded += record.get("attachments_downloaded", 0)
+
+    def _handle_result(self, result, completed, total):
+        """汇总单个笔记的处理结果并打印进度"""
+        # 调用进度回调
+        if self.on_progress:
+            try:
+                self.on_progress(completed, total)
+            except:
+                pass  # 忽略回调错误
 
-        if categories:
-            # 如果获取到分类列表，扫描每个分类
-            print(f"\n📂 开始扫描 {len(categories)} 个分类...\n")
-            for category in categories:
-                if isinstance(category, str):
-                    # 分类是字符串路径
-                    self.scan_folder_recursive(category, output_base, all_notes)
-                elif isinstance(category, dict):
-                    # 分类是对象
-                    cat_path = category.get('key') or category.get('category') or category.get('path')
-                    if cat_path:
-                        self.scan_folder_recursive(cat_path, output_base, all_notes)
-        else:
-            # 如果获取不到分类，尝试扫描根目录
-            print("\n⚠️  无法获取分类列表，尝试扫描根目录...\n")
-            self.scan_folder_recursive('/', output_base, all_notes)
-
-        if not all_notes:
-            print("\n❌ 未发现任何笔记！")
-            print("💡 可能的原因：")
-            print("   1. WizNote 账号中没有笔记")
-            print("   2. API 端点发生变化")
-            print("   3. 需要使用其他 API")
+        if result is None:
             return
 
-        print(f"\n{'='*70}")
-        print(f"📊 扫描完成！发现 {len(all_notes)} 个笔记")
-        print(f"{'='*70}")
-        print(f"\n🚀 开始并发下载（{self.max_workers} 个线程）...\n")
+        self._journal_result(result)
+        rate = self.rate_limiter.describe()  # 进度行中显示当前限速
+
+        # 更新计数器（使用锁保护）
+        with self.lock:
+            self.processed_count += 1
+
+            if result["status"] == "skip":
+                print(f"  [{completed}/{total} · {rate}] ⏭️  跳过: {result['title']} (已存在)")
+            elif result["status"] == "success":
+                self.success_count += 1
+
+                # 统计图片
+                images_found = result.get("images_found", 0)
+                images_downloaded = result.get("images_downloaded", 0)
+                self.total_images_found += images_found
+                self.total_images_downloaded += images_downloaded
+
+                # 统计附件
+                attachments_found = result.get("attachments_found", 0)
+                attachments_downloaded = result.get("attachments_downloaded", 0)
+                self.total_attachments_found += attachments_found
+                self.total_attachments_downloaded += attachments_downloaded
+
+                # 记录失败项
+                if result.get("failed_images"):
+                    self.failed_images.extend(result["failed_images"])
+                    if len(result["failed_images"]) > 0:
+                        print(f"    ⚠️  {len(result['failed_images'])} 张图片下载失败")
+                if result.get("failed_attachments"):
+                    self.failed_attachments.extend(result["failed_attachments"])
+
+                info_parts = []
+                if images_downloaded > 0:
+                    info_parts.append(f"{images_downloaded}/{images_found} 张图片")
+                if attachments_downloaded > 0:
+                    info_parts.append(f"{attachments_downloaded}/{attachments_found} 个附件")
+
+                if info_parts:
+                    print(f"  [{completed}/{total} · {rate}] ✅ 成功: {result['title']} ({', '.join(info_parts)})")
+                else:
+                    print(f"  [{completed}/{total} · {rate}] ✅ 成功: {result['title']}")
+            elif result["status"] == "collaborative":
+                # 协作笔记（已写入结果日志），统计其中已下载的图片和附件
+                images_found = result.get("images_found", 0)
+                images_downloaded = result.get("images_downloaded", 0)
+                attachments_found = result.get("attachments_found", 0)
+                attachments_downloaded = result.get("attachments_downloaded", 0)
+
+                self.total_images_found += images_found
+                self.total_images_downloaded += images_downloaded
+                self.total_attachments_found += attachments_found
+                self.total_attachments_downloaded += attachments_downloaded
+
+                # 记录失败项
+                if result.get("failed_images"):
+                    self.failed_images.extend(result["failed_images"])
+                if result.get("failed_attachments"):
+                    self.failed_attachments.extend(result["failed_attachments"])
+
+                print(f"  [{completed}/{total} · {rate}] ⚠️  协作笔记: {result['title']} (需手动处理)")
+            elif result["status"] == "encrypted":
+                # 加密笔记（已写入结果日志）通常没有下载任何资源，但为了完整性也统计
+                images_found = result.get("images_found", 0)
+                images_downloaded = result.get("images_downloaded", 0)
+                attachments_found = result.get("attachments_found", 0)
+                attachments_downloaded = result.get("attachments_downloaded", 0)
+
+                self.total_images_found += images_found
+                self.total_images_downloaded += images_downloaded
+                self.total_attachments_found += attachments_found
+                self.total_attachments_downloaded += attachments_downloaded
+
+                print(f"  [{completed}/{total} · {rate}] 🔒 加密笔记: {result['title']} (需先解密)")
+            else:
+                # 失败的笔记（已写入结果日志）
+                print(f"  [{completed}/{total} · {rate}] ❌ 失败: {result['title']} - {result.get('error', '未知错误')}")
 
-        # 使用线程池并发处理笔记
-        start_time = time.time()
+    def replay(self, archive_path):
+        """
+        离线重放：从 --archive 归档重新执行转换和写入阶段，不登录、不请求服务器
 
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # 提交所有任务
-            futures = {
-                executor.submit(self.process_note, note, output_base): note
-                for note in all_notes
-            }
+        调整 clean_opening_title 或 markdownify 选项后用它重新生成 Markdown。
+        转换全部交给进程池（多核并行），同时在途的笔记数有上限，归档逐批读取。
+        写入 output_base；它不是归档的来源目录且不为空时拒绝重放，避免覆盖其他导出。
+        """
+        if not NoteArchive.exists(archive_path):
+            print(f"❌ 未找到归档: {Path(archive_path) / ARCHIVE_DB_NAME}")
+            return
+        output_path = Path(self.output_base)
+        source = NoteArchive.source_of(archive_path)
+        if (output_path.is_dir() and any(output_path.iterdir())
+                and (source is None or output_path.resolve() != source)):
+            print(f"❌ 输出目录 {output_path} 不为空且不是归档的来源目录（{source or '未知'}），"
+                  f"请改用空目录或该归档的下载目录")
+            return
+        archive = NoteArchive(archive_path)
+        total = archive.count()
+        output_path.mkdir(parents=True, exist_ok=True)
 
-            # 处理完成的任务
-            completed = 0
-            for future in as_completed(futures):
+        self.replaying = True
+        if self.converter.processes > 0:
+            self.converter.inline_size = 0  # 小文档也在子进程中转换，不受 GIL 限制
+        workers = max(self.pipeline_workers["convert"], self.converter.processes * 2, 1)
+        print(f"\n🔁 离线重放 {total} 篇笔记（{archive.root} → {output_path}；"
+              f"{workers} 个线程，{self.converter.processes} 个转换进程）...\n")
+
+        start_time = time.time()
+        completed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for entry in archive.iter_notes():
+                pending.add(executor.submit(self._replay_note, archive, entry))
+                if len(pending) >= workers * PIPELINE_QUEUE_FACTOR:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        completed += 1
+                        self._handle_result(future.result(), completed, total)
+            for future in as_completed(pending):
                 completed += 1
-                result = future.result()
+                self._handle_result(future.result(), completed, total)
+
+        self.converter.close()
+        archive.close()
+        self.replaying = False
+        self._finish_replay(total, start_time, output_path)
+
+    def _replay_note(self, archive, entry):
+        note = entry["note"]
+        ctx, early_result = self._prepare_note(note, self.output_base)
+        if ctx is None:
+            return early_result
+        try:
+            archive.restore_assets(entry["assets"], ctx["assets_path"])
+            extra = entry["extra"]
+            ctx.update({key: extra[key] for key in ARCHIVE_NOTE_FIELDS if key != "attachments"})
+            return self._finalize_note(note, ctx, entry["content"], entry["is_markdown"],
+                                       extra.get("attachments") or [])
+        except Exception as e:
+            return self._error_result(ctx, str(e))
 
-                # 调用进度回调
-                if self.on_progress:
-                    try:
-                        self.on_progress(completed, len(all_notes))
-                    except:
-                        pass  # 忽略回调错误
+    def _finish_replay(self, total, start_time, output_path):
+        elapsed_time = time.time() - start_time
+        note_success_rate = (self.success_count / total * 100) if total > 0 else 0
+        image_success_rate = (self.total_images_downloaded / self.total_images_found * 100) if self.total_images_found > 0 else 0
+        attachment_success_rate = (self.total_attachments_downloaded / self.total_attachments_found * 100) if self.total_attachments_found > 0 else 0
 
-                if result is None:
-                    continue
+        print(f"\n{'='*70}")
+        print(f"🎉 离线重放完成！")
+        print(f"{'='*70}")
+        print(f"  📝 笔记: {self.success_count}/{total} 篇重新生成，失败 {len(self.failed_notes)} 篇")
+        if self.converter.fallbacks:
+            print(f"  ⚠️  保存为纯文本: {self.converter.fallbacks} 篇（HTML 过大或转换超时）")
+        rate = total / elapsed_time if elapsed_time > 0 else 0.0
+        print(f"  ⏱️  耗时: {elapsed_time:.1f} 秒（{rate:.1f} 篇/秒）")
+        print(f"\n📁 输出位置: {output_path}")
 
-                # 更新计数器（使用锁保护）
-                with self.lock:
-                    self.processed_count += 1
-
-                    if result["status"] == "skip":
-                        print(f"  [{completed}/{len(all_notes)}] ⏭️  跳过: {result['title']} (已存在)")
-                    elif result["status"] == "success":
-                        self.success_count += 1
-
-                        # 统计图片
-                        images_found = result.get("images_found", 0)
-                        images_downloaded = result.get("images_downloaded", 0)
-                        self.total_images_found += images_found
-                        self.total_images_downloaded += images_downloaded
-
-                        # 统计附件
-                        attachments_found = result.get("attachments_found", 0)
-                        attachments_downloaded = result.get("attachments_downloaded", 0)
-                        self.total_attachments_found += attachments_found
-                        self.total_attachments_downloaded += attachments_downloaded
-
-                        # 记录失败项
-                        if result.get("failed_images"):
-                            self.failed_images.extend(result["failed_images"])
-                            if len(result["failed_images"]) > 0:
-                                print(f"    ⚠️  {len(result['failed_images'])} 张图片下载失败")
-                        if result.get("failed_attachments"):
-                            self.failed_attachments.extend(result["failed_attachments"])
-
-                        info_parts = []
-                        if images_downloaded > 0:
-                            info_parts.append(f"{images_downloaded}/{images_found} 张图片")
-                        if attachments_downloaded > 0:
-                            info_parts.append(f"{attachments_downloaded}/{attachments_found} 个附件")
-
-                        if info_parts:
-                            print(f"  [{completed}/{len(all_notes)}] ✅ 成功: {result['title']} ({', '.join(info_parts)})")
-                        else:
-                            print(f"  [{completed}/{len(all_notes)}] ✅ 成功: {result['title']}")
-                    elif result["status"] == "collaborative":
-                        # 协作笔记
-                        self.collaborative_notes.append(result)
-
-                        # 统计协作笔记中已下载的图片和附件
-                        images_found = result.get("images_found", 0)
-                        images_downloaded = result.get("images_downloaded", 0)
-                        attachments_found = result.get("attachments_found", 0)
-                        attachments_downloaded = result.get("attachments_downloaded", 0)
-
-                        self.total_images_found += images_found
-                        self.total_images_downloaded += images_downloaded
-                        self.total_attachments_found += attachments_found
-                        self.total_attachments_downloaded += attachments_downloaded
-
-                        # 记录失败项
-                        if result.get("failed_images"):
-                            self.failed_images.extend(result["failed_images"])
-                        if result.get("failed_attachments"):
-                            self.failed_attachments.extend(result["failed_attachments"])
-
-                        print(f"  [{completed}/{len(all_notes)}] ⚠️  协作笔记: {result['title']} (需手动处理)")
-                    elif result["status"] == "encrypted":
-                        # 加密笔记
-                        self.encrypted_notes.append(result)
-
-                        # 加密笔记通常没有下载任何资源，但为了完整性也统计
-                        images_found = result.get("images_found", 0)
-                        images_downloaded = result.get("images_downloaded", 0)
-                        attachments_found = result.get("attachments_found", 0)
-                        attachments_downloaded = result.get("attachments_downloaded", 0)
-
-                        self.total_images_found += images_found
-                        self.total_images_downloaded += images_downloaded
-                        self.total_attachments_found += attachments_found
-                        self.total_attachments_downloaded += attachments_downloaded
-
-                        print(f"  [{completed}/{len(all_notes)}] 🔒 加密笔记: {result['title']} (需先解密)")
-                    else:
-                        # 记录失败的笔记
-                        self.failed_notes.append(result)
-                        print(f"  [{completed}/{len(all_notes)}] ❌ 失败: {result['title']} - {result.get('error', '未知错误')}")
+        self.generate_report(output_path, note_success_rate, image_success_rate, attachment_success_rate)
+        self.results_journal.close()
 
+    def _finish_run(self, total, start_time, output_path):
+        """打印统计信息、生成下载报告并记录同步点"""
         # 计算耗时
         elapsed_time = time.time() - start_time
         minutes, seconds = divmod(int(elapsed_time), 60)
+        total += self.resumed_notes  # 断点续传：统计整个导出，包括上次已完成的笔记
 
         # 计算成功率（协作笔记不计入失败）
-        note_success_rate = (self.success_count / len(all_notes) * 100) if len(all_notes) > 0 else 0
+        note_success_rate = (self.success_count / total * 100) if total > 0 else 0
         image_success_rate = (self.total_images_downloaded / self.total_images_found * 100) if self.total_images_found > 0 else 0
         attachment_success_rate = (self.total_attachments_downloaded / self.total_attachments_found * 100) if self.total_attachments_found > 0 else 0
 
@@ -1143,7 +3713,7 @@ class WizMigrator:
         print(f"{'='*70}")
         print(f"📊 统计信息:")
         print(f"\n  📝 笔记:")
-        print(f"     - 总数: {len(all_notes)} 个")
+        print(f"     - 总数: {total} 个")
         print(f"     - 成功: {self.success_count} 个")
         if len(self.collaborative_notes) > 0:
             print(f"     - 协作笔记: {len(self.collaborative_notes)} 个（需手动处理）")
@@ -1164,14 +3734,55 @@ class WizMigrator:
         print(f"     - 失败: {self.total_attachments_found - self.total_attachments_downloaded} 个")
         print(f"     - 成功率: {attachment_success_rate:.1f}%")
 
+        limiter = self.rate_limiter
+        if limiter.enabled:
+            print(f"\n  🚦 限速:")
+            print(f"     - 当前速率: {limiter.describe()}")
+            print(f"     - 被限流 (429/503): {limiter.throttled} 次，服务器错误 (5xx): {limiter.server_errors} 次")
+            print(f"     - 降速: {limiter.decreases} 次")
+
+        bandwidth = self.bandwidth
+        if bandwidth.enabled:
+            print(f"\n  📶 带宽限制: {bandwidth.describe()}，限速等待 {bandwidth.waited:.1f} 秒")
+
+        if self.requests_saved:
+            print(f"\n  🔁 复用笔记元数据，节省请求: {self.requests_saved} 次")
+
+        if self.archive is not None:
+            print(f"\n  🗃️  原始内容已归档: {self.archive.root}（python3 wiznote_downloader.py --replay 离线重新转换）")
+            self.archive.close()
+            self.archive = None
+
+        cache = self.response_cache
+        if cache is not None:
+            print(f"\n  🗄️  响应缓存: 命中 {cache.hits} 次（{cache.bytes_served / 1024 / 1024:.1f} MB），"
+                  f"未命中 {cache.misses} 次，淘汰 {cache.evicted} 条")
+            cache.close()
+            self.response_cache = None
+
+        store = self.asset_store
+        if store is not None and (store.stored or store.deduped):
+            print(f"\n  🧩 资源存储（{ASSET_STORE_DIR}）:")
+            print(f"     - 新存储: {store.stored} 个文件")
+            print(f"     - 重复资源: {store.deduped} 个（省下 {store.bytes_reused / 1024 / 1024:.1f} MB 存储）")
+
+        collab = self.collab_client
+        if collab is not None:
+            collab.close()
+            self.collab_client = None
+            if collab.reused:
+                print(f"\n  🔗 协作笔记: 建立 WebSocket 连接 {collab.opened} 个，复用连接获取 {collab.reused} 篇")
+
+        self._print_endpoint_timings()
+
         print(f"\n  ⏱️  耗时: {minutes} 分 {seconds} 秒")
         print(f"\n📁 下载位置: {output_path}")
         print(f"\n💡 下一步:")
 
         # 检测协作笔记是否因缺少依赖
-        missing_dependency_notes = [n for n in self.collaborative_notes if n.get('failure_reason') == 'missing_dependency']
-        if missing_dependency_notes:
-            print(f"\n   ⚠️  检测到 {len(missing_dependency_notes)} 个协作笔记因缺少依赖而无法下载！")
+        missing_dependency_count = self._count_missing_dependency()
+        if missing_dependency_count:
+            print(f"\n   ⚠️  检测到 {missing_dependency_count} 个协作笔记因缺少依赖而无法下载！")
             print(f"\n   解决方案：")
             print(f"      pip3 install websocket-client")
             print(f"      # 或")
@@ -1189,11 +3800,66 @@ class WizMigrator:
         print(f"   2. 运行格式化工具优化: python3 tools/obsidian_formatter.py --all")
         print(f"   3. 如需迁移附件: python3 tools/obsidian_formatter.py --migrate-attachments")
 
+        if self.deleted_notes:
+            print(f"\n   🗑️  服务器上已删除 {len(self.deleted_notes)} 个笔记（本地文件未删除，详见下载报告）")
+
         # 生成下载报告
         self.generate_report(output_path, note_success_rate, image_success_rate, attachment_success_rate)
+        self.results_journal.close()
+        self._write_metrics(output_path)
+
+        if self.state is not None and self.listing_errors == 0:
+            self._save_sync_point(total)
+
+        self._close_outputs()
+
+    def _print_endpoint_timings(self):
+        """按累计耗时从高到低列出各接口的请求统计"""
+        endpoints = self.metrics.snapshot()["endpoints"]
+        if not endpoints:
+            return
+        print(f"\n  📈 请求耗时（按接口，详见 {METRICS_JSON_NAME}）:")
+        for name, stats in sorted(endpoints.items(), key=lambda item: -item[1]["latency"]["sum"]):
+            latency = stats["latency"]
+            extra = []
+            if stats["retries"]:
+                extra.append(f"重试 {stats['retries']} 次")
+            if stats["errors"]:
+                extra.append(f"异常 {sum(stats['errors'].values())} 次")
+            suffix = f"，{'，'.join(extra)}" if extra else ""
+            print(f"     - {name}: {stats['count']} 次，累计 {latency['sum']:.1f} 秒，"
+                  f"p50 ≤{(latency['p50'] or 0) * 1000:.0f} ms，p99 ≤{(latency['p99'] or 0) * 1000:.0f} ms，"
+                  f"{stats['bytes'] / 1024 / 1024:.1f} MB{suffix}")
+
+    def _write_metrics(self, output_path):
+        """把请求统计写到下载报告旁边"""
+        try:
+            for path in self.metrics.write(output_path, prometheus=self.metrics_prometheus):
+                print(f"📈 请求统计已保存: {path}")
+        except OSError as e:
+            print(f"⚠️  保存请求统计失败: {e}")
+
+    def _close_outputs(self):
+        """关闭结果日志和状态库（可重复调用；下载中途出错时也会调用）"""
+        self.results_journal.close()
+        if self.state is not None:
+            self.state.close()
+            self.state = None
+            self.asset_store = None
+
+    def _save_sync_point(self, note_count):
+        """记录本知识库的最近一次同步时间，供下次增量同步显示"""
+        self._get_state().set_value(f"last_sync:{self.kb_guid}", {
+            "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "notes": note_count,
+        })
+
+    def _count_missing_dependency(self):
+        """逐行读取结果日志，统计因缺少 websocket-client 而失败的协作笔记数"""
+        return sum(1 for n in self.collaborative_notes if n.get('failure_reason') == 'missing_dependency')
 
     def generate_report(self, output_path, note_success_rate, image_success_rate, attachment_success_rate):
-        """生成详细的下载报告"""
+        """生成详细的下载报告（失败/协作/加密笔记列表从结果日志逐行读取，不在内存中保留）"""
         report_path = Path(output_path) / "download_report.md"
 
         try:
@@ -1233,10 +3899,10 @@ class WizMigrator:
                     f.write(f"共 {len(self.collaborative_notes)} 个协作笔记无法自动下载：\n\n")
 
                     # 检测是否因为缺少依赖
-                    missing_dependency_notes = [n for n in self.collaborative_notes if n.get('failure_reason') == 'missing_dependency']
+                    missing_dependency_count = self._count_missing_dependency()
 
-                    if missing_dependency_notes:
-                        f.write("> ⚠️ **重要提示**：检测到 {0} 个协作笔记因缺少依赖而无法下载。\n\n".format(len(missing_dependency_notes)))
+                    if missing_dependency_count:
+                        f.write("> ⚠️ **重要提示**：检测到 {0} 个协作笔记因缺少依赖而无法下载。\n\n".format(missing_dependency_count))
                         f.write("**解决方案**：\n")
                         f.write("```bash\n")
                         f.write("# 安装 websocket-client 依赖\n")
@@ -1295,6 +3961,20 @@ class WizMigrator:
                     f.write("**💡 提示**：可以批量解密笔记后再运行下载工具，避免重复操作。\n\n")
                     f.write("---\n\n")
 
+                # 服务器上已删除的笔记（增量同步）
+                if self.deleted_notes:
+                    f.write("## 🗑️ 服务器已删除的笔记\n\n")
+                    f.write(f"共 {len(self.deleted_notes)} 个笔记自上次同步后已在 WizNote 中删除，本地文件保留未动：\n\n")
+
+                    for i, note in enumerate(self.deleted_notes, 1):
+                        f.write(f"{i}. **{note['title']}**\n")
+                        f.write(f"   - 笔记 GUID: `{note['note_guid']}`\n")
+                        if note.get('md_path'):
+                            f.write(f"   - 本地文件: `{note['md_path']}`\n")
+                        f.write("\n")
+
+                    f.write("---\n\n")
+
                 # 失败的笔记
                 if self.failed_notes:
                     f.write("## ❌ 失败的笔记\n\n")
@@ -1354,11 +4034,11 @@ class WizMigrator:
 
                     if self.collaborative_notes:
                         # 检测是否因缺少依赖
-                        missing_dep = [n for n in self.collaborative_notes if n.get('failure_reason') == 'missing_dependency']
+                        missing_dep = self._count_missing_dependency()
 
                         if missing_dep:
                             f.write("### 协作笔记（缺少依赖）\n\n")
-                            f.write(f"有 {len(missing_dep)} 个协作笔记因缺少 `websocket-client` 依赖而无法下载。\n\n")
+                            f.write(f"有 {missing_dep} 个协作笔记因缺少 `websocket-client` 依赖而无法下载。\n\n")
                             f.write("**解决步骤**：\n")
                             f.write("```bash\n")
                             f.write("# 1. 安装依赖\n")
@@ -1370,10 +4050,10 @@ class WizMigrator:
                             f.write("3. 重新运行下载工具\n\n")
 
                         # 如果还有其他原因失败的协作笔记
-                        other_collab = [n for n in self.collaborative_notes if n.get('failure_reason') != 'missing_dependency']
+                        other_collab = len(self.collaborative_notes) - missing_dep
                         if other_collab:
                             f.write("### 协作笔记（权限或其他原因）\n\n")
-                            f.write(f"有 {len(other_collab)} 个协作笔记因权限或其他原因无法自动下载。\n\n")
+                            f.write(f"有 {other_collab} 个协作笔记因权限或其他原因无法自动下载。\n\n")
                             f.write("**手动处理方法**：\n")
                             f.write('1. 点击报告中的"在线查看"链接\n')
                             f.write("2. 在浏览器中登录 WizNote 账号\n")
@@ -1403,6 +4083,752 @@ class WizMigrator:
         except Exception as e:
             print(f"\n⚠️  生成报告失败: {str(e)}")
 
+class AsyncNotePipeline:
+    """
+    异步引擎的下载队列，接口与 NotePipeline 相同（submit / results / close / join），
+    _dispatch_notes 据此把扫描到的笔记直接送入事件循环中的下载协程
+
+    - 待下载的笔记按工作量排序：队列中最重的笔记先取出，相同权重按提交顺序
+    - 队列达到上限时扫描协程在 wait_for_room 中等待（背压），内存占用与账号大小无关
+    """
+
+    _STOP = object()
+
+    def __init__(self, engine, workers):
+        self.engine = engine
+        self.workers = max(1, workers)
+        self.maxsize = max(SCHEDULE_WINDOW, self.workers * PIPELINE_QUEUE_FACTOR)
+        self.notes = asyncio.PriorityQueue()
+        self.results = asyncio.Queue()
+        self._order = itertools.count()
+        self._room = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        return self
+
+    def submit(self, note, weight=0):
+        """提交一个笔记，weight 越大越先处理（不阻塞，扫描协程随后在 wait_for_room 中等待）"""
+        self.notes.put_nowait((-weight, next(self._order), note))
+
+    async def wait_for_room(self):
+        while self.notes.qsize() >= self.maxsize:
+            self._room.clear()
+            await self._room.wait()
+
+    def close(self):
+        """不再提交新笔记：下载协程处理完队列中的笔记后退出"""
+        for _ in range(self.workers):
+            self.notes.put_nowait((float("inf"), next(self._order), self._STOP))
+
+    async def join(self):
+        await asyncio.gather(*self._tasks)
+
+    async def _worker(self):
+        m = self.engine.migrator
+        while True:
+            _, _, note = await self.notes.get()
+            self._room.set()
+            if note is self._STOP:
+                return
+            result = await self.engine._process_note(note)
+            m._record_note_state(note, result)
+            self.results.put_nowait(result)
+
+
+class AsyncDownloadEngine:
+    """
+    基于 asyncio + aiohttp 的下载引擎（--engine async）
+
+    登录、分类/笔记列表、笔记正文、资源列表、图片和附件全部在同一个事件循环中完成：
+    - 全局信号量限制同时进行的 HTTP 请求数（--concurrency）；线程池中的 ZIP 解压和协作笔记获取也占用名额
+    - TCPConnector 限制每个主机的连接数（--per-host），连接在所有请求间复用
+    解压、HTML → Markdown 转换和协作笔记（websocket-client 为同步库）放到线程池执行，
+    结果汇总、断点续传、增量同步和报告复用 WizMigrator 的实现。
+    """
+
+    def __init__(self, migrator):
+        self.migrator = migrator
+        self.concurrency = max(1, migrator.concurrency)
+        self.per_host_limit = max(1, migrator.per_host_limit)
+        self.http = None
+        self.semaphore = None
+        self.pipeline = None
+
+    def run(self):
+        return asyncio.run(self._run())
+
+    async def _drain_stream(self, listing):
+        """在事件循环中汇总下载结果（同 WizMigrator._drain_stream），直到扫描结束且所有笔记处理完成"""
+        m = self.migrator
+        stream = m._stream
+        results = stream["pipeline"].results
+        completed = 0
+        listing_done = False
+        while True:
+            if not listing_done:
+                listing_done = m._listing_finished(listing)
+            total = stream["submitted"]
+            if listing_done and completed >= total:
+                return
+            try:
+                result = await asyncio.wait_for(results.get(), 0.2)
+            except asyncio.TimeoutError:
+                continue
+            completed += 1
+            m._handle_result(result, completed, total)
+
+    # ── HTTP ──────────────────────────────────────────────
+
+    def _headers(self, extra=None):
+        headers = dict(self.migrator.session.headers)
+        if extra:
+            headers.update(extra)
+        return headers
+
+    @asynccontextmanager
+    async def _open(self, method, url, **kwargs):
+        """限速排队、占用并发名额后发出请求，并把响应反馈给限速器"""
+        limiter = self.migrator.rate_limiter
+        metrics = self.migrator.metrics
+        await limiter.acquire_async()
+        async with self.semaphore:
+            started = time.monotonic()
+            status, size, error = None, 0, None
+            try:
+                kwargs.setdefault("headers", self._headers())
+                async with self.http.request(method, url, **kwargs) as resp:
+                    status = resp.status
+                    limiter.on_response(resp.status, time.monotonic() - started,
+                                        resp.headers.get("Retry-After"))
+                    try:
+                        yield resp
+                    finally:
+                        size = getattr(resp.content, "total_bytes", 0)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                limiter.on_error()
+                error = type(e).__name__
+                raise
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                metrics.record(metrics.endpoint(url, kwargs.get("params")), status,
+                               time.monotonic() - started, size, error)
+
+    async def _run_blocking(self, func, *args):
+        """在线程池中执行同步的网络/磁盘操作（协作笔记、ZIP 解压），与请求共用全局并发名额"""
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _request(self, method, url, **kwargs):
+        """发送请求并读取完整响应体，返回 (status, body)；被限流时按限速器等待后重试"""
+        m = self.migrator
+        attempt = 0
+        while True:
+            async with self._open(method, url, **kwargs) as resp:
+                status, body = resp.status, await resp.read()
+            if status not in AdaptiveRateLimiter.THROTTLE_STATUSES or attempt >= m.max_retries - 1:
+                return status, body
+            m.metrics.record_retry(m.metrics.endpoint(url, kwargs.get("params")))
+            await asyncio.sleep(m.rate_limiter.retry_delay(attempt))
+            attempt += 1
+
+    async def _cached_request(self, url, params=None, version=None):
+        """GET 只读接口，启用 --http-cache 时先查响应缓存（同 WizMigrator._cached_get）"""
+        cache = self.migrator.response_cache
+        if cache is None:
+            return await self._request("GET", url, params=params)
+        key = ResponseCache.key(url, params)
+        body = cache.get(key, version)
+        if body is not None:
+            return 200, body
+        status, body = await self._request("GET", url, params=params)
+        if ResponseCache.cacheable(status, body):
+            cache.put(key, body, version)
+        return status, body
+
+    async def _get_json(self, url, params=None, version=None):
+        status, body = await self._cached_request(url, params=params, version=version)
+        return status, json.loads(body)
+
+    async def _download_file(self, url, output_path, name=None):
+        """流式下载文件（支持重试、资源存储），与 WizMigrator.download_file 的策略一致"""
+        m = self.migrator
+        store = m._get_asset_store() if name else None
+        download = PartialDownload(output_path, store=store, name=name, state=m.state)
+        for attempt in range(m.max_retries):
+            try:
+                async with self._open("GET", url, headers=self._headers(download.request_headers())) as resp:
+                    if resp.status != 416:
+                        resp.raise_for_status()
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    if not download.begin(resp.status, resp.headers):
+                        raise IncompleteDownloadError("续传范围无效，重新下载")
+                    try:
+                        async for chunk in resp.content.iter_chunked(65536):
+                            download.write(chunk)
+                            await m.bandwidth.acquire_async(len(chunk))
+                        download.finish()
+                    except BaseException:
+                        download.abort()
+                        raise
+                return True
+            except Exception:
+                if attempt < m.max_retries - 1:
+                    m.metrics.record_retry(m.metrics.endpoint(url))
+                    await asyncio.sleep(m.rate_limiter.retry_delay(attempt))
+        return False
+
+    async def _spool_zip_package(self, url):
+        """流式下载 ZIP 笔记包到临时文件，首块不是 PK 时放弃（同 WizMigrator._spool_zip_package）"""
+        async with self._open("GET", url) as resp:
+            if resp.status != 200:
+                return None
+            spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_MEMORY)
+            first = True
+            async for chunk in resp.content.iter_chunked(ZIP_CHUNK_SIZE):
+                if first and not chunk.startswith(b'PK'):
+                    spool.close()
+                    return None
+                first = False
+                spool.write(chunk)
+                await self.migrator.bandwidth.acquire_async(len(chunk))
+        if first:
+            spool.close()
+            return None
+        spool.seek(0)
+        return spool
+
+    async def _download_asset(self, ctx, kind, name, url, path):
+        m = self.migrator
+        if m.state is not None:
+            m.state.mark_asset(ctx["guid"], kind, name, "pending")
+        ok = await self._download_file(url, str(path), name=name)
+        if ok and m.state is not None:
+            m.state.mark_asset(ctx["guid"], kind, name, "done")
+        m._record_asset_result(ctx, kind, name, url, ok)
+
+    # ── 登录与列表 ────────────────────────────────────────
+
+    async def _login(self):
+        m = self.migrator
+        print(f"Logging in as {m.user_id}...")
+        try:
+            async with self._open("POST", f"{AS_URL}/as/user/login", data=m._login_payload()) as resp:
+                data = await resp.json(content_type=None)
+            return m._apply_login_data(data)
+        except Exception as e:
+            print(f"Error during login: {str(e)}")
+            return False, f"登录出错: {str(e)}"
+
+    async def _get_all_categories(self):
+        m = self.migrator
+        print("\n🔍 尝试获取所有分类...")
+        for endpoint in ("all", "list"):
+            try:
+                status, data = await self._get_json(f"{m.kapi_url}/ks/category/{endpoint}/{m.kb_guid}")
+                print(f"  🔍 /ks/category/{endpoint} 响应: HTTP {status}")
+                if status == 200 and (data.get('return_code') == 200 or data.get('returnCode') == 200):
+                    categories = data.get('result', [])
+                    print(f"  ✅ 发现 {len(categories)} 个分类")
+                    return categories
+            except Exception as e:
+                print(f"  ⚠️  /ks/category/{endpoint} 失败: {str(e)}")
+        print("  ❌ 无法获取分类列表")
+        return []
+
+    async def _scan_folder(self, folder, all_notes):
+        """逐页获取一个分类的笔记（各分类之间并发），每页立即送入下载队列"""
+        m = self.migrator
+        if folder in m.known_folders:
+            return
+        m.known_folders.add(folder)
+
+        if m.resume and m.state is not None and m.state.is_category_scanned(m.kb_guid, folder):
+            return
+
+        list_url = f"{m.kapi_url}/ks/note/list/category/{m.kb_guid}"
+        start = 0
+        complete = False
+        while True:
+            try:
+                _status, data = await self._get_json(list_url, params=m._note_list_params(folder, start))
+            except Exception as e:
+                print(f"  ⚠️  扫描失败 {folder}: {str(e)}")
+                break
+
+            code = data.get('return_code', data.get('returnCode'))
+            if code != 200:
+                print(f"  ⚠️  {folder} API 返回错误码: {code}")
+                break
+
+            notes = data.get('result', [])
+            if notes:
+                all_notes.extend(notes)
+                m._get_state().record_listing(m.kb_guid, notes)
+                m._dispatch_notes(notes)
+                await self.pipeline.wait_for_room()  # 下载队列满时暂停扫描
+            start += len(notes)
+            if len(notes) < NOTE_LIST_PAGE_SIZE:
+                complete = True
+                break
+
+        if complete:
+            m._get_state().mark_category_scanned(m.kb_guid, folder)
+            print(f"📁 {folder}: {start} 个笔记（总计: {len(all_notes)}）")
+        else:
+            m.listing_errors += 1
+
+    # ── 单篇笔记 ──────────────────────────────────────────
+
+    async def _process_note(self, note):
+        m = self.migrator
+        loop = asyncio.get_running_loop()
+        ctx, early_result = m._prepare_note(note, m.output_base)
+        if ctx is None:
+            return early_result
+
+        note_guid = ctx["guid"]
+        note_base = f"{m.kapi_url}/ks/note"
+        try:
+            html_content = None
+            attachments = None
+
+            # 方法 1: 尝试下载 ZIP（某些笔记支持；Lite/协作笔记不必探测）
+            if m._should_probe_zip(ctx):
+                zip_file = await self._spool_zip_package(f"{note_base}/download/{m.kb_guid}/{note_guid}")
+                if zip_file is not None:
+                    with zip_file:
+                        html_content = await self._run_blocking(m._extract_zip_package, ctx, zip_file)
+
+            # 方法 2: 使用 view + 资源/附件 API
+            if not html_content:
+                status, body = await self._cached_request(f"{note_base}/view/{m.kb_guid}/{note_guid}",
+                                                          version=ctx["version"])
+                html_content = m._parse_view_body(ctx["is_lite"], status, body.decode('utf-8', errors='ignore'))
+
+                if html_content:
+                    resources, attachments = await asyncio.gather(
+                        self._get_resources(note_guid, ctx["version"]),
+                        self._get_attachments(note_guid, ctx["version"]))
+
+                    downloads = []
+                    if resources:
+                        for name, url, path in m._plan_image_downloads(ctx, resources):
+                            downloads.append(self._download_asset(ctx, "image", name, url, path))
+                        html_content = html_content.replace("index_files/", f"{ctx['assets_folder_name']}/")
+                    if attachments:
+                        for name, url, path in m._plan_attachment_downloads(ctx, attachments):
+                            downloads.append(self._download_asset(ctx, "attachment", name, url, path))
+                    await asyncio.gather(*downloads)
+
+            if not html_content:
+                return {"status": "error", "title": ctx["safe_title"], "error": "无法获取笔记内容"}
+
+            # 协作笔记走同步 WebSocket 实现
+            is_collaboration_note = False
+            if m._is_collaborative_html(html_content):
+                collab_markdown = await self._run_blocking(m._fetch_collaboration_note, ctx)
+                if not collab_markdown:
+                    return m._collaborative_failure(ctx)
+                html_content = collab_markdown
+                is_collaboration_note = True
+
+            if ctx["attachments_downloaded"] > 0:
+                if attachments is None:
+                    attachments = await self._get_attachments(note_guid, ctx["version"])
+                else:
+                    m._count_saved_request()  # 复用下载附件时已获取的附件列表
+
+            return await loop.run_in_executor(
+                None, m._finalize_note, note, ctx, html_content,
+                ctx["is_lite"] or is_collaboration_note, attachments or [])
+
+        except Exception as e:
+            return m._error_result(ctx, str(e))
+
+    async def _get_resources(self, note_guid, version=None):
+        m = self.migrator
+        try:
+            _status, data = await self._get_json(
+                f"{m.kapi_url}/ks/note/download/{m.kb_guid}/{note_guid}", params=RESOURCE_LIST_PARAMS,
+                version=version)
+            return m._parse_resources(data)
+        except Exception:
+            return {}
+
+    async def _get_attachments(self, note_guid, version=None):
+        m = self.migrator
+        try:
+            status, data = await self._get_json(
+                f"{m.kapi_url}/ks/note/attachments/{m.kb_guid}/{note_guid}", params=ATTACHMENT_LIST_PARAMS,
+                version=version)
+            if status != 200:
+                print(f"    ⚠️  附件 API 返回 HTTP {status}")
+                return []
+            return m._parse_attachments(data)
+        except Exception as e:
+            print(f"    ❌ 获取附件失败: {str(e)}")
+            return []
+
+    # ── 主流程 ────────────────────────────────────────────
+
+    async def _run(self):
+        m = self.migrator
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host_limit)
+        timeout = aiohttp.ClientTimeout(sock_connect=m.connect_timeout, sock_read=m.timeout)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+            self.http = http
+
+            login_success, _login_error = await self._login()
+            if not login_success:
+                return
+
+            output_path = m._print_scan_header()
+
+            categories = m._load_saved_categories()
+            if categories is None:
+                categories = await self._get_all_categories()
+                if categories:
+                    m._get_state().set_value(f"categories:{m.kb_guid}", categories)
+
+            folders = m._category_paths(categories) if categories else ['/']
+            print(f"\n📂 并发扫描 {len(folders)} 个分类，边扫描边下载"
+                  f"（全局并发 {self.concurrency}，单主机连接 {self.per_host_limit}）...\n")
+
+            # 与线程引擎相同：扫描到的笔记经 _dispatch_notes 筛选后立即进入下载队列
+            start_time = time.time()
+            self.pipeline = AsyncNotePipeline(self, self.concurrency).start()
+            listed = ListedNoteCounter()
+            try:
+                m._begin_stream(self.pipeline)
+                if m.resume:
+                    # 断点续传：已扫描分类的笔记来自状态库
+                    m._dispatch_notes(m._get_state().load_notes(m.kb_guid))
+                listing = {asyncio.ensure_future(self._scan_folder(folder, listed)): folder
+                           for folder in folders}
+                await self._drain_stream(listing)
+                self.pipeline.close()
+                await self.pipeline.join()
+            except BaseException:
+                m.converter.close()
+                m._close_outputs()
+                raise
+            m.converter.close()
+
+        stream, m._stream = m._stream, None
+        total = stream["submitted"]
+        if not m._finish_listing(stream["listed"], total, stream["seen"]):
+            m._close_outputs()
+            return
+
+        m._finish_run(total, start_time, output_path)
+
+
+class BatchExporter:
+    """
+    批量导出：按清单并行导出多个账号/知识库
+
+    - 每个任务使用独立的 WizMigrator、下载目录和状态库（断点续传、增量同步互不影响）
+    - 所有任务共用一个 ExportBudget：全局在途请求数、自适应限速器和下载带宽，
+      同时导出多个账号不会放大对服务器的压力
+    - 全部结束后在根目录写出汇总报告（batch_report.md / batch_summary.json）
+
+    清单格式（JSON）：
+        {
+          "output": "wiznote_batch",        根目录，每个任务默认导出到 <output>/<name>
+          "parallel": 2,                    同时导出的任务数
+          "concurrency": 16, "rate": 20, "max_rate": 100,
+          "max_bandwidth": 0,               共享带宽上限 MB/s，0 表示不限
+          "defaults": {"workers": 5, "resume": true},
+          "jobs": [
+            {"name": "me", "user_id": "a@example.com", "password_env": "WIZ_PASSWORD_A"},
+            {"name": "team", "user_id": "b@example.com", "password": "...",
+             "kb_guid": "...", "kb_server": "https://...", "output": "team_kb", "workers": 8}
+          ]
+        }
+    """
+
+    # 清单中 defaults / 任务可以设置的下载参数 → WizMigrator 参数名
+    JOB_OPTIONS = {
+        "workers": "max_workers",
+        "retries": "max_retries",
+        "timeout": "timeout",
+        "connect_timeout": "connect_timeout",
+        "resume": "resume",
+        "incremental": "incremental",
+        "pool_size": "pool_size",
+        "list_workers": "list_workers",
+        "convert_workers": "convert_workers",
+        "write_workers": "write_workers",
+        "convert_processes": "convert_processes",
+        "convert_timeout": "convert_timeout",
+        "asset_store": "asset_store",
+        "hardlink_assets": "hardlink_assets",
+        "collab_connections": "collab_connections",
+        "metrics_prometheus": "metrics_prometheus",
+        "archive": "archive",
+        "http_cache": "http_cache",
+        "http_cache_ttl": "http_cache_ttl",
+        "http_cache_size": "http_cache_size",
+    }
+    JOB_FIELDS = {"name", "user_id", "password", "password_env", "kb_guid", "kb_server", "output"}
+    BUDGET_FIELDS = {"output", "parallel", "concurrency", "rate", "max_rate", "max_bandwidth"}
+
+    def __init__(self, jobs, output=DEFAULT_BATCH_OUTPUT, parallel=DEFAULT_BATCH_PARALLEL,
+                 concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, max_rate=DEFAULT_MAX_RATE,
+                 max_bandwidth=0, migrator_class=None):
+        self.jobs = jobs
+        self.output = output
+        self.parallel = max(1, min(parallel, len(jobs) or 1))
+        self.budget = ExportBudget(concurrency=concurrency, rate=rate, max_rate=max_rate,
+                                   max_bandwidth=max_bandwidth)
+        self.migrator_class = migrator_class or WizMigrator
+        self.results = []
+
+    # ── 清单 ──────────────────────────────────────────────
+
+    @classmethod
+    def from_manifest(cls, path, migrator_class=None, **fallback):
+        """读取并校验清单文件，清单未设置的预算参数取 fallback；清单有误时抛出 ValueError"""
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                manifest = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"清单不是有效的 JSON: {e}") from e
+        params = cls.parse_manifest(manifest)
+        for key, value in fallback.items():
+            params.setdefault(key, value)
+        return cls(migrator_class=migrator_class, **params)
+
+    @classmethod
+    def parse_manifest(cls, manifest):
+        """把清单字典转换为构造参数（jobs 为规范化后的任务列表）"""
+        if not isinstance(manifest, dict) or not isinstance(manifest.get("jobs"), list):
+            raise ValueError("清单缺少 jobs 列表")
+        unknown = set(manifest) - cls.BUDGET_FIELDS - {"defaults", "jobs"}
+        if unknown:
+            raise ValueError(f"清单包含未知字段: {', '.join(sorted(unknown))}")
+
+        defaults = manifest.get("defaults") or {}
+        cls._check_options(defaults, "defaults")
+        output = manifest.get("output", DEFAULT_BATCH_OUTPUT)
+
+        jobs, names, outputs = [], set(), set()
+        for index, entry in enumerate(manifest["jobs"], 1):
+            if not isinstance(entry, dict) or not entry.get("user_id"):
+                raise ValueError(f"第 {index} 个任务缺少 user_id")
+            options = {k: v for k, v in entry.items() if k not in cls.JOB_FIELDS}
+            cls._check_options(options, f"任务 {index}")
+
+            name = entry.get("name") or entry["user_id"]
+            if entry.get("kb_guid") and not entry.get("name"):
+                name = f"{name}-{entry['kb_guid'][:8]}"
+            name = re.sub(r'[\\/:*?"<>|\s]+', "_", name).strip("._") or f"job{index}"
+            job_output = str(Path(output) / entry.get("output", name))
+            if name in names:
+                raise ValueError(f"任务名称重复: {name}")
+            if job_output in outputs:
+                raise ValueError(f"任务下载目录重复: {job_output}")
+            names.add(name)
+            outputs.add(job_output)
+
+            merged = dict(defaults)
+            merged.update(options)
+            jobs.append({
+                "name": name,
+                "user_id": entry["user_id"],
+                "password": entry.get("password"),
+                "password_env": entry.get("password_env"),
+                "kb_guid": entry.get("kb_guid"),
+                "kb_server": entry.get("kb_server"),
+                "output": job_output,
+                "options": {cls.JOB_OPTIONS[k]: v for k, v in merged.items()},
+            })
+
+        params = {k: manifest[k] for k in cls.BUDGET_FIELDS if k in manifest}
+        params["jobs"] = jobs
+        return params
+
+    @classmethod
+    def _check_options(cls, options, where):
+        if not isinstance(options, dict):
+            raise ValueError(f"{where} 必须是对象")
+        unknown = set(options) - set(cls.JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"{where} 包含不支持的参数: {', '.join(sorted(unknown))}")
+
+    def resolve_passwords(self, prompt=None):
+        """按 password / password_env 填充密码；都没有时调用 prompt(job) 询问，返回仍缺少密码的任务名"""
+        missing = []
+        for job in self.jobs:
+            if job["password"] is None and job["password_env"]:
+                job["password"] = os.environ.get(job["password_env"])
+            if job["password"] is None and prompt is not None:
+                job["password"] = prompt(job)
+            if job["password"] is None:
+                missing.append(job["name"])
+        return missing
+
+    # ── 运行 ──────────────────────────────────────────────
+
+    def run(self):
+        budget = self.budget
+        print(f"\n🗂️  批量导出 {len(self.jobs)} 个任务（同时 {self.parallel} 个；全局并发 {budget.concurrency} 个请求，"
+              f"限速 {budget.rate_limiter.describe()}，带宽 {budget.bandwidth.describe()}）\n")
+        for job in self.jobs:
+            kb = f"，知识库 {job['kb_guid']}" if job["kb_guid"] else ""
+            print(f"  - {job['name']}: {job['user_id']}{kb} → {job['output']}")
+
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="batch") as pool:
+            self.results = list(pool.map(self._run_job, self.jobs))
+        elapsed = time.time() - started
+
+        summary = self.summarize(self.results, elapsed)
+        self.print_summary(summary)
+        self.write_summary(summary)
+        return summary
+
+    def _run_job(self, job):
+        result = {"name": job["name"], "user_id": job["user_id"], "kb_guid": job["kb_guid"],
+                  "output": job["output"], "status": "ok", "error": None}
+        if job["password"] is None:
+            result.update(status="skipped", error="缺少密码", elapsed=0.0)
+            return result
+
+        options = dict(job["options"])
+        # 多个任务同时转换时平分 CPU，避免每个任务都启动满额的转换进程
+        options.setdefault("convert_processes", max(1, DEFAULT_CONVERT_PROCESSES // self.parallel))
+        started = time.time()
+        migrator = None
+        try:
+            migrator = self.migrator_class(
+                job["user_id"], job["password"], output_base=job["output"], engine="thread",
+                budget=self.budget, kb_guid=job["kb_guid"], kb_server=job["kb_server"], **options)
+            print(f"\n▶️  [{job['name']}] 开始导出")
+            migrator.run()
+            if not migrator.token:
+                result.update(status="login_failed", error="登录失败")
+        except Exception as e:
+            result.update(status="error", error=str(e))
+        result["elapsed"] = time.time() - started
+        if migrator is not None:
+            result.update(self._job_stats(migrator))
+        print(f"\n⏹️  [{job['name']}] 结束（{self.STATUS_LABELS[result['status']]}，{result['elapsed']:.1f} 秒）")
+        return result
+
+    @staticmethod
+    def _job_stats(migrator):
+        totals = migrator.metrics.snapshot()["totals"]
+        return {
+            "notes": migrator.processed_count,
+            "succeeded": migrator.success_count,
+            "failed": len(migrator.failed_notes),
+            "images": migrator.total_images_downloaded,
+            "attachments": migrator.total_attachments_downloaded,
+            "requests": totals["requests"],
+            "bytes": totals["bytes"],
+            "retries": totals["retries"],
+        }
+
+    # ── 汇总 ──────────────────────────────────────────────
+
+    STATUS_LABELS = {"ok": "完成", "login_failed": "登录失败", "error": "出错", "skipped": "跳过"}
+    SUMMED_FIELDS = ("notes", "succeeded", "failed", "images", "attachments", "requests", "bytes", "retries")
+
+    def summarize(self, results, elapsed):
+        for result in results:
+            job_elapsed = result.get("elapsed") or 0.0
+            result["notes_per_sec"] = result.get("notes", 0) / job_elapsed if job_elapsed > 0 else 0.0
+            result["bytes_per_sec"] = result.get("bytes", 0) / job_elapsed if job_elapsed > 0 else 0.0
+        totals = {field: sum(r.get(field, 0) for r in results) for field in self.SUMMED_FIELDS}
+        totals.update(
+            jobs=len(results),
+            completed=sum(1 for r in results if r["status"] == "ok"),
+            elapsed=elapsed,
+            notes_per_sec=totals["notes"] / elapsed if elapsed > 0 else 0.0,
+            bytes_per_sec=totals["bytes"] / elapsed if elapsed > 0 else 0.0,
+        )
+        limiter, bandwidth = self.budget.rate_limiter, self.budget.bandwidth
+        return {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "budget": {
+                "parallel": self.parallel,
+                "concurrency": self.budget.concurrency,
+                "rate": limiter.describe(),
+                "throttled": limiter.throttled,
+                "server_errors": limiter.server_errors,
+                "max_bandwidth": bandwidth.describe(),
+                "bandwidth_wait": round(bandwidth.waited, 3),
+            },
+            "totals": totals,
+            "jobs": results,
+        }
+
+    def print_summary(self, summary):
+        totals = summary["totals"]
+        print(f"\n{'='*70}")
+        print(f"🗂️  批量导出完成: {totals['completed']}/{totals['jobs']} 个任务成功，总耗时 {totals['elapsed']:.1f} 秒")
+        print(f"{'='*70}")
+        for r in summary["jobs"]:
+            line = f"  {'✅' if r['status'] == 'ok' else '❌'} {r['name']}: {self.STATUS_LABELS[r['status']]}"
+            if "notes" in r:
+                line += (f"，笔记 {r['succeeded']}/{r['notes']}，{r['bytes'] / 1024 / 1024:.1f} MB，"
+                         f"{r['elapsed']:.1f} 秒（{r['notes_per_sec']:.1f} 篇/秒）")
+            if r["error"]:
+                line += f" - {r['error']}"
+            print(line)
+        print(f"\n  🚀 总吞吐量: {totals['notes_per_sec']:.1f} 篇/秒，{totals['bytes_per_sec'] / 1024 / 1024:.2f} MB/秒"
+              f"（共 {totals['notes']} 篇，{totals['bytes'] / 1024 / 1024:.1f} MB，{totals['requests']} 次请求）")
+
+    def write_summary(self, summary):
+        root = Path(self.output)
+        try:
+            root.mkdir(parents=True, exist_ok=True)
+            with open(root / BATCH_SUMMARY_NAME, "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            with open(root / BATCH_REPORT_NAME, "w", encoding="utf-8") as f:
+                f.write(self.render_report(summary))
+        except OSError as e:
+            print(f"⚠️  保存批量导出报告失败: {e}")
+            return
+        print(f"\n📄 批量导出报告: {root / BATCH_REPORT_NAME}")
+
+    def render_report(self, summary):
+        totals, budget = summary["totals"], summary["budget"]
+        lines = [
+            "# WizNote 批量导出报告\n",
+            f"> 生成时间: {summary['generated_at'].replace('T', ' ')}\n",
+            "## 📊 汇总\n",
+            f"- 任务: {totals['completed']}/{totals['jobs']} 个成功（同时 {budget['parallel']} 个）",
+            f"- 笔记: {totals['notes']} 个（成功 {totals['succeeded']}，失败 {totals['failed']}）",
+            f"- 图片: {totals['images']} 张，附件: {totals['attachments']} 个",
+            f"- 请求: {totals['requests']} 次（重试 {totals['retries']} 次），数据量 {totals['bytes'] / 1024 / 1024:.1f} MB",
+            f"- 总耗时: {totals['elapsed']:.1f} 秒",
+            f"- 总吞吐量: {totals['notes_per_sec']:.1f} 篇/秒，{totals['bytes_per_sec'] / 1024 / 1024:.2f} MB/秒",
+            f"- 共享预算: 全局并发 {budget['concurrency']}，限速 {budget['rate']}"
+            f"（被限流 {budget['throttled']} 次），带宽 {budget['max_bandwidth']}\n",
+            "## 📋 各任务\n",
+            "| 任务 | 账号 | 状态 | 笔记 | 失败 | 图片 | 附件 | 数据量 | 耗时 | 吞吐量 | 下载目录 |",
+            "|------|------|------|------|------|------|------|--------|------|--------|----------|",
+        ]
+        for r in summary["jobs"]:
+            status = self.STATUS_LABELS[r["status"]] + (f"：{r['error']}" if r["error"] else "")
+            account = r["user_id"] + (f"（{r['kb_guid']}）" if r["kb_guid"] else "")
+            lines.append(
+                f"| {r['name']} | {account} | {status} | {r.get('succeeded', 0)}/{r.get('notes', 0)} | "
+                f"{r.get('failed', 0)} | {r.get('images', 0)} | {r.get('attachments', 0)} | "
+                f"{r.get('bytes', 0) / 1024 / 1024:.1f} MB | {r['elapsed']:.1f} 秒 | "
+                f"{r['notes_per_sec']:.1f} 篇/秒 | `{r['output']}` |")
+        lines.append("\n各任务的详细报告见对应下载目录中的 download_report.md。\n")
+        return "\n".join(lines)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="WizNote to Obsidian - 在线下载工具 v1.1",
@@ -1420,6 +4846,28 @@ if __name__ == "__main__":
 
   # 超级安全模式（网络很差）
   python3 wiznote_downloader.py --workers 2 --timeout 8 --retries 1 --connect-timeout 5
+
+  # 中断后继续（不重新扫描已完成的分类，重做未完成的笔记）
+  python3 wiznote_downloader.py --resume
+
+  # 增量同步（只下载上次同步后新增或修改的笔记）
+  python3 wiznote_downloader.py --incremental
+
+  # 异步引擎（需要 pip3 install aiohttp），大账号吞吐更高
+  python3 wiznote_downloader.py --engine async --concurrency 32 --per-host 16
+
+  # 限速（初始 10 请求/秒，自动提速不超过 40）
+  python3 wiznote_downloader.py --rate 10 --max-rate 40
+
+  # 归档原始内容，之后修改转换逻辑时离线重新生成 Markdown（不再下载）
+  python3 wiznote_downloader.py --archive
+  python3 wiznote_downloader.py --replay --convert-processes 8
+
+  # 反复调整转换参数时缓存列表/正文响应，重复运行不再请求服务器
+  python3 wiznote_downloader.py --http-cache --http-cache-ttl 86400
+
+  # 批量导出多个账号/团队知识库（清单格式见 BatchExporter），共用并发、限速和带宽预算
+  python3 wiznote_downloader.py --batch accounts.json --concurrency 24 --max-bandwidth 20
         """
     )
 
@@ -1427,7 +4875,70 @@ if __name__ == "__main__":
         '--workers', '-w',
         type=int,
         default=DEFAULT_MAX_WORKERS,
-        help=f'并发下载线程数（默认: {DEFAULT_MAX_WORKERS}，推荐: 3-10）'
+        help=f'并发下载线程数，流水线的正文阶段和资源阶段各使用该数量（默认: {DEFAULT_MAX_WORKERS}，推荐: 3-10）'
+    )
+
+    parser.add_argument(
+        '--convert-workers',
+        type=int,
+        default=DEFAULT_CONVERT_WORKERS,
+        help='HTML 转 Markdown 阶段的线程数（默认与 --convert-processes 相同）'
+    )
+
+    parser.add_argument(
+        '--convert-processes',
+        type=int,
+        default=DEFAULT_CONVERT_PROCESSES,
+        help=f'HTML 转 Markdown 的进程数，0 表示在线程内转换（默认: {DEFAULT_CONVERT_PROCESSES}）'
+    )
+
+    parser.add_argument(
+        '--convert-timeout',
+        type=int,
+        default=DEFAULT_CONVERT_TIMEOUT,
+        help=f'单篇笔记转换超时/秒，超时或 HTML 过大时保存为纯文本（默认: {DEFAULT_CONVERT_TIMEOUT}）'
+    )
+
+    parser.add_argument(
+        '--write-workers',
+        type=int,
+        default=DEFAULT_WRITE_WORKERS,
+        help=f'写入 Markdown 文件的线程数（默认: {DEFAULT_WRITE_WORKERS}）'
+    )
+
+    parser.add_argument(
+        '--list-workers',
+        type=int,
+        default=DEFAULT_LIST_WORKERS,
+        help=f'同时扫描的分类数，扫描到的笔记立即开始下载（默认: {DEFAULT_LIST_WORKERS}）'
+    )
+
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f'全局同时进行的 HTTP 请求数，笔记/图片/附件共用（默认: {DEFAULT_CONCURRENCY}）'
+    )
+
+    parser.add_argument(
+        '--pool-size',
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help='线程引擎的 HTTP 连接池大小（默认与 --concurrency 相同）'
+    )
+
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=DEFAULT_RATE,
+        help=f'初始请求速率/每秒，按服务器反馈（429/5xx、Retry-After、延迟）自动升降，0 表示不限速（默认: {DEFAULT_RATE}）'
+    )
+
+    parser.add_argument(
+        '--max-rate',
+        type=float,
+        default=DEFAULT_MAX_RATE,
+        help=f'自动提速的上限/每秒（默认: {DEFAULT_MAX_RATE}）'
     )
 
     parser.add_argument(
@@ -1451,15 +4962,168 @@ if __name__ == "__main__":
         help=f'连接超时时间/秒（默认: {DEFAULT_CONNECT_TIMEOUT}，推荐: 5-15）'
     )
 
+    parser.add_argument(
+        '--engine',
+        choices=['thread', 'async'],
+        default='thread',
+        help='下载引擎：thread（线程池，默认）或 async（asyncio + aiohttp，单事件循环）；两者都边扫描边下载'
+    )
+
+    parser.add_argument(
+        '--per-host',
+        type=int,
+        default=DEFAULT_PER_HOST_LIMIT,
+        help=f'async 引擎每个主机的最大连接数（默认: {DEFAULT_PER_HOST_LIMIT}）'
+    )
+
+    parser.add_argument(
+        '--collab-connections',
+        type=int,
+        default=DEFAULT_COLLAB_CONNECTIONS,
+        help=f'协作笔记保持的 WebSocket 连接数，连接在笔记之间复用（默认: {DEFAULT_COLLAB_CONNECTIONS}）'
+    )
+
+    parser.add_argument(
+        '--metrics-prometheus',
+        action='store_true',
+        help=f'除 {METRICS_JSON_NAME} 外，再以 Prometheus 文本格式写出 {METRICS_PROM_NAME}'
+    )
+
+    parser.add_argument(
+        '--archive',
+        nargs='?',
+        const=True,
+        metavar='DIR',
+        help=f'归档转换前的原始正文和资源文件，之后可用 --replay 离线重新转换'
+             f'（默认位置: 下载目录/{ARCHIVE_DIR_NAME}）'
+    )
+
+    parser.add_argument(
+        '--replay',
+        nargs='?',
+        const=str(Path(DEFAULT_OUTPUT_BASE) / ARCHIVE_DIR_NAME),
+        metavar='DIR',
+        help='离线重放：从 --archive 归档重新转换并写入 Markdown，不登录、不下载'
+    )
+
+    parser.add_argument(
+        '--replay-output',
+        metavar='DIR',
+        help='离线重放的输出目录（默认: 归档的来源下载目录）；不是来源目录时必须为空'
+    )
+
+    parser.add_argument(
+        '--http-cache',
+        nargs='?',
+        const=True,
+        metavar='PATH',
+        help=f'缓存分类、笔记列表、正文和资源/附件列表响应，重复运行时从本地读取'
+             f'（默认位置: 下载目录/{HTTP_CACHE_NAME}）'
+    )
+
+    parser.add_argument(
+        '--http-cache-ttl',
+        type=int,
+        default=DEFAULT_HTTP_CACHE_TTL,
+        help=f'分类和笔记列表缓存的有效期/秒；正文和资源/附件列表按笔记版本校验（默认: {DEFAULT_HTTP_CACHE_TTL}）'
+    )
+
+    parser.add_argument(
+        '--http-cache-size',
+        type=int,
+        default=DEFAULT_HTTP_CACHE_SIZE,
+        help=f'响应缓存大小上限/MB，超出后淘汰最久未使用的条目（默认: {DEFAULT_HTTP_CACHE_SIZE}）'
+    )
+
+    parser.add_argument(
+        '--max-bandwidth',
+        type=float,
+        default=0,
+        help='图片/附件/笔记包下载的带宽上限 MB/秒，批量导出时所有任务共用，0 表示不限（默认: 0）'
+    )
+
+    parser.add_argument(
+        '--batch',
+        metavar='MANIFEST',
+        help='批量导出：按 JSON 清单并行导出多个账号/知识库，共用 --concurrency/--rate/--max-bandwidth 预算'
+    )
+
+    parser.add_argument(
+        '--parallel',
+        type=int,
+        default=DEFAULT_BATCH_PARALLEL,
+        help=f'批量导出时同时进行的任务数，清单中的 parallel 优先（默认: {DEFAULT_BATCH_PARALLEL}）'
+    )
+
+    parser.add_argument(
+        '--no-asset-store',
+        action='store_true',
+        help=f'不使用资源存储（{ASSET_STORE_DIR}），每个笔记的图片/附件单独下载保存'
+    )
+
+    parser.add_argument(
+        '--hardlink-assets',
+        action='store_true',
+        help='文件系统不支持 reflink 时用硬链接代替复制放置重复资源（省空间，但各笔记共用同一个文件，'
+             '修改一处会影响所有笔记）'
+    )
+
+    parser.add_argument(
+        '--incremental', '-i',
+        action='store_true',
+        help='增量同步：只下载上次同步后新增或修改的笔记，并报告服务器上已删除的笔记'
+    )
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help=f'断点续传：使用下载目录中的状态库（{STATE_DB_NAME}），跳过已扫描的分类和已完成的笔记'
+    )
+
     args = parser.parse_args()
 
+    if args.replay:
+        if args.archive:
+            parser.error("--replay 不能与 --archive 同时使用")
+        output_base = args.replay_output
+        if output_base is None:
+            if not NoteArchive.exists(args.replay):
+                print(f"❌ 未找到归档: {Path(args.replay) / ARCHIVE_DB_NAME}")
+                sys.exit(1)
+            output_base = NoteArchive.source_of(args.replay) or DEFAULT_OUTPUT_BASE
+        WizMigrator(
+            None, None,
+            output_base=str(output_base),
+            convert_workers=args.convert_workers,
+            write_workers=args.write_workers,
+            convert_processes=args.convert_processes,
+            convert_timeout=args.convert_timeout
+        ).replay(args.replay)
+        sys.exit(0)
+
+    if args.batch:
+        try:
+            exporter = BatchExporter.from_manifest(
+                args.batch, parallel=args.parallel, concurrency=args.concurrency,
+                rate=args.rate, max_rate=args.max_rate, max_bandwidth=args.max_bandwidth)
+        except (OSError, ValueError) as e:
+            print(f"❌ 无法读取批量导出清单 {args.batch}: {e}")
+            sys.exit(1)
+        exporter.resolve_passwords(
+            prompt=lambda job: getpass.getpass(f"🔑 {job['name']} ({job['user_id']}) 密码: "))
+        exporter.run()
+        sys.exit(0)
+
     print("=" * 70)
     print("WizNote to Obsidian - 在线下载工具 v1.1")
     print("=" * 70)
     print("\n📥 此工具将从 WizNote 云端下载笔记并转换为 Markdown 格式")
     print("📁 默认下载目录: ./wiznote_download/")
     print("🖼️  图片和附件: 支持自动下载（使用增强版 API）")
-    print(f"⚡ 性能优化: 并发下载，{args.workers} 个线程同时处理")
+    if args.engine == 'async':
+        print(f"⚡ 性能优化: 异步引擎，全局并发 {args.concurrency}，单主机连接 {args.per_host}")
+    else:
+        print(f"⚡ 性能优化: 并发下载，{args.workers} 个线程同时处理，全局并发 {args.concurrency} 个请求")
     print(f"⚙️  参数配置: 超时 {args.timeout}s, 重试 {args.retries}次, 连接超时 {args.connect_timeout}s\n")
     print("-" * 70)
 
@@ -1472,6 +5136,28 @@ if __name__ == "__main__":
         max_workers=args.workers,
         max_retries=args.retries,
         timeout=args.timeout,
-        connect_timeout=args.connect_timeout
+        connect_timeout=args.connect_timeout,
+        resume=args.resume,
+        incremental=args.incremental,
+        engine=args.engine,
+        concurrency=args.concurrency,
+        per_host_limit=args.per_host,
+        pool_size=args.pool_size,
+        rate=args.rate,
+        max_rate=args.max_rate,
+        list_workers=args.list_workers,
+        convert_workers=args.convert_workers,
+        write_workers=args.write_workers,
+        convert_processes=args.convert_processes,
+        convert_timeout=args.convert_timeout,
+        asset_store=not args.no_asset_store,
+        hardlink_assets=args.hardlink_assets,
+        collab_connections=args.collab_connections,
+        metrics_prometheus=args.metrics_prometheus,
+        max_bandwidth=args.max_bandwidth,
+        http_cache=args.http_cache,
+        http_cache_ttl=args.http_cache_ttl,
+        http_cache_size=args.http_cache_size,
+        archive=args.archive
     )
     migrator.run()